@@ -1,364 +1,908 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, has_request_context
 from flask_cors import CORS
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
 import psycopg2
+from psycopg2 import errors
 import os
 import json
+import random
 import re
-from decimal import Decimal
-from datetime import datetime, timedelta, date
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, date
 from dotenv import load_dotenv
 import logging
-
-logging.basicConfig(level=logging.DEBUG)
+from db import ConnectionPool, PoolTimeout, ReplicaRouter
+from nl_cache import NLSQLCache, normalize_question
+from result_cache import ResultCache
+from kpi_store import KPIStore
+from concurrency import Bulkhead, Overloaded, StageTimeout
+from pagination import ROW_ID_COLUMN, decode_page_token, next_page_token, page_query
+from llm import LLMStats, stream_completion
+from date_phrases import preprocess_question
+from fast_path import match_question
+from schema_cache import SchemaCache
+from sql_pipeline import (UnsafeSQL, combine_aggregates, enforce_limit, extract_sql, parameterize, parse_cache_stats,
+                          prepare_sql)
+from statements import StatementCache
+from index_advisor import IndexAdvisor
+from metrics import CONTENT_TYPE, Registry
+from serialization import FastJSONProvider, dumps_columnar, dumps_row
+from chart import ChartBuilder
+from query_guard import QueryCancelled, QueryGuard, QueryRejected
+from spool import RowSpool
+from coalesce import SingleFlight
 
 load_dotenv()
 
+
+# Tags every log line with the id of the request that produced it
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = g.get('request_id', '-') if has_request_context() else '-'
+        return True
+
+
+# LOG_LEVEL=DEBUG adds the full prompt, raw Claude response and SQL text of every request;
+# the AWS SDK stays at AWS_LOG_LEVEL so botocore doesn't log every HTTP exchange
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RequestIdFilter())
+for noisy in ('boto3', 'botocore', 's3transfer', 'urllib3'):
+    logging.getLogger(noisy).setLevel(os.getenv('AWS_LOG_LEVEL', 'WARNING').upper())
+log = logging.getLogger('sqlapp')
+slow_query_log = logging.getLogger('sqlapp.slow_query')
+
+# Database calls slower than SLOW_QUERY_MS are counted; SLOW_QUERY_SAMPLE_RATE of them are logged
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '1000'))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_SAMPLE_RATE', '0.25'))
+
 app = Flask(__name__)
-CORS(app)
+app.json = FastJSONProvider(app)
+CORS(app, expose_headers=['X-Request-ID', 'Server-Timing'])
+
+# Prometheus metrics for GET /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram('sqlapp_stage_duration_seconds', 'Time spent in each request pipeline stage',
+                                  ('stage',))
+request_seconds = metrics.histogram('sqlapp_request_duration_seconds', 'Time to response headers per endpoint',
+                                    ('endpoint', 'status'))
+ask_paths = metrics.counter('sqlapp_ask_sql_source_total', 'Where /ask got its SQL (rules, cache or llm)', ('path',))
+slow_queries = metrics.counter('sqlapp_slow_queries_total', 'Database calls slower than SLOW_QUERY_MS')
+
+# Per-upstream concurrency limits: requests beyond max concurrency queue briefly, then get a 429
+bedrock_bulkhead = Bulkhead.from_env('bedrock', max_concurrent=8, max_waiting=32, wait_timeout=10)
+
+BEDROCK_MODEL_ID = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-v2')
+# Stream Claude's output and stop reading once the SQL statement is complete
+BEDROCK_STREAMING = os.getenv('BEDROCK_STREAMING', '1') == '1'
+llm_stats = LLMStats()
 
 # AWS Bedrock client
 bedrock = boto3.client(
     service_name='bedrock-runtime',
     region_name=os.getenv('AWS_REGION'),
     aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-)
-
-# PostgreSQL connection
-def get_pg_connection():
-    return psycopg2.connect(
-        host=os.getenv('PG_HOST'),
-        port=os.getenv('PG_PORT'),
-        database=os.getenv('PG_DB'),
-        user=os.getenv('PG_USER'),
-        password=os.getenv('PG_PASSWORD')
+    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+    config=Config(
+        connect_timeout=float(os.getenv('BEDROCK_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.getenv('BEDROCK_TIMEOUT', '30')),
+        retries={'max_attempts': int(os.getenv('BEDROCK_MAX_ATTEMPTS', '2'))},
+        max_pool_connections=bedrock_bulkhead.max_concurrent
     )
+)
 
-# Replace relative phrases like "last month", "this year"
-def replace_relative_dates(question):
-    today = datetime.today()
-
-    first_of_this_month = today.replace(day=1)
-    last_day_of_last_month = first_of_this_month - timedelta(days=1)
-    first_day_of_last_month = last_day_of_last_month.replace(day=1)
-
-    last_year = today.year - 1
-    start_of_last_year = datetime(last_year, 1, 1)
-    end_of_last_year = datetime(last_year, 12, 31)
-
-    start_of_this_year = datetime(today.year, 1, 1)
-    end_of_this_year = datetime(today.year, 12, 31)
-
-    start_of_this_week = today - timedelta(days=today.weekday())
-    start_of_last_week = start_of_this_week - timedelta(days=7)
-    end_of_last_week = start_of_this_week - timedelta(days=1)
-    end_of_this_week = start_of_this_week + timedelta(days=6)
-
-    replacements = [
-        (r'\b(last month|from last month)\b',
-         f"between '{first_day_of_last_month.strftime('%Y-%m-%d')}' and '{last_day_of_last_month.strftime('%Y-%m-%d')}'"),
-        (r'\b(this month|from this month)\b',
-         f"between '{first_of_this_month.strftime('%Y-%m-%d')}' and '{(first_of_this_month.replace(month=first_of_this_month.month % 12 + 1, day=1) - timedelta(days=1)).strftime('%Y-%m-%d')}'"),
-        (r'\b(last year|from last year|policies from last year)\b',
-         f"between '{start_of_last_year.strftime('%Y-%m-%d')}' and '{end_of_last_year.strftime('%Y-%m-%d')}'"),
-        (r'\b(this year|from this year)\b',
-         f"between '{start_of_this_year.strftime('%Y-%m-%d')}' and '{end_of_this_year.strftime('%Y-%m-%d')}'"),
-        (r'\b(last week|from last week)\b',
-         f"between '{start_of_last_week.strftime('%Y-%m-%d')}' and '{end_of_last_week.strftime('%Y-%m-%d')}'"),
-        (r'\b(this week|from this week)\b',
-         f"between '{start_of_this_week.strftime('%Y-%m-%d')}' and '{end_of_this_week.strftime('%Y-%m-%d')}'")
-    ]
-
-    for pattern, replacement in replacements:
-        question = re.sub(pattern, replacement, question, flags=re.IGNORECASE)
-
-    return question
-
-# Replace "in May", "from April", etc.
-def replace_month_names(question):
-    months = {
-        'january': 1, 'february': 2, 'march': 3, 'april': 4,
-        'may': 5, 'june': 6, 'july': 7, 'august': 8,
-        'september': 9, 'october': 10, 'november': 11, 'december': 12
-    }
-
-    today = datetime.today()
-    current_year = today.year
-
-    for month_name, month_num in months.items():
-        # Case: "in April 2024" / "from May 2023"
-        pattern_explicit_year = rf'\b(in|from)\s+{month_name}\s+(\d{{4}})\b'
-        match = re.search(pattern_explicit_year, question, flags=re.IGNORECASE)
-        if match:
-            year = int(match.group(2))
-            first_day = datetime(year, month_num, 1)
-            last_day = (datetime(year, month_num + 1, 1) - timedelta(days=1)) if month_num < 12 else datetime(year, 12, 31)
-            date_range = f"effective_date BETWEEN '{first_day.strftime('%Y-%m-%d')}' AND '{last_day.strftime('%Y-%m-%d')}'"
-            question = re.sub(pattern_explicit_year, date_range, question, flags=re.IGNORECASE)
-            continue
-
-        # Case: "April last year"
-        pattern_last_year = rf'\b{month_name}\s+last\s+year\b'
-        if re.search(pattern_last_year, question, flags=re.IGNORECASE):
-            year = current_year - 1
-            first_day = datetime(year, month_num, 1)
-            last_day = (datetime(year, month_num + 1, 1) - timedelta(days=1)) if month_num < 12 else datetime(year, 12, 31)
-            date_range = f"effective_date BETWEEN '{first_day.strftime('%Y-%m-%d')}' AND '{last_day.strftime('%Y-%m-%d')}'"
-            question = re.sub(pattern_last_year, date_range, question, flags=re.IGNORECASE)
-            continue
-
-        # Case: "April this year"
-        pattern_this_year = rf'\b{month_name}\s+this\s+year\b'
-        if re.search(pattern_this_year, question, flags=re.IGNORECASE):
-            year = current_year
-            first_day = datetime(year, month_num, 1)
-            last_day = (datetime(year, month_num + 1, 1) - timedelta(days=1)) if month_num < 12 else datetime(year, 12, 31)
-            date_range = f"effective_date BETWEEN '{first_day.strftime('%Y-%m-%d')}' AND '{last_day.strftime('%Y-%m-%d')}'"
-            question = re.sub(pattern_this_year, date_range, question, flags=re.IGNORECASE)
-            continue
-
-        # FINAL Case: "in April" / "from April" → all years → EXTRACT(MONTH FROM effective_date) = 4
-        pattern_generic = rf'\b(in|from)\s+{month_name}\b'
-        if re.search(pattern_generic, question, flags=re.IGNORECASE):
-            # Only match if no explicit year is present anywhere in the question
-            if not re.search(r'\b\d{4}\b', question):
-                month_filter = f"EXTRACT(MONTH FROM effective_date) = {month_num}"
-                question = re.sub(pattern_generic, month_filter, question, flags=re.IGNORECASE)
-                continue
-
-    return question
-
-
-# Final preprocessor combining both
-def preprocess_question(question):
-    question = replace_month_names(question)
-    question = replace_relative_dates(question)
-    return question
+# PostgreSQL connection pool (sized via PG_POOL_* in .env), shared by every route
+pg_pool = ConnectionPool.from_env()
+
+# Read replicas (PG_REPLICA_* in .env) for /ask, /filters and /kpis reads; the primary when there are
+# none, when they lag or while they fail. Background jobs and writes stay on pg_pool.
+db_router = ReplicaRouter.from_env(pg_pool)
+db_router.start()
+db_bulkhead = Bulkhead.from_env('db', max_concurrent=db_router.capacity(), max_waiting=64, wait_timeout=5)
+
+# Question -> generated SQL cache (NL_CACHE_* in .env), consulted before calling Bedrock
+nl_sql_cache = NLSQLCache.from_env()
+
+# Server-side prepared statements per pooled connection (PG_PREPARED_STATEMENTS per connection, 0 = off)
+statement_cache = StatementCache.from_env()
+
+# Query shapes and timings behind the /indexes/advice suggestions (migrations/003_policy_indexes.sql)
+index_advisor = IndexAdvisor.from_env(pg_pool)
+
+# EXPLAIN-based admission, per-request statement timeouts and cancellation of superseded or
+# abandoned queries (ADMISSION_* and ASK_STATEMENT_TIMEOUT_MS in .env)
+query_guard = QueryGuard.from_env()
+
+# Executed-SQL result cache (RESULT_CACHE_* in .env), invalidated when insurance_policies changes
+result_cache = ResultCache.from_env(pg_pool)
+
+# Precomputed KPI aggregates (migrations/002_kpi_daily.sql), refreshed every KPI_REFRESH_INTERVAL seconds
+kpi_store = KPIStore.from_env(pg_pool)
+kpi_store.start()
+
+# Live table columns and value sets for the Claude prompt, refreshed every SCHEMA_REFRESH_INTERVAL seconds
+schema_cache = SchemaCache.from_env(pg_pool)
+schema_cache.load()
+schema_cache.start()
+
+# Rule-based NL -> SQL for common question shapes (fast_path.py); anything it isn't sure about goes to Bedrock
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', '1') == '1'
+
+# Chart series for chart questions: at most CHART_MAX_POINTS line points and CHART_MAX_CATEGORIES bars/slices
+chart_builder = ChartBuilder.from_env()
+
+# Identical concurrent work runs once and every caller gets the result (single-flight): Claude calls
+# by normalized question, database reads by SQL and parameters (/ask and /filters), and /kpis
+sql_flight = SingleFlight('bedrock')
+query_flight = SingleFlight('db', retry_on=(QueryCancelled,))
+kpi_flight = SingleFlight('kpis')
+flights = (sql_flight, query_flight, kpi_flight)
+
+# Hard cap on rows returned by /ask; larger results are truncated (or paged when streaming)
+ASK_MAX_ROWS = int(os.getenv('ASK_MAX_ROWS', '10000'))
+STREAM_ITERSIZE = int(os.getenv('STREAM_ITERSIZE', '500'))
+
+# /ask/batch: questions per call, and Claude calls / queries each batch runs at once
+BATCH_MAX_QUESTIONS = int(os.getenv('BATCH_MAX_QUESTIONS', '20'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+# Gauges and counters read from the components' own stats() at scrape time
+def _pool_metrics():
+    pool = pg_pool.stats()
+    return [(('in_use',), pool['inUse']), (('idle',), pool['idle']), (('waiting',), pool['waiting'])]
+
+def _bulkhead_metrics(key):
+    return lambda: [((b.name,), b.stats()[key]) for b in (bedrock_bulkhead, db_bulkhead)]
+
+def _cache_metrics():
+    nl, results, statements = nl_sql_cache.stats(), result_cache.stats(), statement_cache.stats()
+    return [(('nl_sql', 'hit'), nl['hits'] + nl['similarHits']), (('nl_sql', 'miss'), nl['misses']),
+            (('result', 'hit'), results['hits']), (('result', 'miss'), results['misses']),
+            (('prepared_statement', 'hit'), statements['hits']),
+            (('prepared_statement', 'miss'), statements['prepared'])]
+
+metrics.collected('sqlapp_db_pool_connections', 'Pooled PostgreSQL connections by state', _pool_metrics, ('state',))
+metrics.collected('sqlapp_upstream_active', 'Requests currently using each upstream',
+                  _bulkhead_metrics('active'), ('upstream',))
+metrics.collected('sqlapp_upstream_waiting', 'Requests queued for each upstream',
+                  _bulkhead_metrics('waiting'), ('upstream',))
+metrics.collected('sqlapp_upstream_rejected_total', 'Requests turned away with a 429 (queue full or wait timeout)',
+                  lambda: [((b.name,), b.stats()['rejected'] + b.stats()['timedOut'])
+                           for b in (bedrock_bulkhead, db_bulkhead)], ('upstream',), kind='counter')
+metrics.collected('sqlapp_admission_total', 'Generated queries by EXPLAIN admission decision',
+                  lambda: [((decision,), query_guard.stats()[key]) for decision, key in
+                           (('admitted', 'admitted'), ('auto_limited', 'autoLimited'), ('rejected', 'rejected'))],
+                  ('decision',), kind='counter')
+metrics.collected('sqlapp_queries_cancelled_total', 'Backend queries cancelled, by reason',
+                  lambda: [((reason,), count) for reason, count in sorted(query_guard.stats()['cancelled'].items())],
+                  ('reason',), kind='counter')
+metrics.collected('sqlapp_db_routed_total', 'Read queries routed to each database node',
+                  lambda: [((node['name'],), node['routed']) for node in db_router.stats()['nodes']],
+                  ('node',), kind='counter')
+metrics.collected('sqlapp_db_outstanding', 'Queries currently running on each database node',
+                  lambda: [((node['name'],), node['outstanding']) for node in db_router.stats()['nodes']], ('node',))
+metrics.collected('sqlapp_db_replica_lag_seconds', 'Replica replay lag at the last check',
+                  lambda: [((node['name'],), node['lagSeconds']) for node in db_router.stats()['nodes']
+                           if node['lagSeconds'] is not None], ('node',))
+metrics.collected('sqlapp_db_failovers_total', 'Reads sent to the primary instead of a replica, by reason',
+                  lambda: [((reason,), count) for reason, count in sorted(db_router.stats()['failovers'].items())],
+                  ('reason',), kind='counter')
+metrics.collected('sqlapp_coalesced_requests_total', 'Requests that shared an identical in-flight call instead of making their own',
+                  lambda: [((flight.name,), flight.stats()['coalesced']) for flight in flights], ('call',), kind='counter')
+metrics.collected('sqlapp_cache_lookups_total', 'Cache lookups by cache and outcome', _cache_metrics,
+                  ('cache', 'result'), kind='counter')
+
+# Times one pipeline stage into sqlapp_stage_duration_seconds and the response's Server-Timing header
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage)
+        if has_request_context():
+            spans = g.setdefault('spans', {})
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+# Counts database calls over SLOW_QUERY_MS and logs a sample of them. The SQL is parameterized,
+# so only the number of bind values is logged, not the values themselves.
+def note_slow_query(sql, params, db_ms, row_count):
+    if db_ms < SLOW_QUERY_MS:
+        return
+    slow_queries.inc()
+    if random.random() < SLOW_QUERY_SAMPLE_RATE:
+        slow_query_log.warning("[Slow Query] %.1f ms, %s rows, %d params: %s",
+                               db_ms, row_count, len(params or ()), sql)
+
+QueryResult = namedtuple('QueryResult', ['columns', 'rows', 'cached', 'db_ms', 'truncated'])
+
+# How a query is guarded: EXPLAIN admission, its statement_timeout (None = PG_STATEMENT_TIMEOUT_MS)
+# and the session/ticket a newer question cancels it by
+DBGuard = namedtuple('DBGuard', ['admit', 'timeout_ms', 'session_id', 'ticket'])
+NO_GUARD = DBGuard(False, None, None, None)
+
+def client_disconnected():
+    return request.environ.get('waitress.client_disconnected') if has_request_context() else None
+
+# QueryCanceled from Postgres: our own cancel (superseded / client gone) or the statement timeout
+def cancelled_error(in_flight, e):
+    if in_flight is not None and in_flight.reason:
+        return QueryCancelled(in_flight.reason)
+    query_guard.record_timeout()
+    return StageTimeout("db", "PostgreSQL query exceeded the statement timeout")
+
+# Run a read query through the result cache, reading at most `max_rows` rows. Rows past
+# RESULT_SPILL_ROWS go to a temp file (a RowSpool is returned instead of a list).
+# Concurrent calls for the same query share one execution; a waiter whose leader was cancelled
+# (superseded in the leader's session, or its client went away) runs the query itself.
+def run_query(sql, params=None, max_rows=ASK_MAX_ROWS, guard=NO_GUARD):
+    key = (sql, tuple(params or ()), max_rows, guard.admit, guard.timeout_ms)
+    result, _ = query_flight.do(key, lambda: execute_query(sql, params, max_rows, guard), share=share_rows)
+    return result
+
+def share_rows(result):
+    if isinstance(result.rows, RowSpool):
+        result.rows.share()
+
+def execute_query(sql, params=None, max_rows=ASK_MAX_ROWS, guard=NO_GUARD):
+    started = time.perf_counter()
+    with span('result_cache'):
+        hit, token = result_cache.lookup(sql, params)
+    if hit is not None:
+        columns, rows, truncated = hit
+        return QueryResult(columns, rows, True, round((time.perf_counter() - started) * 1000, 2), truncated)
+
+    in_flight = None
+
+    def fetch(conn):
+        nonlocal in_flight
+        run_sql, limit = sql, max_rows
+        with query_guard.timeout(conn, guard.timeout_ms), conn.cursor() as cur, \
+                query_guard.running(conn, guard.session_id, guard.ticket, client_disconnected()) as in_flight:
+            if guard.admit:
+                with span('admission'):
+                    auto_limit = query_guard.admit(conn, cur, run_sql, params)
+                if auto_limit is not None:
+                    log.info("[Admission] Auto-limited to %d rows", auto_limit)
+                    run_sql, limit = enforce_limit(run_sql, auto_limit + 1), min(limit, auto_limit)
+            statement_cache.execute(conn, cur, run_sql, params)
+            rows = RowSpool.from_env()
+            while len(rows) < limit:
+                batch = cur.fetchmany(min(STREAM_ITERSIZE, limit - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            truncated = len(rows) == limit and cur.fetchone() is not None
+            return run_sql, [desc[0] for desc in cur.description], rows, truncated
 
-# Claude prompt builder
+    try:
+        with span('db'), db_bulkhead.slot():
+            (sql, columns, rows, truncated), node = db_router.read(fetch)
+    except errors.QueryCanceled as e:
+        raise cancelled_error(in_flight, e) from e
+
+    if not rows.spilled:
+        rows = rows.head
+        # Results read on a replica that was behind could be stored under the primary's newer
+        # table versions, so only the primary's and caught-up replicas' results are cached
+        if node is db_router.primary or node.lag == 0:
+            result_cache.store(token, columns, (rows, truncated))
+    db_ms = round((time.perf_counter() - started) * 1000, 2)
+    index_advisor.record(sql, db_ms)
+    note_slow_query(sql, params, db_ms, len(rows))
+    return QueryResult(columns, rows, False, db_ms, truncated)
+
+# Row tuple -> JSON-ready dict, with effective_date rendered as YYYY-MM-DD
+def row_to_dict(columns, row):
+    row_dict = dict(zip(columns, row))
+    if isinstance(row_dict.get('effective_date'), (datetime, date)):
+        row_dict['effective_date'] = row_dict['effective_date'].strftime('%Y-%m-%d')
+    return row_dict
+
+# row_to_dict for a whole result, checking for effective_date once instead of per row
+def rows_to_dicts(columns, rows):
+    result = [dict(zip(columns, row)) for row in rows]
+    if 'effective_date' in columns:
+        for row_dict in result:
+            value = row_dict['effective_date']
+            if isinstance(value, (datetime, date)):
+                row_dict['effective_date'] = value.strftime('%Y-%m-%d')
+    return result
+
+# format=columnar responses: {"columns": [...], "data": [[...], ...]} straight from the row tuples,
+# with NUMERIC values as JSON numbers and dates as ISO strings
+def columnar_response(payload):
+    return Response(dumps_columnar(payload), mimetype='application/json')
+
+# The same JSON bodies for a spilled RowSpool, encoded one batch at a time as the response is
+# written ("result" or "data" comes last); the temp file is removed when the response closes
+def spilled_response(payload, columns, rows, columnar):
+    if columnar:
+        head, key = dumps_columnar({**payload, "columns": columns}).decode()[:-1], "data"
+    else:
+        head, key = app.json.dumps(payload)[:-1], "result"
+
+    def generate():
+        try:
+            yield f'{head},"{key}":['
+            for i, batch in enumerate(rows.batches(STREAM_ITERSIZE)):
+                if columnar:
+                    chunk = b",".join(dumps_row(row) for row in batch)
+                else:
+                    chunk = ",".join(app.json.dumps(row) for row in rows_to_dicts(columns, batch)).encode()
+                yield b"," + chunk if i else chunk
+            yield "]}\n"
+        finally:
+            rows.close()
+
+    return Response(generate(), mimetype='application/json')
+
+# Stream one page of `sql` as NDJSON from a server-side cursor.
+#
+# Lines: {"sql", "columns"} first, then one object per row (an array with columnar=True),
+# then {"done", "count", "nextPage"}.
+# The query is opened before the response starts so pool/backpressure errors still get a
+# proper status code; the cursor and connection are released when the response closes.
+def stream_rows(sql, page_size, after_key=None, offset=0, on_first_batch=None, query_params=None, columnar=False,
+                guard=NO_GUARD):
+    paged_sql, params = page_query(sql, page_size, after_key=after_key, offset=offset, params=query_params)
+    resources = ExitStack()
+    started = time.perf_counter()
+    in_flight = None
+    try:
+        with span('db'):
+            resources.enter_context(db_bulkhead.slot())
+            # A replica that fails before the first batch is read hands the page to the primary
+            for node in db_router.route(read_only=True):
+                try:
+                    with ExitStack() as attempt:
+                        conn = attempt.enter_context(db_router.connection(node))
+                        # Held until the response closes, so a newer question also stops a stream in progress
+                        in_flight = attempt.enter_context(
+                            query_guard.running(conn, guard.session_id, guard.ticket, client_disconnected()))
+                        attempt.enter_context(query_guard.timeout(conn, guard.timeout_ms))
+                        if guard.admit:
+                            with conn.cursor() as plain, span('admission'):
+                                query_guard.admit(conn, plain, paged_sql, params, can_limit=False)
+                        cur = attempt.enter_context(conn.cursor(name=f"ask_stream_{uuid.uuid4().hex}"))
+                        cur.itersize = STREAM_ITERSIZE
+                        cur.execute(paged_sql, params)
+                        batch = cur.fetchmany(STREAM_ITERSIZE)
+                        columns = [desc[0] for desc in cur.description]
+                        resources.enter_context(attempt.pop_all())
+                    break
+                except Exception as e:
+                    if not db_router.failover(node, e):
+                        raise
+    except errors.QueryCanceled as e:
+        resources.close()
+        raise cancelled_error(in_flight, e) from e
+    except BaseException:
+        resources.close()
+        raise
+
+    note_slow_query(paged_sql, params, (time.perf_counter() - started) * 1000, len(batch))
+    if on_first_batch:
+        on_first_batch()
+
+    # Keyset pages end with the row's ctid, which only the next-page token needs
+    row_columns = columns
+    keyed = columns[-1:] == [ROW_ID_COLUMN]
+    if keyed:
+        columns = columns[:-1]
+
+    def generate(batch):
+        yield app.json.dumps({"sql": sql, "params": query_params, "columns": columns}) + "\n"
+        count = 0
+        last_row = None
+        has_more = False
+        try:
+            while batch:
+                for row in batch:
+                    if count == page_size:
+                        has_more = True
+                        break
+                    last_row = row
+                    if keyed:
+                        row = row[:-1]
+                    if columnar:
+                        yield dumps_row(row) + b"\n"
+                    else:
+                        yield app.json.dumps(row_to_dict(columns, row)) + "\n"
+                    count += 1
+                if has_more:
+                    break
+                if in_flight.reason:
+                    yield app.json.dumps({"error": "Query cancelled", "reason": in_flight.reason}) + "\n"
+                    return
+                batch = cur.fetchmany(STREAM_ITERSIZE)
+        except Exception as e:
+            if in_flight.reason:
+                yield app.json.dumps({"error": "Query cancelled", "reason": in_flight.reason}) + "\n"
+                return
+            log.error("[Stream Error] %s", e)
+            yield app.json.dumps({"error": "PostgreSQL query failed", "details": str(e)}) + "\n"
+            return
+
+        next_page = next_page_token(sql, row_columns, last_row, page_size, offset, query_params) if has_more else None
+        yield app.json.dumps({"done": True, "count": count, "nextPage": next_page}) + "\n"
+
+    response = Response(generate(batch), mimetype='application/x-ndjson')
+    response.call_on_close(resources.close)
+    return response
+
+# Claude prompt builder: the schema part is rendered once by the schema cache
 def build_prompt(user_question):
-    return f"""
-Human: You are a SQL assistant. Convert the following natural language question into a SQL query for a PostgreSQL database.
-Only return the SQL query. Do not explain anything.
+    return schema_cache.build_prompt(user_question)
+
+# Prompt Claude via Bedrock and clean the returned text down to a single executable query.
+# Returns (sql, llm_timings).
+def generate_sql(question):
+    # Build Claude prompt
+    with span('prompt'):
+        prompt = build_prompt(question)
+    log.debug("[Claude Prompt]\n%s", prompt)
+
+    # Invoke Claude API to get SQL
+    body = json.dumps({
+        "prompt": prompt,
+        "max_tokens_to_sample": 500,
+        "temperature": 0.2,
+        "stop_sequences": ["\n\nHuman:"]
+    })
 
-The table is called 'insurance_policies' and has the following columns:
-- policy_number (TEXT)
-- effective_date (DATE; when the policy was issued)
-- transaction_type (TEXT; e.g. New, Endorsement)
-- insured_state (TEXT; two-letter US state abbreviation)
-- coverage (TEXT)
-- limit (NUMERIC; represents the coverage limit in dollars)
-- gross_premium (NUMERIC; represents the total premium in dollars)
+    log.debug("[Claude API Request Body]\n%s", body)
 
-When interpreting phrases like 'above 100000' or 'greater than 1000', apply the correct SQL numeric comparison operators (e.g., '>' for above, '<' for below).
+    try:
+        with bedrock_bulkhead.slot(), span('bedrock'):
+            if BEDROCK_STREAMING:
+                response_body, llm_timings = stream_completion(bedrock, BEDROCK_MODEL_ID, body, stats=llm_stats)
+            else:
+                started = time.perf_counter()
+                response = bedrock.invoke_model(
+                    modelId=BEDROCK_MODEL_ID,
+                    contentType='application/json',
+                    accept='application/json',
+                    body=body
+                )
+                response_body = json.loads(response['body'].read())['completion']
+                llm_timings = {"totalMs": round((time.perf_counter() - started) * 1000, 2)}
+    except (ConnectTimeoutError, ReadTimeoutError) as e:
+        raise StageTimeout("bedrock", "Claude did not respond in time") from e
+    log.debug("[Claude Raw Response Body]\n%s", response_body)
+
+    with span('sql'):
+        sql = extract_sql(response_body)
+        log.debug("[Original Generated SQL]\n%s", sql)
+
+        # One parse: read-only/table checks, "limit" quoting, sargable EXTRACT(YEAR) and the FROM/SINCE range
+        open_ended_from = bool(re.search(r'\b(from|since)\s+\w+\s+\d{4}\b', question, re.IGNORECASE))
+        sql = prepare_sql(sql, open_ended_from=open_ended_from)
+    log.debug("[Generated SQL]\n%s", sql)
+
+    return sql, llm_timings
+
+
+# Request ids: a well-formed X-Request-ID from the caller (or proxy) is kept, otherwise one is made up
+REQUEST_ID_PATTERN = re.compile(r'^[\w.\-]{1,64}$')
+
+@app.before_request
+def start_request():
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex[:16]
+    g.started = time.perf_counter()
+    g.spans = {}
+
+
+@app.after_request
+def finish_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if endpoint != '/metrics':
+        request_seconds.observe(time.perf_counter() - g.started, endpoint, str(response.status_code))
+    response.headers['X-Request-ID'] = g.request_id
+    if g.spans:
+        response.headers['Server-Timing'] = ', '.join(f"{stage};dur={seconds * 1000:.1f}"
+                                                      for stage, seconds in g.spans.items())
+    return response
 
-When filtering text columns like 'coverage' or 'insured_state', use case-insensitive comparison (e.g., ILIKE instead of =).
 
-Ensure you generate valid SQL for numeric fields like 'limit' and 'gross_premium'.
+@app.route("/")
+def home():
+    return "<h3>Claude SQL API is running. Send a POST to /ask</h3>"
 
-Use proper PostgreSQL syntax and avoid line breaks or comments.
+# Steps 0-2 of /ask: the preprocessed question and SQL from the local rules or the NL cache
+# (sql is None when Claude has to write it)
+SQLLookup = namedtuple('SQLLookup', ['question', 'sql', 'params', 'path', 'sql_cache'])
 
-If the question mentions "no filter" for a column, do not add any WHERE clause for that column.
+def lookup_sql(question):
+    # Step 0: Preprocess relative date phrases
+    with span('preprocess'):
+        question = preprocess_question(question)
+    log.debug("[Preprocessed Question] %s", question)
 
-Do not invent or assume transaction_type values. Only use known values: New, Renewal, Endorsement, Reinstate, Cancellation, Audit.
+    # Step 1: Answer common question shapes with parameterized SQL from local rules
+    with span('fast_path'):
+        fast = match_question(question) if FAST_PATH_ENABLED else None
+    if fast is not None:
+        log.debug("[Fast Path (%s)] %s %s", fast.intent, fast.sql, fast.params)
+        return SQLLookup(question, fast.sql, fast.params, "rules", None)
 
-Question: {user_question}
-Assistant:
-"""
+    # Step 2: Reuse SQL generated for the same (or a near-identical) question
+    with span('nl_cache'):
+        sql, sql_cache = nl_sql_cache.get(question)
+    if sql is not None:
+        log.debug("[NL Cache Hit (%s)] %s", sql_cache, sql)
+    return SQLLookup(question, sql, None, "cache", sql_cache)
 
-@app.route("/")
-def home():
-    return "<h3>Claude SQL API is running. Send a POST to /ask</h3>"
 
 @app.route("/ask", methods=["POST"])
 def ask():
     data = request.json
     question = data.get("question")
-
-    print(f"[Incoming Request] Question: {question}")
+    stream = bool(data.get("stream"))
+    columnar = data.get("format") == "columnar"
+    chart_only = bool(data.get("chartOnly"))
+    page_size = min(int(data.get("pageSize") or ASK_MAX_ROWS), ASK_MAX_ROWS)
+    timeout_ms = query_guard.ask_timeout(data.get("timeoutMs"))
+
+    # Continuing a streamed result: the signed token carries the SQL, so Bedrock is skipped. The
+    # signature is not trusted on its own: the SQL is validated and admitted like a new question's.
+    if data.get("nextPage"):
+        try:
+            page = decode_page_token(data["nextPage"])
+            page_sql = prepare_sql(page["sql"])
+        except UnsafeSQL as e:
+            log.warning("[Rejected SQL] Page token: %s", e)
+            return jsonify({"error": "Page token SQL was rejected", "details": str(e)}), 400
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({"error": str(e) or "Malformed page token"}), 400
+        return stream_rows(page_sql, page_size, after_key=page.get("after"), offset=page.get("offset", 0),
+                           query_params=page.get("params"), columnar=columnar,
+                           guard=DBGuard(True, timeout_ms, None, None))
+
+    log.info("[Incoming Request] Question: %s", question)
 
     if not question:
-        print("[Error] Missing 'question' in request body")
+        log.warning("[Error] Missing 'question' in request body")
         return jsonify({"error": "Missing 'question' in request body"}), 400
 
-    # Step 0: Preprocess relative date phrases
-    question = preprocess_question(question)
-    print(f"[Preprocessed Question] {question}")
-
-    # Step 1: Build Claude prompt
-    prompt = build_prompt(question)
-    print(f"[Claude Prompt]\n{prompt}")
-
-    # Step 2: Invoke Claude API to get SQL
+    # A new question from the same voice session cancels that session's query still in flight
+    session_id = data.get("sessionId") or request.headers.get("X-Session-ID")
+    ticket = query_guard.begin(session_id) if session_id else None
+
+    # Steps 0-2: preprocess, then local rules or the NL cache
+    question, sql, sql_params, path, sql_cache = lookup_sql(question)
+    llm_timings = None
+
+    # Step 3: Otherwise build the Claude prompt and invoke Claude API to get SQL
+    if sql is None:
+        path = "llm"
+        try:
+            (sql, llm_timings), _ = sql_flight.do(normalize_question(question), lambda: generate_sql(question))
+
+        except (Overloaded, StageTimeout, QueryRejected, QueryCancelled):
+            raise
+        except UnsafeSQL as e:
+            log.warning("[Rejected SQL] %s", e)
+            return jsonify({"error": "Generated SQL was rejected", "details": str(e)}), 400
+        except Exception as e:
+            log.exception("[Claude API Error] %s", e)
+            return jsonify({"error": "Claude API failed", "details": str(e)}), 500
+    ask_paths.inc(path)
+    # Rule-based SQL has known shapes; anything Claude wrote is EXPLAINed before it runs
+    guard = DBGuard(path != "rules", timeout_ms, session_id, ticket)
+
+    # Step 4: Execute SQL on PostgreSQL
     try:
-        body = json.dumps({
-            "prompt": prompt,
-            "max_tokens_to_sample": 500,
-            "temperature": 0.2,
-            "stop_sequences": ["\n\nHuman:"]
-        })
-
-        print(f"[Claude API Request Body]\n{body}")
-
-        response = bedrock.invoke_model(
-            modelId='anthropic.claude-v2',
-            contentType='application/json',
-            accept='application/json',
-            body=body
-        )
-
-        response_body = response['body'].read().decode('utf-8')
-        print(f"[Claude Raw Response Body]\n{response_body}")
-
-        sql_start = response_body.lower().find("select")
-        if sql_start == -1:
-            print(f"[Error] No SQL query found in Claude response.\nResponse Body: {response_body}")
-            raise ValueError("No SQL query found in response.")
-
-        sql_section = response_body[sql_start:]
-
-        # Stop at the first semicolon OR double newline OR 'stop_reason'
-        sql_only = re.split(r'(;|\n\n|stop_reason)', sql_section)[0].strip()
-
-        # Remove trailing commentary after FROM/GROUP BY queries
-        sql_only = re.split(r'(?:This|Note|Explanation|The result|You can use)', sql_only, flags=re.IGNORECASE)[0].strip()
+        log.debug("[Executing SQL]\n%s", sql)
+
+        # Streaming mode: rows go out as NDJSON while the server-side cursor reads them
+        if stream:
+            def remember_sql():
+                if path == "llm":
+                    nl_sql_cache.put(question, sql)
+
+            return stream_rows(sql, page_size, on_first_batch=remember_sql, query_params=sql_params,
+                               columnar=columnar, guard=guard)
+
+        # Generated SQL runs with its literals as bind parameters, so each question shape is prepared once
+        with span('sql'):
+            if sql_params is None:
+                exec_sql, exec_params = parameterize(enforce_limit(sql, ASK_MAX_ROWS + 1))
+            else:
+                exec_sql, exec_params = enforce_limit(sql, ASK_MAX_ROWS + 1), sql_params
+        columns, rows, result_cached, db_ms, truncated = run_query(exec_sql, exec_params, guard=guard)
+        result = []
+        # Spilled results are encoded from the temp file as the response is written
+        spilled = isinstance(rows, RowSpool)
 
-        # Clean escaped characters
-        sql = sql_only.replace('\\n', ' ').replace('\\t', ' ').strip('",` ')
+        with span('serialize'):
+            # Columnar responses send the row tuples as they are
+            if not columnar and not spilled:
+                # ✅ CASE 1: Scalar result (e.g., SELECT COUNT(*), SUM(...), AVG(...))
+                if len(columns) == 1 and len(rows) == 1:
+                    result.append({columns[0]: rows[0][0]})
 
-        # Quote reserved keywords like 'limit'
-        # Quote 'limit' if used as a column but not in LIMIT clause
-        sql = re.sub(
-            r'(?<!\bLIMIT\s)\blimit\b(?!\s*\d)', 
-            '"limit"', 
-            sql, 
-            flags=re.IGNORECASE
-        )
+                # ✅ CASE 2: Grouped summary (e.g., SELECT field, COUNT(*) ... LIMIT 1)
+                elif len(columns) == 2 and len(rows) == 1:
+                    result.append(dict(zip(columns, rows[0])))
 
+                # ✅ CASE 3: Normal full row output
+                else:
+                    result = rows_to_dicts(columns, rows)
 
-        # Normalize spaces in SQL to prevent matching issues
-        sql_clean = re.sub(r'\s+', ' ', sql).strip()
 
-        # Debug print original SQL
-        print(f"[Original Generated SQL]\n{sql_clean}")
+        log.info("[SQL Query Result] Rows Fetched: %d (cached: %s, %s ms)", len(rows), result_cached, db_ms)
 
-        # Apply FROM/SINCE patch if needed
-        if re.search(r'\b(from|since)\s+\w+\s+\d{4}\b', question, re.IGNORECASE):
-            sql_clean = re.sub(
-                r"effective_date\s+(BETWEEN|>=)\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+effective_date\s+<=\s+'(\d{4}-\d{2}-\d{2})'",
-                r"effective_date >= '\2'",
-                sql_clean,
-                flags=re.IGNORECASE
-            )
-            print(f"[Post-processed SQL after FROM/SINCE adjustment]\n{sql_clean}")
-        else:
-            print("[No FROM/SINCE adjustment applied. Original SQL is correct.]")
+        # Only cache SQL that Postgres actually accepted
+        if path == "llm":
+            nl_sql_cache.put(question, sql)
 
-        # Replace the cleaned SQL back into sql for execution
-        sql = sql_clean
-        print(f"[Generated SQL]\n{sql}")
+    except UnsafeSQL as e:
+        log.warning("[Rejected SQL] %s", e)
+        return jsonify({"error": "Generated SQL was rejected", "sql": sql, "details": str(e)}), 400
 
-        # Handle EXTRACT(YEAR FROM effective_date) = 2024 pattern
-        extract_year_match = re.search(r"extract\s*\(\s*year\s+from\s+effective_date\s*\)\s*=\s*(\d{4})", sql, re.IGNORECASE)
-        if extract_year_match:
-            year = int(extract_year_match.group(1))
-            sql = re.sub(
-                r"extract\s*\(\s*year\s+from\s+effective_date\s*\)\s*=\s*\d{4}",
-                f"effective_date >= '{year}-01-01' AND effective_date < '{year + 1}-01-01'",
-                sql,
-                flags=re.IGNORECASE
-            )
-            print(f"[Post-processed SQL after EXTRACT(YEAR) patch]\n{sql}")
+    except PoolTimeout as e:
+        log.warning("[PostgreSQL Pool Timeout] %s", e)
+        return jsonify({"error": "Database busy, please retry", "details": str(e)}), 503
 
+    except (Overloaded, StageTimeout, QueryRejected, QueryCancelled):
+        raise
 
     except Exception as e:
-        print(f"[Claude API Error] {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": "Claude API failed", "details": str(e)}), 500
-
-    # Step 3: Execute SQL on PostgreSQL
-    try:
-        print(f"[Executing SQL]\n{sql}")
-        conn = get_pg_connection()
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        result = []
-
-        # ✅ CASE 1: Scalar result (e.g., SELECT COUNT(*), SUM(...), AVG(...))
-        if len(columns) == 1 and len(rows) == 1:
-            result.append({columns[0]: rows[0][0]})
-
-        # ✅ CASE 2: Grouped summary (e.g., SELECT field, COUNT(*) ... LIMIT 1)
-        elif len(columns) == 2 and len(rows) == 1:
-            result.append(dict(zip(columns, rows[0])))
-
-        # ✅ CASE 3: Normal full row output
-        else:
-            for row in rows:
-                row_dict = dict(zip(columns, row))
-                if 'effective_date' in row_dict and isinstance(row_dict['effective_date'], (datetime, date)):
-                    if row_dict['effective_date'] is not None:
-                        row_dict['effective_date'] = row_dict['effective_date'].strftime('%Y-%m-%d')
-                result.append(row_dict)
-
-
-        print(f"[SQL Query Result] Rows Fetched: {len(result)}")
-        cur.close()
-        conn.close()
-
-    except Exception as e:
-        print(f"[PostgreSQL Execution Error] {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("[PostgreSQL Execution Error] %s", e)
         return jsonify({"error": "PostgreSQL query failed", "sql": sql, "details": str(e)}), 500
-    
-    # Step 4: Determine Chart Type (only if user asked for it)
-    chart_type = None
-    question_lower = question.lower()
-
-    if any(kw in question_lower for kw in ['chart', 'graph', 'visualize', 'plot', 'distribution', 'trend', 'compare', 'share']):
-        if 'line chart' in question_lower or 'trend' in question_lower or 'over time' in question_lower or 'time series' in question_lower:
-            chart_type = 'line'
-        elif 'bar chart' in question_lower or 'compare' in question_lower or 'comparison' in question_lower:
-            chart_type = 'bar'
-        elif 'pie chart' in question_lower or 'distribution' in question_lower or 'share' in question_lower or 'proportion' in question_lower:
-            chart_type = 'pie'
-        else:
-            # fallback default
-            chart_type = 'bar'
-
-    print(f"[Determined Chart Type] {chart_type}")
-
-    # Step 5: Infer xField & yField (only if chartType is needed)
-    x_field = None
-    y_field = None
-
-    if chart_type and result:
-        result_keys = result[0].keys()
-        print(f"[Result Keys] {result_keys}")
-
-        numeric_fields = [k for k in result_keys if isinstance(result[0][k], (int, float, Decimal))]
-        string_fields = [k for k in result_keys if isinstance(result[0][k], str)]
-
-        y_field = numeric_fields[0] if numeric_fields else None
-        x_field = string_fields[0] if string_fields else None
 
-        print(f"[Inferred xField: {x_field}, yField: {y_field}]")
-
-    return jsonify({
+    with span('chart'):
+        # Step 5: Determine Chart Type (only if user asked for it)
+        chart_type = None
+        question_lower = question.lower()
+
+        if any(kw in question_lower for kw in ['chart', 'graph', 'visualize', 'plot', 'distribution', 'trend', 'compare', 'share']):
+            if 'line chart' in question_lower or 'trend' in question_lower or 'over time' in question_lower or 'time series' in question_lower:
+                chart_type = 'line'
+            elif 'bar chart' in question_lower or 'compare' in question_lower or 'comparison' in question_lower:
+                chart_type = 'bar'
+            elif 'pie chart' in question_lower or 'distribution' in question_lower or 'share' in question_lower or 'proportion' in question_lower:
+                chart_type = 'pie'
+            else:
+                # fallback default
+                chart_type = 'bar'
+
+        log.debug("[Determined Chart Type] %s", chart_type)
+
+        # Step 6: Build the chart series server-side (grouped, top-N + Other, downsampled) and
+        # take xField & yField from it (only if chartType is needed)
+        x_field = None
+        y_field = None
+        chart = None
+
+        if chart_type and rows:
+            chart = chart_builder.build(chart_type, columns, rows)
+            if chart is not None:
+                x_field, y_field = chart["xField"], chart["yField"]
+                log.debug("[Chart] %s points from %s rows (%s, %s)", len(chart["labels"]), len(rows),
+                          chart["aggregation"], chart["method"])
+
+            log.debug("[Inferred xField: %s, yField: %s]", x_field, y_field)
+
+    count = len(rows) if columnar or spilled else len(result)
+    # chartOnly: the series is all the client plots, so the raw rows stay on the server
+    if chart_only and chart is not None:
+        if spilled:
+            rows.close()
+        rows, result, spilled = [], [], False
+
+    payload = {
         "sql": sql,
-        "result": result,
-        "count": len(result), 
+        "params": sql_params,
+        "count": count,
         "chartType": chart_type,
         "xField": x_field,
-        "yField": y_field
-    })
+        "yField": y_field,
+        "chart": chart,
+        "path": path,
+        "sqlCache": sql_cache or "miss",
+        "cached": result_cached,
+        "dbTimeMs": db_ms,
+        "truncated": truncated,
+        "llm": llm_timings
+    }
+    with span('serialize'):
+        if spilled:
+            response = spilled_response(payload, columns, rows, columnar)
+        elif columnar:
+            response = columnar_response({**payload, "columns": columns, "data": rows})
+        else:
+            response = jsonify({**payload, "result": result})
+    return response
+
+
+# Per-question error of a batch: the status and body /ask would have answered with
+def batch_error(e, stage):
+    if isinstance(e, UnsafeSQL):
+        return {"status": 400, "error": "Generated SQL was rejected", "details": str(e)}
+    if isinstance(e, Overloaded):
+        return {"status": 429, "error": str(e), "upstream": e.upstream}
+    if isinstance(e, StageTimeout):
+        return {"status": 504, "error": str(e), "stage": e.stage}
+    if isinstance(e, QueryRejected):
+        return {"status": 422, "error": str(e), "estimatedCost": e.cost, "estimatedRows": e.rows}
+    if isinstance(e, QueryCancelled):
+        return {"status": 409 if e.reason == "superseded" else 499, "error": str(e), "reason": e.reason}
+    if isinstance(e, PoolTimeout):
+        return {"status": 503, "error": "Database busy, please retry", "details": str(e)}
+    log.error("[Batch %s Error] %s", stage, e)
+    return {"status": 500, "error": "Claude API failed" if stage == "bedrock" else "PostgreSQL query failed",
+            "details": str(e)}
+
+# Runs a batch job, returning (result, None) or (None, error)
+def batch_call(stage, fn, *args):
+    try:
+        return fn(*args), None
+    except Exception as e:
+        return None, batch_error(e, stage)
+
+# A batch result's rows as a list (spilled rows are read back and the temp file closed)
+def fetched_rows(result):
+    if isinstance(result.rows, RowSpool):
+        rows = list(result.rows)
+        result.rows.close()
+        return result._replace(rows=rows)
+    return result
+
+
+# Answers several questions in one call.
+#
+# 1. every question is preprocessed and matched against the rules and the NL cache; the rest go
+#    to Claude, one call per distinct question and BATCH_CONCURRENCY calls at a time
+# 2. questions that end up with the same SQL and parameters share one execution
+# 3. single-row aggregates over the same table are folded into one scan with FILTER clauses
+#    (run separately if that scan fails); the rest run BATCH_CONCURRENCY at a time over the pool
+#
+# Results come back in question order, each with its own error and status if it failed.
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    data = request.json or {}
+    questions = data.get("questions")
+    columnar = data.get("format") == "columnar"
+    timeout_ms = query_guard.ask_timeout(data.get("timeoutMs"))
+
+    if not isinstance(questions, list) or not questions or \
+            not all(isinstance(question, str) and question.strip() for question in questions):
+        return jsonify({"error": "'questions' must be a non-empty list of questions"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}), 400
+    log.info("[Incoming Batch] %d questions", len(questions))
+
+    items = [{"question": question} for question in questions]
+    lookups = [lookup_sql(question) for question in questions]
+
+    def translate(question):
+        return sql_flight.do(normalize_question(question), lambda: generate_sql(question))[0]
+
+    def execute(key, max_rows=ASK_MAX_ROWS):
+        sql, params = key
+        # Rule-based SQL has known shapes; anything Claude wrote is EXPLAINed before it runs
+        admit = any(lookups[i].path != "rules" for i in owners[key])
+        return fetched_rows(run_query(sql, params, max_rows=max_rows, guard=DBGuard(admit, timeout_ms, None, None)))
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='ask-batch') as pool:
+        # Step 1: Claude writes the SQL the rules and the NL cache didn't have
+        to_generate = {}
+        for i, lookup in enumerate(lookups):
+            if lookup.sql is None:
+                to_generate.setdefault(normalize_question(lookup.question), []).append(i)
+        with span('bedrock'):
+            futures = [(indexes, pool.submit(batch_call, "bedrock", translate, lookups[indexes[0]].question))
+                       for indexes in to_generate.values()]
+            for indexes, future in futures:
+                generated, error = future.result()
+                for i in indexes:
+                    if error is not None:
+                        items[i].update(error)
+                        lookups[i] = None
+                    else:
+                        lookups[i] = lookups[i]._replace(sql=generated[0], path="llm")
+                        items[i]["llm"] = generated[1]
+
+        # Step 2: one execution per distinct SQL + parameters
+        owners = {}
+        for i, lookup in enumerate(lookups):
+            if lookup is None:
+                continue
+            ask_paths.inc(lookup.path)
+            items[i].update({"sql": lookup.sql, "params": lookup.params, "path": lookup.path,
+                             "sqlCache": lookup.sql_cache or "miss"})
+            try:
+                with span('sql'):
+                    if lookup.params is None:
+                        key = parameterize(enforce_limit(lookup.sql, ASK_MAX_ROWS + 1))
+                    else:
+                        key = enforce_limit(lookup.sql, ASK_MAX_ROWS + 1), tuple(lookup.params)
+            except UnsafeSQL as e:
+                items[i].update(batch_error(e, "sql"))
+                continue
+            owners.setdefault(key, []).append(i)
+
+        # Step 3: shared scans for single-row aggregates, separate queries for everything else
+        keys = list(owners)
+        with span('sql'):
+            scans = combine_aggregates([(lookups[owners[key][0]].sql, lookups[owners[key][0]].params) for key in keys])
+        separate = set(keys)
+        for scan in scans:
+            separate.difference_update(keys[index] for index, _ in scan.members)
+            # EXPLAIN the scan if any of its questions would have been
+            owners[(scan.sql, scan.params)] = [i for index, _ in scan.members for i in owners[keys[index]]]
+
+        results = {}
+        scan_futures = [(scan, pool.submit(batch_call, "db", execute, (scan.sql, scan.params), 1)) for scan in scans]
+        futures = [(key, pool.submit(batch_call, "db", execute, key)) for key in separate]
+        for scan, future in scan_futures:
+            result, error = future.result()
+            if error is not None:
+                log.warning("[Batch] Combined scan of %d queries failed, running them separately: %s",
+                            len(scan.members), error["error"])
+                futures += [(keys[index], pool.submit(batch_call, "db", execute, keys[index]))
+                            for index, _ in scan.members]
+                continue
+            position = 0
+            for index, columns in scan.members:
+                values = result.rows[0][position:position + len(columns)]
+                position += len(columns)
+                results[keys[index]] = (result._replace(columns=columns, rows=[tuple(values)]), None, True)
+        for key, future in futures:
+            results[key] = (*future.result(), False)
+
+    # SQL Claude wrote is cached once it has run, as /ask does, so the next run of the batch skips Bedrock
+    remembered = set()
+    for key in keys:
+        result, error, combined = results[key]
+        for i in owners[key]:
+            if error is not None:
+                items[i].update(error)
+                continue
+            if lookups[i].path == "llm" and lookups[i].question not in remembered:
+                remembered.add(lookups[i].question)
+                nl_sql_cache.put(lookups[i].question, lookups[i].sql)
+            items[i].update({"count": len(result.rows), "cached": result.cached, "dbTimeMs": result.db_ms,
+                             "truncated": result.truncated, "combined": combined, "sharedSql": len(owners[key]) > 1})
+            if columnar:
+                items[i].update({"columns": result.columns, "data": result.rows})
+            else:
+                items[i]["result"] = rows_to_dicts(result.columns, result.rows)
+
+    payload = {
+        "results": items,
+        "count": len(items),
+        "failed": sum(1 for item in items if "error" in item),
+        "bedrockCalls": len(to_generate),
+        "queries": len(futures) + len(scan_futures),
+        "combinedScans": len(scans)
+    }
+    with span('serialize'):
+        return columnar_response(payload) if columnar else jsonify(payload)
 
 
+FILTERS_SELECT = (
+    'SELECT policy_number, effective_date, transaction_type, insured_state, coverage, "limit", gross_premium '
+    'FROM insurance_policies'
+)
+
+# Case-insensitive match; plain values compare with lower() = lower() (index-friendly), patterns keep ILIKE
+def text_filter(column, value):
+    if '%' in value or '_' in value:
+        return f"{column} ILIKE %s"
+    return f"lower({column}) = lower(%s)"
+
 
 @app.route("/filters", methods=["POST"])
 def filters():
@@ -370,25 +914,19 @@ def filters():
     conditions = []
     values = []
 
+    # Bare column comparisons so the effective_date / lower(...) indexes can be used
     if filters_data.get('effectiveFrom'):
-        conditions.append("CAST(effective_date AS DATE) >= %s")
+        conditions.append("effective_date >= %s")
         values.append(filters_data['effectiveFrom'])
 
     if filters_data.get('effectiveTo'):
-        conditions.append("CAST(effective_date AS DATE) <= %s")
+        conditions.append("effective_date < %s::date + 1")
         values.append(filters_data['effectiveTo'])
 
-    if filters_data.get('transactionType'):
-        conditions.append("transaction_type ILIKE %s")
-        values.append(filters_data['transactionType'])
-
-    if filters_data.get('insuredState'):
-        conditions.append("insured_state ILIKE %s")
-        values.append(filters_data['insuredState'])
-
-    if filters_data.get('coverage'):
-        conditions.append("coverage ILIKE %s")
-        values.append(filters_data['coverage'])
+    for key, column in (('transactionType', 'transaction_type'), ('insuredState', 'insured_state'), ('coverage', 'coverage')):
+        if filters_data.get(key):
+            conditions.append(text_filter(column, filters_data[key]))
+            values.append(filters_data[key])
 
     try:
         # Handle limit range
@@ -422,117 +960,131 @@ def filters():
     except ValueError as e:
         return jsonify({"error": "Invalid numeric filter values", "details": str(e)}), 400
 
-    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-
-    # ✅ ✅ FIXED: Use f-string for SQL interpolation
-    sql = f"""
-        SELECT
-        policy_number,
-        effective_date,
-        transaction_type,
-        insured_state,
-        coverage,
-        "limit",
-        gross_premium
-    FROM insurance_policies
-    {where_clause}
-    LIMIT 100;
+    where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
 
-    """
+    # One SQL text per combination of filters, so each combination is prepared once per connection
+    sql = f"{FILTERS_SELECT}{where_clause} LIMIT 100"
 
-    print("Generated SQL:", sql)
-    print("With values:", values)
+    log.debug("Generated SQL: %s", sql)
+    log.debug("With values: %s", values)
 
     try:
-        conn = get_pg_connection()
-        cur = conn.cursor()
-        cur.execute(sql, values)
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        result = []
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-
-            # ✅ Safe check if effective_date exists and is not None
-            if 'effective_date' in row_dict and isinstance(row_dict['effective_date'], (datetime, date)):
-                if row_dict['effective_date'] is not None:
-                    row_dict['effective_date'] = row_dict['effective_date'].strftime('%Y-%m-%d')
+        columns, rows, result_cached, db_ms, _ = run_query(sql, values)
 
-            result.append(row_dict)
-
-        cur.close()
-        conn.close()
+    except PoolTimeout as e:
+        log.warning("SQL Pool Timeout: %s", e)
+        return jsonify({"error": "Database busy, please retry", "details": str(e)}), 503
+    except (Overloaded, StageTimeout, QueryRejected, QueryCancelled):
+        raise
     except Exception as e:
-        print("SQL Error:", str(e))
+        log.error("SQL Error: %s", e)
         return jsonify({"error": "PostgreSQL query failed", "sql": sql, "details": str(e)}), 500
 
-    return jsonify({
-        "sql": sql, 
-        "result": result,
-        "count": len(result)
-    })
+    payload = {
+        "sql": sql,
+        "count": len(rows),
+        "cached": result_cached,
+        "dbTimeMs": db_ms
+    }
+    with span('serialize'):
+        if filters_data.get("format") == "columnar":
+            response = columnar_response({**payload, "columns": columns, "data": rows})
+        else:
+            response = jsonify({**payload, "result": rows_to_dicts(columns, rows)})
+    return response
+
 
+def read_kpis():
+    with db_bulkhead.slot():
+        kpis, _ = db_router.read(kpi_store.read_from)
+    return kpis
 
 @app.route("/kpis", methods=["GET"])
 def get_kpis():
     try:
-        conn = get_pg_connection()
-        cur = conn.cursor()
-
-        # 1. Total Policies
-        cur.execute("SELECT COUNT(*) FROM insurance_policies;")
-        total_policies = cur.fetchone()[0]
-
-        # 2. Total Gross Premium
-        cur.execute("SELECT COALESCE(ROUND(SUM(gross_premium), 2), 0) FROM insurance_policies;")
-        total_gross_premium = cur.fetchone()[0]
-
-        # 3. Average Policy Limit
-        cur.execute('SELECT COALESCE(ROUND(AVG("limit"), 2), 0) FROM insurance_policies;')
-        avg_policy_limit = cur.fetchone()[0]
-
-        # 4. Policies Issued This Year
-        cur.execute("""
-            SELECT COUNT(*) FROM insurance_policies 
-            WHERE EXTRACT(YEAR FROM effective_date) = EXTRACT(YEAR FROM CURRENT_DATE);
-        """)
-        policies_this_year = cur.fetchone()[0]
-
-        # 5. Most Common Transaction Type
-        cur.execute("""
-            SELECT transaction_type FROM insurance_policies 
-            GROUP BY transaction_type 
-            ORDER BY COUNT(*) DESC 
-            LIMIT 1;
-        """)
-        common_transaction_type = cur.fetchone()[0]
-
-        # 6. Top Insured State
-        cur.execute("""
-            SELECT insured_state FROM insurance_policies 
-            GROUP BY insured_state 
-            ORDER BY COUNT(*) DESC 
-            LIMIT 1;
-        """)
-        top_insured_state = cur.fetchone()[0]
-
-        cur.close()
-        conn.close()
+        with span('db'):
+            kpis, _ = kpi_flight.do('kpis', read_kpis)
 
         # Return KPI data
         return jsonify({
-            "totalPolicies": total_policies,
-            "totalGrossPremium": f"${total_gross_premium:,.2f}",
-            "avgPolicyLimit": f"${avg_policy_limit:,.2f}",
-            "policiesThisYear": policies_this_year,
-            "commonTransactionType": common_transaction_type,
-            "topInsuredState": top_insured_state
+            **kpis,
+            "totalGrossPremium": f"${kpis['totalGrossPremium']:,.2f}",
+            "avgPolicyLimit": f"${kpis['avgPolicyLimit']:,.2f}"
         })
 
+    except PoolTimeout as e:
+        log.warning("KPI Pool Timeout: %s", e)
+        return jsonify({"error": "Database busy, please retry", "details": str(e)}), 503
+    except (Overloaded, StageTimeout, QueryRejected, QueryCancelled):
+        raise
     except Exception as e:
-        print("KPI Query Error:", str(e))
+        log.error("KPI Query Error: %s", e)
         return jsonify({"error": "Failed to fetch KPIs", "details": str(e)}), 500
 
 
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    log.warning("[Backpressure] %s: %s", e.upstream, e)
+    response = jsonify({"error": str(e), "upstream": e.upstream})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+
+@app.errorhandler(StageTimeout)
+def handle_stage_timeout(e):
+    log.warning("[Stage Timeout] %s: %s", e.stage, e)
+    return jsonify({"error": str(e), "stage": e.stage}), 504
+
+
+@app.errorhandler(QueryRejected)
+def handle_query_rejected(e):
+    log.warning("[Admission Rejected] %s", e)
+    return jsonify({"error": str(e), "estimatedCost": e.cost, "estimatedRows": e.rows}), 422
+
+
+# Superseded by a newer question (409) or abandoned by the client (499, nobody reads it)
+@app.errorhandler(QueryCancelled)
+def handle_query_cancelled(e):
+    log.info("[Query Cancelled] %s", e.reason)
+    return jsonify({"error": str(e), "reason": e.reason}), 409 if e.reason == "superseded" else 499
+
+
+# Index suggestions from the query shapes seen so far, with the slowest shapes
+@app.route("/indexes/advice", methods=["GET"])
+def index_advice():
+    return jsonify(index_advisor.advise(top=int(request.args.get("top", 20))))
+
+
+# Prometheus scrape endpoint: stage and request latency histograms plus pool, upstream and cache counters
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "pool": pg_pool.stats(),
+        "replicas": db_router.stats(),
+        "singleFlight": {flight.name: flight.stats() for flight in flights},
+        "nlCache": nl_sql_cache.stats(),
+        "sqlParseCache": parse_cache_stats(),
+        "preparedStatements": statement_cache.stats(),
+        "schema": schema_cache.stats(),
+        "queryGuard": query_guard.stats(),
+        "resultCache": result_cache.stats(),
+        "bedrock": {**bedrock_bulkhead.stats(), **llm_stats.stats()},
+        "db": db_bulkhead.stats()
+    })
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # APP_SERVER=waitress runs a multi-threaded production server; the default stays the Flask dev server
+    if os.getenv('APP_SERVER', 'flask') == 'waitress':
+        from waitress import serve
+        # channel_request_lookahead lets waitress notice a client hanging up mid-request
+        # (waitress.client_disconnected), which cancels that request's query
+        serve(app, host=os.getenv('APP_HOST', '0.0.0.0'), port=int(os.getenv('APP_PORT', '5000')),
+              threads=int(os.getenv('APP_THREADS', '32')), channel_request_lookahead=1)
+    else:
+        app.run(debug=True, threaded=True)
@@ -0,0 +1,73 @@
+# Hit rate and latency of the rule-based fast path.
+#
+#   python bench/bench_fast_path.py [--repeat 2000] [--verbose]
+#
+# Runs each sample question through the same steps /ask does before Bedrock (date preprocessing,
+# then match_question) and reports how many were answered locally and what that costs per question.
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from date_phrases import preprocess_question  # noqa: E402
+from fast_path import match_question  # noqa: E402
+from bench_preprocess import QUESTIONS as DATE_QUESTIONS  # noqa: E402
+
+QUESTIONS = DATE_QUESTIONS + [
+    "Total premium by state",
+    "Count of policies in CA last month",
+    "Average limit for Auto coverage",
+    "How many policies were issued in April 2024?",
+    "What is the average premium for Auto coverage?",
+    "Show all policies where coverage limit is above 1M",
+    "Most common transaction type?",
+    "Top insured state",
+    "Show renewal policies in TX last quarter",
+    "Total premium by month this year",
+    "Number of policies by transaction type",
+    "Highest premium in NY",
+    "Show a pie chart of policies by state",
+    "Which policy has the highest premium?",
+    "Show the trend of premium over time",
+    "Which states grew premium the most compared to last year?",
+    "List the top 10 policies by limit",
+    "Average premium of renewals vs new business",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rule-based fast path benchmark')
+    parser.add_argument('--repeat', type=int, default=2000, help='passes over the corpus')
+    parser.add_argument('--verbose', action='store_true', help='print the SQL produced for each question')
+    args = parser.parse_args()
+
+    today = date(2025, 6, 15)
+    prepared = [preprocess_question(q, today=today) for q in QUESTIONS]
+
+    hits = 0
+    for question, text in zip(QUESTIONS, prepared):
+        match = match_question(text)
+        hits += match is not None
+        label = match.intent if match else 'bedrock'
+        print(f"{label:28} {question}")
+        if args.verbose and match:
+            print(f"{'':28}   {match.sql} {match.params}")
+
+    timings = {'hit': [], 'miss': []}
+    for text in prepared:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            match = match_question(text)
+        timings['hit' if match else 'miss'].append((time.perf_counter() - started) / args.repeat * 1e6)
+
+    print(f"\nHit rate: {hits}/{len(QUESTIONS)} ({hits / len(QUESTIONS):.0%}) answered without Bedrock")
+    for kind, samples in timings.items():
+        if samples:
+            print(f"{kind:>4}: avg {sum(samples) / len(samples):.1f} us, max {max(samples):.1f} us per question")
+
+
+if __name__ == '__main__':
+    main()
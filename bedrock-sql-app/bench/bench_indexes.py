@@ -0,0 +1,159 @@
+# Before/after benchmark for migrations/003_policy_indexes.sql on a synthetic table.
+#
+#   python bench/bench_indexes.py [--rows 5000000] [--runs 5] [--ordered] [--keep]
+#
+# Uses the PG_* settings from .env. Builds insurance_policies_bench with --rows synthetic policies,
+# times the query shapes /ask and /filters generate, applies the migration's indexes to the bench
+# table and times them again. --ordered stores rows in effective_date order (where BRIN shines).
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import connect_from_env  # noqa: E402
+
+TABLE = 'insurance_policies_bench'
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations', '003_policy_indexes.sql')
+
+CREATE_SQL = f"""
+    DROP TABLE IF EXISTS {TABLE};
+    CREATE TABLE {TABLE} (
+        policy_number TEXT,
+        effective_date DATE,
+        transaction_type TEXT,
+        insured_state TEXT,
+        coverage TEXT,
+        "limit" NUMERIC,
+        gross_premium NUMERIC
+    );
+"""
+
+STATES = "'AL','AK','AZ','AR','CA','CO','CT','DE','FL','GA','HI','ID','IL','IN','IA','KS','KY','LA','ME','MD'," \
+         "'MA','MI','MN','MS','MO','MT','NE','NV','NH','NJ','NM','NY','NC','ND','OH','OK','OR','PA','RI','SC'," \
+         "'SD','TN','TX','UT','VT','VA','WA','WV','WI','WY'"
+
+FILL_SQL = f"""
+    INSERT INTO {TABLE}
+    SELECT 'P' || lpad(g::text, 10, '0'),
+           DATE '2019-01-01' + {{day_expr}},
+           (ARRAY['New','Renewal','Endorsement','Reinstate','Cancellation','Audit'])[1 + floor(random() * 6)::int],
+           (ARRAY[{STATES}])[1 + floor(random() * 50)::int],
+           (ARRAY['Auto','Home','Life','Commercial Property','General Liability','Workers Comp','Umbrella','Cyber'])
+               [1 + floor(random() * 8)::int],
+           (ARRAY[100000,250000,500000,1000000,2000000,5000000])[1 + floor(random() * 6)::int],
+           round((500 + random() * 49500)::numeric, 2)
+    FROM generate_series(1, %s) AS g
+"""
+
+# The shapes the app actually sends: /filters (lower() equality, bare date ranges), prepared
+# /ask SQL (wildcard ILIKE, plain ILIKE and EXTRACT(YEAR) rewritten, numeric comparisons) and
+# keyset pages of streamed results
+QUERIES = [
+    ("filters: month + transaction type",
+     f"""SELECT policy_number, effective_date, transaction_type, insured_state, coverage, "limit", gross_premium
+         FROM {TABLE} WHERE effective_date >= '2024-03-01' AND effective_date < '2024-03-31'::date + 1
+         AND lower(transaction_type) = lower('Endorsement') LIMIT 100"""),
+    ("filters: state + premium floor",
+     f"""SELECT policy_number, effective_date, transaction_type, insured_state, coverage, "limit", gross_premium
+         FROM {TABLE} WHERE lower(insured_state) = lower('ca') AND gross_premium >= 49000 LIMIT 100"""),
+    ("ask: count in one month",
+     f"SELECT COUNT(*) FROM {TABLE} WHERE effective_date >= '2024-04-01' AND effective_date < '2024-05-01'"),
+    ("ask: coverage ILIKE in a quarter",
+     f"""SELECT * FROM {TABLE} WHERE coverage ILIKE '%cyber%'
+         AND (effective_date >= '2024-07-01' AND effective_date < '2024-10-01') LIMIT 10001"""),
+    ("ask: state count",
+     f"SELECT COUNT(*) FROM {TABLE} WHERE LOWER(insured_state) = LOWER('WY')"),
+    ("ask: high limits in NY",
+     f"""SELECT policy_number, "limit" FROM {TABLE} WHERE "limit" > 2000000 AND LOWER(insured_state) = LOWER('NY')
+         AND effective_date >= '2025-01-01' LIMIT 10001"""),
+    ("ask: premium by state in a year",
+     f"""SELECT insured_state, SUM(gross_premium) FROM {TABLE}
+         WHERE (effective_date >= '2024-01-01' AND effective_date < '2025-01-01') GROUP BY insured_state"""),
+    ("ask: top premiums",
+     f"SELECT policy_number, gross_premium FROM {TABLE} WHERE gross_premium > 49990 LIMIT 10001"),
+    ("ask: deep keyset page",
+     f"""SELECT * FROM (SELECT *, ctid AS page_row_id FROM {TABLE}) AS page
+         WHERE page.policy_number >= 'P0002500000' AND (page.policy_number, page.page_row_id) > ('P0002500000', '(0,0)'::tid)
+         ORDER BY page.policy_number, page.page_row_id LIMIT 1001"""),
+]
+
+
+def migration_statements():
+    with open(MIGRATION) as f:
+        text = '\n'.join(line for line in f if not line.lstrip().startswith('--'))
+    statements = [s.strip() for s in text.split(';') if s.strip()]
+    return [re.sub(r'\binsurance_policies', TABLE, s) for s in statements]
+
+
+def time_queries(cur, runs):
+    timings = {}
+    for label, sql in QUERIES:
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            cur.execute(sql)
+            cur.fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = cur.fetchone()[0][0]['Plan']
+        while plan.get('Plans') and plan['Node Type'] in ('Limit', 'Aggregate', 'Gather', 'Gather Merge',
+                                                           'Finalize Aggregate', 'Partial Aggregate', 'Sort',
+                                                           'HashAggregate', 'Finalize GroupAggregate'):
+            plan = plan['Plans'][0]
+        timings[label] = (statistics.median(samples), plan['Node Type'])
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index migration before/after benchmark')
+    parser.add_argument('--rows', type=int, default=5_000_000, help='synthetic policies to generate')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per query (median is reported)')
+    parser.add_argument('--ordered', action='store_true', help='insert rows in effective_date order')
+    parser.add_argument('--keep', action='store_true', help='keep the bench table afterwards')
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = connect_from_env()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SET statement_timeout = 0")
+
+    try:
+        print(f"Building {TABLE} with {args.rows:,} rows...")
+        started = time.perf_counter()
+        cur.execute(CREATE_SQL)
+        day_expr = f"(g::bigint * 2555 / {args.rows})::int" if args.ordered else "floor(random() * 2555)::int"
+        cur.execute(FILL_SQL.format(day_expr=day_expr), (args.rows,))
+        cur.execute(f"VACUUM ANALYZE {TABLE}")
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+
+        print("Timing queries without indexes...")
+        before = time_queries(cur, args.runs)
+
+        print("Applying migrations/003_policy_indexes.sql...")
+        started = time.perf_counter()
+        for statement in migration_statements():
+            cur.execute(statement)
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+
+        print("Timing queries with indexes...")
+        after = time_queries(cur, args.runs)
+
+        print(f"\n{'query':36} {'before ms':>10} {'after ms':>10} {'speedup':>8}  plan after")
+        for label, _ in QUERIES:
+            (before_ms, _), (after_ms, plan) = before[label], after[label]
+            print(f"{label:36} {before_ms:10.1f} {after_ms:10.1f} {before_ms / max(after_ms, 0.001):7.1f}x  {plan}")
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
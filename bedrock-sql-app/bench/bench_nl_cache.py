@@ -0,0 +1,76 @@
+# Micro-benchmark for the similarity tier of the NL -> SQL cache.
+#
+#   python bench/bench_nl_cache.py [--entries 1000] [--repeat 200]
+#
+# Checks PAIRS (paraphrases that must share SQL, and near-duplicates that must not; exits
+# non-zero on a mismatch), then times a similarity lookup against a full cache.
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nl_cache import LRUTTLBackend, NLSQLCache  # noqa: E402
+
+# (cached question, new question, should the new one reuse the cached SQL)
+PAIRS = [
+    ("show total premium in Texas", "what is the total premium for TX please", True),
+    ("list all auto policies in CA", "show me auto policies in California", True),
+    ("premium by state for auto coverage", "show premium by state for auto coverage", True),
+    ("total coverage by state", "sum of coverage by state", True),
+    # negations
+    ("show policies in TX", "show policies not in TX", False),
+    ("policies with auto coverage", "policies without auto coverage", False),
+    # ordering and comparators
+    ("list policies by premium ascending", "list policies by premium descending", False),
+    ("policies with highest premium", "policies with lowest premium", False),
+    ("policies issued before 2024-01-01", "policies issued after 2024-01-01", False),
+    # aggregates
+    ("average premium in TX", "total premium in TX", False),
+    ("how many policies in TX", "list policies in TX", False),
+    # measure and dimension columns
+    ("policies with premium above 1000 in TX", "policies with limit above 1000 in TX", False),
+    ("count of renewal policies grouped by state", "count of renewal policies grouped by coverage", False),
+    ("total premium by month in 2024", "total premium by year in 2024", False),
+    ("list auto policies by effective date", "list auto policies by transaction", False),
+    # coverage values, listed and not
+    ("total premium for auto coverage", "total premium for home coverage", False),
+    ("total premium for gap coverage", "total premium for pip coverage", False),
+]
+
+
+def check(similarity):
+    failures = 0
+    for cached, question, shared in PAIRS:
+        cache = NLSQLCache(LRUTTLBackend(), similarity=similarity)
+        cache.put(cached, 'SELECT 1')
+        _, tier = cache.get(question)
+        if (tier is not None) != shared:
+            failures += 1
+            print(f"MISMATCH {cached!r} -> {question!r}: tier {tier}, expected {'a hit' if shared else 'a miss'}")
+    print(f"{len(PAIRS) - failures}/{len(PAIRS)} similarity cases OK")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--similarity', type=float, default=float(os.getenv('NL_CACHE_SIMILARITY', '0.9')))
+    args = parser.parse_args()
+
+    ok = check(args.similarity)
+
+    cache = NLSQLCache(LRUTTLBackend(max_entries=args.entries), similarity=args.similarity,
+                       max_similar_entries=args.entries)
+    for i in range(args.entries):
+        cache.put(f"total premium for policies with limit above {i} in TX", f"SELECT {i}")
+    seconds = timeit.timeit(lambda: cache.get("policies with premium below 5 in CA by coverage"),
+                            number=args.repeat)
+    print(f"similarity miss over {args.entries} entries: {seconds / args.repeat * 1e6:.1f} us")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
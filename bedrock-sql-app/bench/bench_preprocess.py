@@ -0,0 +1,101 @@
+# Micro-benchmark for the date-phrase preprocessor.
+#
+#   python bench/bench_preprocess.py [--repeat 2000]
+#
+# Checks EXPECTED (one or more cases per phrase family, resolved on 2025-06-15; exits non-zero on
+# a mismatch), then prints the per-question cost of preprocess_question over a corpus of typical
+# voice questions.
+import argparse
+import os
+import sys
+import timeit
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from date_phrases import preprocess_question  # noqa: E402
+
+QUESTIONS = [
+    "Show all policies from California",
+    "List renewal policies with premium over 100000",
+    "Get policies issued in April 2025",
+    "What are the new policies from Texas?",
+    "Total gross premium last month",
+    "Policies issued this year in CA",
+    "Average policy limit for policies from last year",
+    "Count of endorsements this week",
+    "Premium by state in March",
+    "Policies April last year with limit above 500000",
+    "Total premium in Q3 2024",
+    "Renewals last quarter",
+    "GWP YTD by coverage",
+    "Policies in the last 30 days",
+    "Month to date gross premium",
+    "Policies issued today",
+    "Compare gross premium by transaction type",
+    "Show the distribution of policies by coverage",
+    "Cancellations in the past 2 weeks",
+    "First quarter of 2025 new business premium",
+]
+
+# (question, expected output on 2025-06-15)
+EXPECTED = [
+    # month + year
+    ("Policies in April 2024", "Policies effective_date BETWEEN '2024-04-01' AND '2024-04-30'"),
+    # month + last/this year, with and without "in"/"from" (must not fall through to "in April")
+    ("Policies April last year", "Policies effective_date BETWEEN '2024-04-01' AND '2024-04-30'"),
+    ("total premium in April last year", "total premium in effective_date BETWEEN '2024-04-01' AND '2024-04-30'"),
+    ("policies from April this year", "policies from effective_date BETWEEN '2025-04-01' AND '2025-04-30'"),
+    ("renewals in december last year", "renewals in effective_date BETWEEN '2024-12-01' AND '2024-12-31'"),
+    # quarters
+    ("Total premium in Q3 2024", "Total premium between '2024-07-01' and '2024-09-30'"),
+    ("first quarter of 2025 premium", "between '2025-01-01' and '2025-03-31' premium"),
+    ("Renewals last quarter", "Renewals between '2025-01-01' and '2025-03-31'"),
+    # last N days/weeks/months
+    ("Policies in the last 30 days", "Policies between '2025-05-17' and '2025-06-15'"),
+    # to date
+    ("GWP YTD by coverage", "GWP between '2025-01-01' and '2025-06-15' by coverage"),
+    # last/this month/year/week
+    ("Total gross premium last month", "Total gross premium between '2025-05-01' and '2025-05-31'"),
+    ("Average limit for policies from last year", "Average limit for policies between '2024-01-01' and '2024-12-31'"),
+    # today/yesterday
+    ("Policies issued yesterday", "Policies issued between '2025-06-14' and '2025-06-14'"),
+    # month with no year: every April, unless the question names a year elsewhere
+    ("Premium by state in March", "Premium by state EXTRACT(MONTH FROM effective_date) = 3"),
+    ("Premium in March for 2024 policies", "Premium in March for 2024 policies"),
+]
+
+
+def check(today):
+    failures = 0
+    for question, expected in EXPECTED:
+        actual = preprocess_question(question, today=today)
+        if actual != expected:
+            failures += 1
+            print(f"MISMATCH {question!r}\n  expected {expected!r}\n  got      {actual!r}")
+    print(f"{len(EXPECTED) - failures}/{len(EXPECTED)} expected outputs match\n")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Date-phrase preprocessor micro-benchmark')
+    parser.add_argument('--repeat', type=int, default=2000, help='passes over the corpus')
+    args = parser.parse_args()
+
+    today = date(2025, 6, 15)
+    ok = check(today)
+    for question in QUESTIONS:
+        print(f"{question!r:55} -> {preprocess_question(question, today=today)!r}")
+
+    total = timeit.timeit(
+        lambda: [preprocess_question(q, today=today) for q in QUESTIONS],
+        number=args.repeat
+    )
+    per_question_us = total / (args.repeat * len(QUESTIONS)) * 1e6
+    print(f"\n{len(QUESTIONS)} questions x {args.repeat} passes: {per_question_us:.2f} us/question")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Micro-benchmark for result serialization.
+#
+#   python bench/bench_serialization.py [--rows 10000] [--repeat 20]
+#
+# Encodes synthetic insurance_policies rows (Decimal limit/premium, date effective_date) the way
+# /ask and /filters respond: per-row dicts through Flask's stock encoder (before), the same dicts
+# through FastJSONProvider, and format=columnar. Prints encode time, payload size and peak allocation.
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import serialization  # noqa: E402
+from serialization import FastJSONProvider, dumps_columnar  # noqa: E402
+
+COLUMNS = ['policy_number', 'effective_date', 'transaction_type', 'insured_state', 'coverage', 'limit', 'gross_premium']
+
+
+def make_rows(count):
+    rng = random.Random(7)
+    start = date(2019, 1, 1)
+    return [(
+        f"POL{i:09d}",
+        start + timedelta(days=rng.randrange(2500)),
+        rng.choice(['New', 'Renewal', 'Endorsement']),
+        rng.choice(['CA', 'TX', 'FL', 'NY']),
+        rng.choice(['Auto', 'Home', 'Cyber']),
+        Decimal(rng.choice([100000, 500000, 1000000])),
+        Decimal(f"{rng.uniform(200, 20000):.2f}")
+    ) for i in range(count)]
+
+
+def row_to_dict(row):
+    row_dict = dict(zip(COLUMNS, row))
+    row_dict['effective_date'] = row_dict['effective_date'].strftime('%Y-%m-%d')
+    return row_dict
+
+
+def measure(encode, repeat):
+    tracemalloc.start()
+    payload = encode()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encode()
+    ms = (time.perf_counter() - started) / repeat * 1000
+    return ms, len(payload), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Result serialization micro-benchmark')
+    parser.add_argument('--rows', type=int, default=10_000, help='rows per response')
+    parser.add_argument('--repeat', type=int, default=20, help='timed encodes per format')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    stock = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    rows = make_rows(args.rows)
+
+    def dict_rows():
+        return {"result": [row_to_dict(r) for r in rows]}
+
+    cases = [
+        ("rows, Flask encoder", lambda: stock.dumps(dict_rows(), separators=(',', ':')).encode()),
+        ("rows, FastJSONProvider", lambda: fast.dumps(dict_rows()).encode()),
+        ("columnar", lambda: dumps_columnar({"columns": COLUMNS, "data": rows})),
+    ]
+    print(f"{args.rows:,} rows, orjson {'available' if serialization.orjson else 'not installed (stdlib fallback)'}\n")
+    print(f"{'format':24} {'encode ms':>10} {'bytes':>11} {'peak alloc KB':>14}")
+    for label, encode in cases:
+        ms, size, peak = measure(encode, args.repeat)
+        print(f"{label:24} {ms:10.2f} {size:11,} {peak / 1024:14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
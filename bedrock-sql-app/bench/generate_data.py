@@ -0,0 +1,143 @@
+# Synthetic insurance_policies data with realistic skew, for load tests and index benchmarks.
+#
+#   python bench/generate_data.py --rows 1000000 [--table insurance_policies] [--truncate] [--seed 42]
+#   python bench/generate_data.py --rows 100000 --csv policies.csv
+#
+# States follow roughly the US population, coverages and transaction types a typical P&C book,
+# and policy volume grows over time. Rows are streamed to Postgres with COPY in chunks, so
+# 10M rows take minutes and constant memory. Uses the PG_* settings from .env.
+import argparse
+import io
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import connect_from_env  # noqa: E402
+
+STATE_WEIGHTS = {
+    'CA': 11.7, 'TX': 9.0, 'FL': 6.7, 'NY': 5.9, 'PA': 3.9, 'IL': 3.8, 'OH': 3.5, 'GA': 3.3, 'NC': 3.2,
+    'MI': 3.0, 'NJ': 2.8, 'VA': 2.6, 'WA': 2.3, 'AZ': 2.2, 'TN': 2.1, 'MA': 2.1, 'IN': 2.0, 'MO': 1.8,
+    'MD': 1.8, 'WI': 1.8, 'CO': 1.7, 'MN': 1.7, 'SC': 1.6, 'AL': 1.5, 'LA': 1.4, 'KY': 1.3, 'OR': 1.3,
+    'OK': 1.2, 'CT': 1.1, 'UT': 1.0, 'IA': 1.0, 'NV': 0.9, 'AR': 0.9, 'MS': 0.9, 'KS': 0.9, 'NM': 0.6,
+    'NE': 0.6, 'ID': 0.6, 'WV': 0.5, 'HI': 0.4, 'NH': 0.4, 'ME': 0.4, 'MT': 0.3, 'RI': 0.3, 'DE': 0.3,
+    'SD': 0.3, 'ND': 0.2, 'AK': 0.2, 'VT': 0.2, 'WY': 0.2
+}
+COVERAGE_WEIGHTS = {
+    'Auto': 35, 'Home': 25, 'Commercial Property': 12, 'General Liability': 10, 'Workers Comp': 7,
+    'Life': 5, 'Umbrella': 4, 'Cyber': 2
+}
+TRANSACTION_WEIGHTS = {'Renewal': 45, 'New': 30, 'Endorsement': 15, 'Cancellation': 5, 'Audit': 3, 'Reinstate': 2}
+LIMIT_WEIGHTS = {100000: 20, 250000: 25, 500000: 25, 1000000: 18, 2000000: 8, 5000000: 4}
+# Median premium per coverage, before scaling by limit
+BASE_PREMIUM = {
+    'Auto': 1400, 'Home': 1800, 'Commercial Property': 9000, 'General Liability': 6000, 'Workers Comp': 12000,
+    'Life': 900, 'Umbrella': 450, 'Cyber': 4000
+}
+
+START_DATE = date(2019, 1, 1)
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        policy_number TEXT,
+        effective_date DATE,
+        transaction_type TEXT,
+        insured_state TEXT,
+        coverage TEXT,
+        "limit" NUMERIC,
+        gross_premium NUMERIC
+    )
+"""
+
+
+def _sampler(weights):
+    values = list(weights)
+    cumulative = []
+    total = 0
+    for value in values:
+        total += weights[value]
+        cumulative.append(total)
+    return lambda rng, k: rng.choices(values, cum_weights=cumulative, k=k)
+
+
+def generate_chunk(rng, first_number, count, end_date):
+    span = (end_date - START_DATE).days
+    states = _sampler(STATE_WEIGHTS)(rng, count)
+    coverages = _sampler(COVERAGE_WEIGHTS)(rng, count)
+    transactions = _sampler(TRANSACTION_WEIGHTS)(rng, count)
+    limits = _sampler(LIMIT_WEIGHTS)(rng, count)
+
+    out = io.StringIO()
+    for i in range(count):
+        # sqrt skews towards recent dates: the book grows over time
+        effective = START_DATE + timedelta(days=int(span * math.sqrt(rng.random())))
+        coverage = coverages[i]
+        limit = limits[i]
+        premium = BASE_PREMIUM[coverage] * (limit / 500000) ** 0.5 * rng.lognormvariate(0, 0.45)
+        out.write(f"POL{first_number + i:09d}\t{effective.isoformat()}\t{transactions[i]}\t{states[i]}\t"
+                  f"{coverage}\t{limit}\t{premium:.2f}\n")
+    out.seek(0)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic insurance_policies generator')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows to generate (e.g. 100000, 1000000, 10000000)')
+    parser.add_argument('--table', default='insurance_policies', help='target table (created if missing)')
+    parser.add_argument('--truncate', action='store_true', help='empty the table first')
+    parser.add_argument('--start', type=int, default=1, help='first policy number')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (same seed, same data)')
+    parser.add_argument('--chunk', type=int, default=100_000, help='rows per COPY batch')
+    parser.add_argument('--csv', help='write tab-separated rows to this file instead of Postgres')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    end_date = date.today()
+    started = time.perf_counter()
+
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            for offset in range(0, args.rows, args.chunk):
+                count = min(args.chunk, args.rows - offset)
+                f.write(generate_chunk(rng, args.start + offset, count, end_date).getvalue())
+        print(f"Wrote {args.rows:,} rows to {args.csv} in {time.perf_counter() - started:.1f}s")
+        return
+
+    load_dotenv()
+    conn = connect_from_env()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET statement_timeout = 0")
+            cur.execute(CREATE_SQL.format(table=args.table))
+            if args.truncate:
+                cur.execute(f"TRUNCATE {args.table}")
+            conn.commit()
+
+            columns = '(policy_number, effective_date, transaction_type, insured_state, coverage, "limit", gross_premium)'
+            for offset in range(0, args.rows, args.chunk):
+                count = min(args.chunk, args.rows - offset)
+                cur.copy_expert(f"COPY {args.table} {columns} FROM STDIN",
+                                generate_chunk(rng, args.start + offset, count, end_date))
+                conn.commit()
+                done = offset + count
+                rate = done / (time.perf_counter() - started)
+                print(f"  {done:,}/{args.rows:,} rows ({rate:,.0f} rows/s)", end='\r', flush=True)
+
+            print()
+            cur.execute(f"ANALYZE {args.table}")
+            conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Loaded {args.rows:,} rows into {args.table} in {time.perf_counter() - started:.1f}s. "
+          f"If migrations/002_kpi_daily.sql is installed, the KPI store catches up on its next refresh.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+# End-to-end load test with a stubbed Bedrock.
+#
+#   python bench/load_test.py [--concurrency 16] [--duration 30] [--mix ask=6,filters=3,kpis=1]
+#                             [--llm-latency-ms 800] [--llm-jitter-ms 200] [--cold]
+#                             [--json results.json] [--max-p95-ms 2000] [--max-error-rate 0.01]
+#
+# Runs the real app (waitress, real Postgres from .env; load data with bench/generate_data.py)
+# with bedrock.invoke_model replaced by a local stub that returns canned SQL after a configurable
+# delay, drives /ask, /filters and /kpis from concurrent keep-alive clients, and reports
+# throughput, p50/p95/p99 latency, a per-stage breakdown and peak RSS. --max-p95-ms and
+# --max-error-rate turn it into a regression gate (exit code 1 when exceeded).
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_fast_path import QUESTIONS  # noqa: E402
+
+# Chosen per question (by hash), so the same question always "generates" the same SQL
+CANNED_SQL = [
+    "SELECT insured_state, SUM(gross_premium) AS total_premium FROM insurance_policies "
+    "GROUP BY insured_state ORDER BY total_premium DESC",
+    "SELECT * FROM insurance_policies WHERE coverage ILIKE '%auto%' AND EXTRACT(YEAR FROM effective_date) = 2024",
+    "SELECT policy_number, gross_premium FROM insurance_policies ORDER BY gross_premium DESC LIMIT 10",
+    "SELECT date_trunc('month', effective_date) AS month, SUM(gross_premium) AS total_premium "
+    "FROM insurance_policies WHERE effective_date >= '2024-01-01' GROUP BY 1 ORDER BY 1",
+    "SELECT transaction_type, AVG(gross_premium) AS avg_premium FROM insurance_policies "
+    "WHERE transaction_type IN ('New', 'Renewal') GROUP BY transaction_type",
+    "SELECT COUNT(*) FROM insurance_policies WHERE limit > 1000000 AND insured_state ILIKE 'NY'",
+]
+
+FILTER_STATES = ['', '', 'CA', 'TX', 'FL', 'NY', 'IL', 'WY']
+FILTER_TYPES = ['', '', 'New', 'Renewal', 'Endorsement']
+FILTER_COVERAGES = ['', '', '', 'Auto', 'Home', '%Liability%']
+
+
+class _StubStream:
+    def __init__(self, pieces, first_delay, piece_delay):
+        self._pieces = pieces
+        self._first_delay = first_delay
+        self._piece_delay = piece_delay
+        self.closed = False
+
+    def __iter__(self):
+        for i, piece in enumerate(self._pieces):
+            if self.closed:
+                return
+            time.sleep(self._first_delay if i == 0 else self._piece_delay)
+            yield {'chunk': {'bytes': json.dumps({'completion': piece}).encode()}}
+
+    def close(self):
+        self.closed = True
+
+
+# Stands in for the bedrock-runtime client: canned SQL after latency_ms (+/- jitter_ms).
+# Streaming responses send the first token after ttft_ms and the rest spread over the remainder.
+class StubBedrock:
+    def __init__(self, latency_ms=800, jitter_ms=200, ttft_ms=300):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ttft_ms = min(ttft_ms, latency_ms)
+        self.calls = 0
+
+    def _answer(self, body):
+        self.calls += 1
+        prompt = json.loads(body)['prompt']
+        question = prompt.rsplit('Question:', 1)[-1].split('Assistant:', 1)[0].strip()
+        sql = CANNED_SQL[zlib.crc32(question.encode()) % len(CANNED_SQL)]
+        delay = max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        return f" {sql};\n\nThis query returns the requested data.", delay
+
+    def invoke_model(self, modelId, contentType, accept, body):
+        completion, delay = self._answer(body)
+        time.sleep(delay)
+        payload = {'completion': completion, 'stop_reason': 'stop_sequence'}
+        return {'body': io.BytesIO(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, contentType, accept, body):
+        completion, delay = self._answer(body)
+        pieces = [completion[i:i + 12] for i in range(0, len(completion), 12)]
+        first = min(delay, self.ttft_ms / 1000)
+        return {'body': _StubStream(pieces, first, (delay - first) / max(len(pieces) - 1, 1))}
+
+
+def random_filters(rng):
+    year = rng.randint(2019, 2025)
+    month = rng.randint(1, 10)
+    return {
+        "effectiveFrom": f"{year}-{month:02d}-01",
+        "effectiveTo": f"{year}-{month + 2:02d}-28",
+        "transactionType": rng.choice(FILTER_TYPES),
+        "insuredState": rng.choice(FILTER_STATES),
+        "coverage": rng.choice(FILTER_COVERAGES),
+        "limitMin": rng.choice(['', '', '500000']),
+        "limitMax": '',
+        "premiumMin": rng.choice(['', '', '1000']),
+        "premiumMax": ''
+    }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}   # endpoint -> list of (latency_ms, status, stages dict, path)
+
+    def add(self, endpoint, latency_ms, status, stages, path):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency_ms, status, stages, path))
+
+
+def request_once(conn, rng, endpoint):
+    if endpoint == 'ask':
+        method, url, payload = 'POST', '/ask', {"question": rng.choice(QUESTIONS)}
+    elif endpoint == 'filters':
+        method, url, payload = 'POST', '/filters', random_filters(rng)
+    else:
+        method, url, payload = 'GET', '/kpis', None
+
+    body = json.dumps(payload) if payload is not None else None
+    headers = {'Content-Type': 'application/json'} if body else {}
+    started = time.perf_counter()
+    conn.request(method, url, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    stages = {}
+    path = None
+    if response.status == 200 and endpoint != 'kpis':
+        result = json.loads(data)
+        stages['db'] = result.get('dbTimeMs') or 0.0
+        if endpoint == 'ask':
+            stages['llm'] = (result.get('llm') or {}).get('totalMs') or 0.0
+            path = result.get('path')
+        stages['app'] = max(0.0, latency_ms - sum(stages.values()))
+    return latency_ms, response.status, stages, path
+
+
+def worker(port, mix, deadline, recorder, seed, warmup_until):
+    rng = random.Random(seed)
+    endpoints, weights = zip(*mix.items())
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(endpoints, weights=weights)[0]
+        try:
+            latency_ms, status, stages, path = request_once(conn, rng, endpoint)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            latency_ms, status, stages, path = 0.0, 'conn-error', {}, None
+        if time.perf_counter() >= warmup_until:
+            recorder.add(endpoint, latency_ms, status, stages, path)
+    conn.close()
+
+
+def summarize(recorder, elapsed):
+    report = {"endpoints": {}, "elapsedSeconds": round(elapsed, 2)}
+    total = 0
+    for endpoint, samples in sorted(recorder.samples.items()):
+        ok = sorted(latency for latency, status, _, _ in samples if status == 200)
+        statuses = {}
+        for _, status, _, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        stage_totals = {}
+        for _, status, stages, _ in samples:
+            for stage, ms in stages.items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+        paths = {}
+        for _, _, _, path in samples:
+            if path:
+                paths[path] = paths.get(path, 0) + 1
+        total += len(samples)
+        report["endpoints"][endpoint] = {
+            "requests": len(samples),
+            "throughput": round(len(samples) / elapsed, 2),
+            "errorRate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+            "statuses": statuses,
+            "p50Ms": round(percentile(ok, 0.50), 2),
+            "p95Ms": round(percentile(ok, 0.95), 2),
+            "p99Ms": round(percentile(ok, 0.99), 2),
+            "maxMs": round(ok[-1], 2) if ok else 0.0,
+            "avgStageMs": {stage: round(ms / max(len(ok), 1), 2) for stage, ms in sorted(stage_totals.items())},
+            "paths": paths
+        }
+    report["throughput"] = round(total / elapsed, 2)
+    report["peakRssMb"] = peak_rss_mb()
+    return report
+
+
+# Peak RSS of this process in MB (the app runs in it). `resource` is Unix-only; elsewhere this
+# falls back to psutil (peak working set on Windows) and returns None without it.
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024), 1)
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def print_report(report, out):
+    print(f"\n{'endpoint':10} {'reqs':>7} {'req/s':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  "
+          f"avg stage ms", file=out)
+    for endpoint, r in report["endpoints"].items():
+        stages = ', '.join(f"{k} {v}" for k, v in r["avgStageMs"].items()) or '-'
+        print(f"{endpoint:10} {r['requests']:7d} {r['throughput']:8.1f} {r['errorRate'] * 100:5.1f}% "
+              f"{r['p50Ms']:8.1f} {r['p95Ms']:8.1f} {r['p99Ms']:8.1f} {r['maxMs']:8.1f}  {stages}", file=out)
+        if r["paths"]:
+            print(f"{'':10} paths: {r['paths']}  statuses: {r['statuses']}", file=out)
+        elif set(r["statuses"]) != {'200'}:
+            print(f"{'':10} statuses: {r['statuses']}", file=out)
+    print(f"\nTotal throughput: {report['throughput']} req/s over {report['elapsedSeconds']}s, "
+          f"peak RSS {report['peakRssMb'] if report['peakRssMb'] is not None else 'n/a'} MB", file=out)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('ask', 'filters', 'kpis'):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test with a stubbed Bedrock')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before that')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('ask=6,filters=3,kpis=1'),
+                        help='endpoint weights, e.g. ask=6,filters=3,kpis=1')
+    parser.add_argument('--llm-latency-ms', type=float, default=800, help='stub Bedrock response time')
+    parser.add_argument('--llm-jitter-ms', type=float, default=200, help='+/- random jitter on that')
+    parser.add_argument('--llm-ttft-ms', type=float, default=300, help='stub time to first streamed token')
+    parser.add_argument('--server-threads', type=int, default=32, help='waitress worker threads')
+    parser.add_argument('--cold', action='store_true', help='disable the NL, result and fast-path shortcuts')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the request mix')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--max-p95-ms', type=float, help='fail if any endpoint p95 exceeds this')
+    parser.add_argument('--max-error-rate', type=float, help='fail if any endpoint error rate exceeds this')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's request logging")
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    if not args.verbose:
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.cold:
+        os.environ['NL_CACHE_MAX_ENTRIES'] = '0'
+        os.environ['RESULT_CACHE_MAX_MB'] = '0'
+        os.environ['FAST_PATH_ENABLED'] = '0'
+
+    from waitress.server import create_server
+    import app as service
+
+    service.bedrock = StubBedrock(args.llm_latency_ms, args.llm_jitter_ms, args.llm_ttft_ms)
+    server = create_server(service.app, host='127.0.0.1', port=0, threads=args.server_threads)
+    threading.Thread(target=server.run, name='load-test-server', daemon=True).start()
+    port = server.effective_port
+
+    out = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    print(f"Driving http://127.0.0.1:{port} with {args.concurrency} clients for {args.warmup}s warm-up "
+          f"+ {args.duration}s, mix {args.mix}, stub LLM {args.llm_latency_ms}ms", file=out)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    threads = [threading.Thread(target=worker, args=(port, args.mix, deadline, recorder, args.seed + i, warmup_until))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - warmup_until
+
+    if not args.verbose:
+        sys.stdout.close()
+        sys.stdout = out
+
+    report = summarize(recorder, elapsed)
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ('json', 'verbose')}
+    report["bedrockCalls"] = service.bedrock.calls
+    print_report(report, out)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = []
+    for endpoint, r in report["endpoints"].items():
+        if args.max_p95_ms is not None and r["p95Ms"] > args.max_p95_ms:
+            failed.append(f"{endpoint} p95 {r['p95Ms']}ms > {args.max_p95_ms}ms")
+        if args.max_error_rate is not None and r["errorRate"] > args.max_error_rate:
+            failed.append(f"{endpoint} error rate {r['errorRate']} > {args.max_error_rate}")
+    if failed:
+        print("FAILED: " + '; '.join(failed), file=out)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
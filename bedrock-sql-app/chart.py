@@ -0,0 +1,220 @@
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+# Time buckets from finest to coarsest, with labels that sort chronologically as strings
+_BUCKETS = [
+    ('day', lambda d: d.isoformat()),
+    ('week', lambda d: date.fromordinal(d.toordinal() - d.weekday()).isoformat()),
+    ('month', lambda d: f"{d.year}-{d.month:02d}"),
+    ('quarter', lambda d: f"{d.year}-Q{(d.month - 1) // 3 + 1}"),
+    ('year', lambda d: str(d.year)),
+]
+_NUMERIC = (int, float, Decimal)
+OTHER_LABEL = 'Other'
+
+
+# Turns /ask result rows into a compact Chart.js series.
+#
+# Rows that repeat an x value are grouped and aggregated, bar/pie categories are capped at the
+# top `max_categories` plus "Other", and line series longer than `max_points` are bucketed by
+# day/week/month/quarter/year when x is a date, or reduced with LTTB otherwise.
+class ChartBuilder:
+    def __init__(self, max_points=200, max_categories=12):
+        self.max_points = max_points
+        self.max_categories = max_categories
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_points=int(os.getenv('CHART_MAX_POINTS', '200')),
+            max_categories=int(os.getenv('CHART_MAX_CATEGORIES', '12'))
+        )
+
+    def build(self, chart_type, columns, rows):
+        if not rows:
+            return None
+        kinds = _column_kinds(columns, rows)
+        x_index, y_index = _pick_fields(chart_type, columns, kinds, rows)
+        if x_index is None:
+            return None
+        y_field = columns[y_index] if y_index is not None else 'count'
+        agg = _aggregation(y_field) if y_index is not None else 'count'
+        temporal = kinds[x_index] == 'date'
+
+        groups = {}
+        for row in rows:
+            x = row[x_index]
+            if isinstance(x, datetime):
+                x = x.date() if temporal and x.time() == datetime.min.time() else x
+            _add(groups, x, row[y_index] if y_index is not None else 1)
+        method = 'grouped' if len(groups) < len(rows) else 'none'
+
+        if chart_type == 'line' or (temporal and chart_type == 'bar'):
+            points = sorted(((x, state) for x, state in groups.items() if x is not None), key=lambda p: p[0])
+            if temporal and len(points) > self.max_points:
+                points, bucket = _bucket(points, self.max_points)
+                method = f"bucket:{bucket}"
+            labels = [_label(x) for x, _ in points]
+            values = [_value(state, agg) for _, state in points]
+            if len(labels) > self.max_points >= 3:
+                labels, values = _lttb(labels, values, [_x_number(x) for x, _ in points], self.max_points)
+                method = 'lttb'
+        else:
+            ranked = sorted(groups.items(), key=lambda item: _value(item[1], agg) or 0, reverse=True)
+            if len(ranked) > self.max_categories:
+                rest = [0.0, 0, None, None]
+                for _, state in ranked[self.max_categories - 1:]:
+                    _merge(rest, state)
+                ranked = ranked[:self.max_categories - 1] + [(OTHER_LABEL, rest)]
+                method = f"top:{self.max_categories - 1}+other"
+            labels = [_label(x) for x, _ in ranked]
+            values = [_value(state, agg) for _, state in ranked]
+
+        return {
+            "type": chart_type,
+            "labels": labels,
+            "datasets": [{"label": y_field, "data": values}],
+            "xField": columns[x_index],
+            "yField": y_field,
+            "aggregation": agg,
+            "method": method,
+            "sourceRows": len(rows)
+        }
+
+
+# 'number', 'date', 'text' or None (all null) per column, from the first non-null value
+def _column_kinds(columns, rows):
+    kinds = []
+    for i in range(len(columns)):
+        value = next((row[i] for row in rows[:50] if row[i] is not None), None)
+        if isinstance(value, bool) or value is None:
+            kinds.append(None if value is None else 'text')
+        elif isinstance(value, _NUMERIC):
+            kinds.append('number')
+        elif isinstance(value, (date, datetime)):
+            kinds.append('date')
+        else:
+            kinds.append('text')
+    return kinds
+
+
+# x: a date for line charts, else the text column with the fewest distinct values (a dimension
+# rather than an id like policy_number); y: the last numeric column (aggregates usually come
+# after the dimensions in the SELECT list)
+def _pick_fields(chart_type, columns, kinds, rows):
+    dates = [i for i, kind in enumerate(kinds) if kind == 'date']
+    sample = rows[:1000]
+    texts = sorted((i for i, kind in enumerate(kinds) if kind == 'text'),
+                   key=lambda i: len({row[i] for row in sample}))
+    numbers = [i for i, kind in enumerate(kinds) if kind == 'number']
+    if chart_type == 'line':
+        x_candidates = dates + texts + numbers[:-1]
+    else:
+        x_candidates = texts + dates
+    x_index = x_candidates[0] if x_candidates else None
+    y_candidates = [i for i in numbers if i != x_index]
+    return x_index, (y_candidates[-1] if y_candidates else None)
+
+
+def _aggregation(y_field):
+    name = y_field.lower()
+    if name.startswith(('avg', 'average', 'mean')) or 'rate' in name or 'ratio' in name:
+        return 'avg'
+    if name.startswith('max'):
+        return 'max'
+    if name.startswith('min'):
+        return 'min'
+    return 'sum'
+
+
+# Group state: [sum, count, min, max]
+def _add(groups, x, y):
+    state = groups.get(x)
+    if state is None:
+        state = groups[x] = [0.0, 0, None, None]
+    if y is None:
+        return
+    y = float(y)
+    state[0] += y
+    state[1] += 1
+    state[2] = y if state[2] is None else min(state[2], y)
+    state[3] = y if state[3] is None else max(state[3], y)
+
+
+def _merge(into, state):
+    into[0] += state[0]
+    into[1] += state[1]
+    for i, pick in ((2, min), (3, max)):
+        if state[i] is not None:
+            into[i] = state[i] if into[i] is None else pick(into[i], state[i])
+
+
+def _value(state, agg):
+    if agg == 'count':
+        return state[1]
+    if agg == 'avg':
+        return round(state[0] / state[1], 4) if state[1] else None
+    if agg == 'min':
+        return state[2]
+    if agg == 'max':
+        return state[3]
+    return round(state[0], 4)
+
+
+def _bucket(points, max_points):
+    for name, label in _BUCKETS:
+        buckets = {}
+        for x, state in points:
+            day = x.date() if isinstance(x, datetime) else x
+            _merge(buckets.setdefault(label(day), [0.0, 0, None, None]), state)
+        if len(buckets) <= max_points or name == 'year':
+            return sorted(buckets.items()), name
+
+
+def _label(x):
+    if x is None:
+        return 'Unknown'
+    if isinstance(x, (date, datetime)):
+        return x.isoformat()
+    if isinstance(x, Decimal):
+        return float(x)
+    return x
+
+
+def _x_number(x):
+    if isinstance(x, datetime):
+        return x.timestamp()
+    if isinstance(x, date):
+        return x.toordinal()
+    if isinstance(x, _NUMERIC):
+        return float(x)
+    return None
+
+
+# Largest-Triangle-Three-Buckets: keeps the first and last points and, from each of the
+# threshold - 2 buckets in between, the point forming the largest triangle with its neighbours
+def _lttb(labels, values, xs, threshold):
+    n = len(values)
+    if any(x is None for x in xs):
+        xs = list(range(n))
+    ys = [v if v is not None else 0.0 for v in values]
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return [labels[i] for i in keep], [values[i] for i in keep]
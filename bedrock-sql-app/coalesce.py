@@ -0,0 +1,67 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# Single-flight: concurrent calls with the same key share one execution.
+#
+# The first caller (the leader) runs the function; callers arriving while it runs wait and get
+# its result, or its exception re-raised. Nothing is kept once the call finishes, so there is no
+# staleness beyond the duration of one call. Exceptions in `retry_on` are not shared: each waiter
+# then makes its own call (e.g. the leader's query was cancelled on behalf of its own session).
+class SingleFlight:
+    def __init__(self, name, retry_on=()):
+        self.name = name
+        self.retry_on = retry_on
+        self._lock = threading.Lock()
+        self._calls = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+
+    # Returns (result, coalesced). `share(result)` is called by the leader once per waiter before
+    # they are released, for results that need a reference per user.
+    def do(self, key, fn, share=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                if isinstance(call.error, self.retry_on):
+                    return fn(), False
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            if share is not None and call.error is None:
+                for _ in range(waiters):
+                    share(call.result)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "inFlight": len(self._calls)}
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Raised when an upstream's queue is full; the app turns this into a 429
+class Overloaded(Exception):
+    def __init__(self, upstream, message, retry_after=1):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+# Raised when a pipeline stage runs past its deadline; the app turns this into a 504
+class StageTimeout(Exception):
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+# Caps how many requests may use one upstream (Bedrock, Postgres) at the same time.
+#
+# Up to `max_concurrent` callers run; up to `max_waiting` more queue for at most `wait_timeout`
+# seconds. Anyone beyond that is rejected straight away so a slow upstream can't pile up every
+# worker thread behind it.
+class Bulkhead:
+    def __init__(self, name, max_concurrent, max_waiting, wait_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_env(cls, name, max_concurrent, max_waiting, wait_timeout):
+        prefix = name.upper()
+        return cls(
+            name,
+            max_concurrent=int(os.getenv(f'{prefix}_MAX_CONCURRENCY', str(max_concurrent))),
+            max_waiting=int(os.getenv(f'{prefix}_MAX_QUEUE', str(max_waiting))),
+            wait_timeout=float(os.getenv(f'{prefix}_QUEUE_TIMEOUT', str(wait_timeout)))
+        )
+
+    def _acquire(self):
+        with self._cond:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                return
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded(self.name, f"Too many concurrent {self.name} requests, please retry")
+
+            deadline = time.monotonic() + self.wait_timeout
+            self._waiting += 1
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise Overloaded(self.name, f"Timed out waiting for a free {self.name} slot")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self.completed += 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "maxConcurrency": self.max_concurrent,
+                "maxQueue": self.max_waiting,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timedOut": self.timed_out
+            }
@@ -0,0 +1,146 @@
+import re
+from datetime import date, timedelta
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'jun': 6, 'jul': 7, 'aug': 8,
+    'sep': 9, 'sept': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+ORDINAL_QUARTERS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4}
+
+_MONTH = '(?:' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + ')'
+_YEAR = r'\d{4}'
+
+# Every supported phrase in one alternation, tried left to right at each position.
+# More specific forms ("in April last year") come before the shorter ones they contain ("in April",
+# "last year"), and take the same optional "in"/"from" so they match at the same start position.
+DATE_PHRASE_RE = re.compile(
+    r'\b(?:'
+    rf'(?P<month_year>(?:in|from)\s+(?P<my_month>{_MONTH})\s+(?P<my_year>{_YEAR}))'
+    rf'|(?P<month_rel>(?P<mr_prefix>(?:in|from)\s+)?(?P<mr_month>{_MONTH})\s+(?P<mr_which>last|this)\s+year)'
+    rf'|(?P<quarter>(?:in\s+|from\s+)?(?:q(?P<q_num>[1-4])|(?P<q_ord>first|second|third|fourth)\s+quarter)'
+    rf'(?:\s+(?:of\s+)?(?P<q_year>{_YEAR}))?)'
+    r'|(?P<quarter_rel>(?:from\s+|in\s+)?(?P<qr_which>last|this)\s+quarter)'
+    r'|(?P<last_n>(?:in\s+|from\s+|over\s+)?(?:the\s+)?(?:last|past|previous)\s+(?P<n>\d+)\s+(?P<n_unit>days?|weeks?|months?))'
+    r'|(?P<to_date>(?P<td_unit>ytd|mtd|qtd|year\s+to\s+date|month\s+to\s+date|quarter\s+to\s+date))'
+    r'|(?P<relative>(?:from\s+)?(?P<rel_which>last|this)\s+(?P<rel_unit>month|year|week))'
+    r'|(?P<day>(?P<day_which>today|yesterday))'
+    rf'|(?P<month_only>(?:in|from)\s+(?P<mo_month>{_MONTH}))'
+    r')\b',
+    re.IGNORECASE
+)
+_ANY_YEAR_RE = re.compile(r'\b\d{4}\b')
+
+
+def _iso(d):
+    return d.strftime('%Y-%m-%d')
+
+
+def _month_end(year, month):
+    if month == 12:
+        return date(year, 12, 31)
+    return date(year, month + 1, 1) - timedelta(days=1)
+
+
+def _add_months(d, months):
+    month_index = d.year * 12 + d.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(d.day, _month_end(year, month).day))
+
+
+def _quarter_bounds(year, quarter):
+    first_month = (quarter - 1) * 3 + 1
+    return date(year, first_month, 1), _month_end(year, first_month + 2)
+
+
+# Month phrases keep the original "effective_date BETWEEN ..." form; relative phrases keep "between ..."
+def _column_range(start, end):
+    return f"effective_date BETWEEN '{_iso(start)}' AND '{_iso(end)}'"
+
+
+def _between(start, end):
+    return f"between '{_iso(start)}' and '{_iso(end)}'"
+
+
+def _resolve(match, today, question_has_year):
+    group = match.group
+
+    if group('month_year'):
+        year, month = int(group('my_year')), MONTHS[group('my_month').lower()]
+        return _column_range(date(year, month, 1), _month_end(year, month))
+
+    if group('month_rel'):
+        year = today.year - 1 if group('mr_which').lower() == 'last' else today.year
+        month = MONTHS[group('mr_month').lower()]
+        # "in April last year" keeps its "in", as the month-name replacement always did
+        return (group('mr_prefix') or '') + _column_range(date(year, month, 1), _month_end(year, month))
+
+    if group('quarter'):
+        quarter = int(group('q_num')) if group('q_num') else ORDINAL_QUARTERS[group('q_ord').lower()]
+        year = int(group('q_year')) if group('q_year') else today.year
+        return _between(*_quarter_bounds(year, quarter))
+
+    if group('quarter_rel'):
+        quarter = (today.month - 1) // 3 + 1
+        year = today.year
+        if group('qr_which').lower() == 'last':
+            quarter -= 1
+            if quarter == 0:
+                quarter, year = 4, year - 1
+        return _between(*_quarter_bounds(year, quarter))
+
+    if group('last_n'):
+        n = int(group('n'))
+        unit = group('n_unit').lower()
+        if unit.startswith('day'):
+            start = today - timedelta(days=n - 1)
+        elif unit.startswith('week'):
+            start = today - timedelta(days=7 * n - 1)
+        else:
+            start = _add_months(today, -n) + timedelta(days=1)
+        return _between(start, today)
+
+    if group('to_date'):
+        unit = group('td_unit').lower()
+        if unit[0] == 'y':
+            start = date(today.year, 1, 1)
+        elif unit[0] == 'q':
+            start = _quarter_bounds(today.year, (today.month - 1) // 3 + 1)[0]
+        else:
+            start = today.replace(day=1)
+        return _between(start, today)
+
+    if group('relative'):
+        last = group('rel_which').lower() == 'last'
+        unit = group('rel_unit').lower()
+        if unit == 'month':
+            first = today.replace(day=1)
+            if last:
+                first = _add_months(first, -1)
+            return _between(first, _month_end(first.year, first.month))
+        if unit == 'year':
+            year = today.year - 1 if last else today.year
+            return _between(date(year, 1, 1), date(year, 12, 31))
+        start_of_week = today - timedelta(days=today.weekday())
+        if last:
+            start_of_week -= timedelta(days=7)
+        return _between(start_of_week, start_of_week + timedelta(days=6))
+
+    if group('day'):
+        day = today if group('day_which').lower() == 'today' else today - timedelta(days=1)
+        return _between(day, day)
+
+    # "in April" with no year anywhere in the question means April of every year
+    if question_has_year:
+        return match.group(0)
+    return f"EXTRACT(MONTH FROM effective_date) = {MONTHS[group('mo_month').lower()]}"
+
+
+# Rewrites date phrases ("in April 2024", "last month", "Q3", "last 30 days", "YTD", ...)
+# into literal date ranges in one scan. `today` can be injected for deterministic results.
+def preprocess_question(question, today=None):
+    today = today or date.today()
+    question_has_year = bool(_ANY_YEAR_RE.search(question))
+    return DATE_PHRASE_RE.sub(lambda m: _resolve(m, today, question_has_year), question)
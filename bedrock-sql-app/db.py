@@ -0,0 +1,444 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+log = logging.getLogger('sqlapp.db')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Opens a single raw connection using the PG_* settings from .env
+def connect_from_env():
+    return psycopg2.connect(
+        host=os.getenv('PG_HOST'),
+        port=os.getenv('PG_PORT'),
+        database=os.getenv('PG_DB') or os.getenv('PG_DATABASE'),
+        user=os.getenv('PG_USER'),
+        password=os.getenv('PG_PASSWORD'),
+        connect_timeout=int(os.getenv('PG_CONNECT_TIMEOUT', '10')),
+        options=f"-c statement_timeout={int(os.getenv('PG_STATEMENT_TIMEOUT_MS', '15000'))}"
+    )
+
+
+# Opens a connection to a libpq DSN (a read replica), with the same timeouts as the primary
+def connect_dsn(dsn):
+    return psycopg2.connect(
+        dsn,
+        connect_timeout=int(os.getenv('PG_CONNECT_TIMEOUT', '10')),
+        options=f"-c statement_timeout={int(os.getenv('PG_STATEMENT_TIMEOUT_MS', '15000'))}"
+    )
+
+
+# Thread-safe PostgreSQL connection pool.
+#
+# - keeps between `minconn` and `maxconn` connections open
+# - callers block (up to `timeout` seconds) when every connection is checked out
+# - idle connections are pinged with SELECT 1 before reuse if they sat longer than `health_check_after`
+# - connections idle longer than `max_idle` are closed, down to `minconn`
+class ConnectionPool:
+    def __init__(self, connect=connect_from_env, minconn=1, maxconn=10, timeout=5.0,
+                 max_idle=300.0, health_check_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()        # (conn, last_used) — most recently returned on the right
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._opened = 0
+        self._discarded = 0
+        self._evicted = 0
+        self._checkout_ms = deque(maxlen=1024)
+
+    @classmethod
+    def from_env(cls, connect=connect_from_env):
+        return cls(
+            connect=connect,
+            minconn=int(os.getenv('PG_POOL_MIN', '1')),
+            maxconn=int(os.getenv('PG_POOL_MAX', '10')),
+            timeout=float(os.getenv('PG_POOL_TIMEOUT', '5')),
+            max_idle=float(os.getenv('PG_POOL_MAX_IDLE', '300')),
+            health_check_after=float(os.getenv('PG_POOL_HEALTH_CHECK_AFTER', '30'))
+        )
+
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _evict_idle(self, now):
+        # Oldest idle connections sit on the left; stop once we hit one still fresh
+        while self._idle and self._total() > self.minconn:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.max_idle:
+                break
+            self._idle.popleft()
+            self._evicted += 1
+            _close_quietly(conn)
+
+    def _is_healthy(self, conn, last_used, now):
+        if conn.closed:
+            return False
+        if now - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _open(self):
+        conn = self._connect()
+        conn.autocommit = False
+        return conn
+
+    def getconn(self):
+        started = time.perf_counter()
+        deadline = started + self.timeout
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                now = time.monotonic()
+                self._evict_idle(now)
+
+                conn = None
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._total() < self.maxconn:
+                    self._opening += 1
+                else:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No PostgreSQL connection available after {self.timeout}s")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    continue
+
+                if conn is not None:
+                    self._in_use.add(conn)
+
+            # Health check / connect outside the lock so other threads are not blocked on I/O
+            if conn is not None:
+                if self._is_healthy(conn, last_used, now):
+                    break
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._discarded += 1
+                    self._cond.notify()
+                _close_quietly(conn)
+                continue
+
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._opened += 1
+                self._in_use.add(conn)
+            break
+
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_ms.append((time.perf_counter() - started) * 1000)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        # Never hand a connection back with an open transaction or a broken socket
+        if not discard and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if discard or conn.closed or self._closed:
+                self._discarded += 1
+                to_close = conn
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = None
+            self._cond.notify()
+
+        if to_close is not None:
+            _close_quietly(to_close)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            self.putconn(conn, discard=True)
+            raise
+        except psycopg2.OperationalError:
+            # Server went away mid-query; don't put a dead socket back in the pool
+            self.putconn(conn, discard=conn.closed != 0)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            samples = sorted(self._checkout_ms)
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "inUse": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "total": self._total(),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "opened": self._opened,
+                "discarded": self._discarded,
+                "evicted": self._evicted,
+                "checkoutLatencyMs": {
+                    "avg": round(sum(samples) / len(samples), 3) if samples else 0.0,
+                    "p95": _percentile(samples, 0.95),
+                    "max": round(samples[-1], 3) if samples else 0.0
+                }
+            }
+
+
+# Replay lag in seconds; 0 on the primary and on a streaming replica that has replayed everything
+# it received (now() - pg_last_xact_replay_timestamp() alone keeps growing on an idle but current
+# replica). NULL when the WAL receiver isn't streaming: receive = replay also holds on a replica
+# that lost its primary, however far behind it is. Seeing the receiver's status takes
+# pg_read_all_stats (e.g. GRANT pg_monitor) on the replica; without it a replica never qualifies.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class _Node:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.outstanding = 0
+        self.routed = 0
+        self.errors = 0
+        self.lag = None             # seconds, from the last lag check (None = not checked yet)
+        self.down_until = 0.0
+        self.last_error = None
+
+
+# Routes read-only queries across PostgreSQL read replicas.
+#
+# - each replica (PG_REPLICA_DSNS) gets its own ConnectionPool; reads go to the available replica
+#   with the fewest outstanding requests, writes and everything else to the primary
+# - a replica is skipped while its replay lag is over `max_lag` (checked every `check_interval`
+#   seconds by a background thread) and for `retry_after` seconds after a connection error
+# - a read that fails on a replica with a connection error is retried once on the primary
+class ReplicaRouter:
+    def __init__(self, primary, replicas=(), max_lag=30.0, retry_after=30.0, check_interval=5.0):
+        self.primary = _Node('primary', primary)
+        self.replicas = [_Node(name, pool) for name, pool in replicas]
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.failovers = {"error": 0, "busy": 0, "unavailable": 0}
+
+    @classmethod
+    def from_env(cls, primary):
+        dsns = [dsn.strip() for dsn in os.getenv('PG_REPLICA_DSNS', '').split(',') if dsn.strip()]
+        replicas = []
+        for i, dsn in enumerate(dsns, 1):
+            pool = ConnectionPool(
+                connect=lambda dsn=dsn: connect_dsn(dsn),
+                minconn=0,
+                maxconn=int(os.getenv('PG_REPLICA_POOL_MAX', os.getenv('PG_POOL_MAX', '10'))),
+                timeout=float(os.getenv('PG_REPLICA_POOL_TIMEOUT', '1')),
+                max_idle=float(os.getenv('PG_POOL_MAX_IDLE', '300')),
+                health_check_after=float(os.getenv('PG_POOL_HEALTH_CHECK_AFTER', '30'))
+            )
+            replicas.append((f"replica{i}", pool))
+        return cls(
+            primary,
+            replicas,
+            max_lag=float(os.getenv('PG_REPLICA_MAX_LAG_SECONDS', '30')),
+            retry_after=float(os.getenv('PG_REPLICA_RETRY_AFTER', '30')),
+            check_interval=float(os.getenv('PG_REPLICA_CHECK_INTERVAL', '5'))
+        )
+
+    # Connections the router can hand out at once, for sizing the db bulkhead
+    def capacity(self):
+        return self.primary.pool.maxconn + sum(node.pool.maxconn for node in self.replicas)
+
+    def _available(self, node, now):
+        return node.down_until <= now and node.lag is not None and node.lag <= self.max_lag
+
+    # Nodes to try in order: the least busy available replica for reads, then the primary
+    def route(self, read_only=True):
+        if read_only and self.replicas:
+            now = time.monotonic()
+            with self._lock:
+                available = [node for node in self.replicas if self._available(node, now)]
+                if available:
+                    return [min(available, key=lambda node: (node.outstanding, node.routed)), self.primary]
+                self.failovers["unavailable"] += 1
+        return [self.primary]
+
+    @contextmanager
+    def connection(self, node):
+        with self._lock:
+            node.outstanding += 1
+            node.routed += 1
+        try:
+            with node.pool.connection() as conn:
+                yield conn
+        finally:
+            with self._lock:
+                node.outstanding -= 1
+
+    # Whether a read that raised `error` on `node` should be retried on the next node. Replicas
+    # that can't be reached are taken out of rotation; SQL errors and cancellations are not retried.
+    def failover(self, node, error):
+        if node is self.primary:
+            return False
+        if isinstance(error, PoolTimeout):
+            with self._lock:
+                self.failovers["busy"] += 1
+            return True
+        if isinstance(error, psycopg2.errors.QueryCanceled) or not isinstance(
+                error, (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.errors.SerializationFailure)):
+            return False
+        with self._lock:
+            node.errors += 1
+            node.last_error = str(error).strip()
+            node.down_until = time.monotonic() + self.retry_after
+            self.failovers["error"] += 1
+        log.warning("[Replica Router] %s failed, using the primary for %.0fs: %s", node.name, self.retry_after, error,
+                    exc_info=error)
+        return True
+
+    # Runs work(conn) on the routed node, failing over to the primary; returns (result, node)
+    def read(self, work):
+        for node in self.route(read_only=True):
+            try:
+                with self.connection(node) as conn:
+                    return work(conn), node
+            except Exception as e:
+                if not self.failover(node, e):
+                    raise
+
+    def check(self):
+        for node in self.replicas:
+            try:
+                with node.pool.connection() as conn, conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    lag = cur.fetchone()[0]
+                with self._lock:
+                    if lag is None:
+                        # Over any PG_REPLICA_MAX_LAG_SECONDS, and never the lag == 0 that lets results be cached
+                        node.lag = float('inf')
+                        node.last_error = "WAL receiver is not streaming"
+                    else:
+                        node.lag = float(lag)
+                        node.last_error = None
+            except Exception as e:
+                with self._lock:
+                    node.lag = None
+                    node.errors += 1
+                    node.last_error = str(e).strip()
+
+    def _run(self):
+        while True:
+            self.check()
+            if self._stop.wait(self.check_interval):
+                return
+
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="replica-lag-check", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            nodes = [{
+                "name": node.name,
+                "available": node is self.primary or self._available(node, now),
+                "outstanding": node.outstanding,
+                "routed": node.routed,
+                "errors": node.errors,
+                # Not streaming shows as null with lastError set, since JSON has no Infinity
+                "lagSeconds": None if node is self.primary or node.lag == float('inf') else node.lag,
+                "lastError": node.last_error
+            } for node in [self.primary, *self.replicas]]
+            return {"maxLagSeconds": self.max_lag, "failovers": dict(self.failovers), "nodes": nodes}
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _percentile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * q))
+    return round(sorted_samples[index], 3)
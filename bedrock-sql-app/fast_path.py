@@ -0,0 +1,216 @@
+import re
+from collections import namedtuple
+
+from nl_cache import US_STATES
+
+FastPathMatch = namedtuple('FastPathMatch', ['sql', 'params', 'intent'])
+
+TABLE = 'insurance_policies'
+LIST_COLUMNS = 'policy_number, effective_date, transaction_type, insured_state, coverage, "limit", gross_premium'
+
+TRANSACTION_TYPES = {
+    'new': 'New', 'renewal': 'Renewal', 'endorsement': 'Endorsement',
+    'reinstate': 'Reinstate', 'reinstatement': 'Reinstate', 'cancellation': 'Cancellation',
+    'audit': 'Audit'
+}
+
+MEASURES = {
+    'gross premium': ('gross_premium', 'premium'), 'premium': ('gross_premium', 'premium'),
+    'policy limit': ('"limit"', 'limit'), 'limit': ('"limit"', 'limit'),
+    'coverage limit': ('"limit"', 'limit')
+}
+
+AGGREGATES = {
+    'total': ('SUM', 'total'), 'sum of': ('SUM', 'total'), 'sum': ('SUM', 'total'),
+    'average': ('AVG', 'average'), 'avg': ('AVG', 'average'), 'mean': ('AVG', 'average'),
+    'maximum': ('MAX', 'max'), 'max': ('MAX', 'max'), 'highest': ('MAX', 'max'), 'largest': ('MAX', 'max'),
+    'minimum': ('MIN', 'min'), 'min': ('MIN', 'min'), 'lowest': ('MIN', 'min'), 'smallest': ('MIN', 'min')
+}
+
+DIMENSIONS = {
+    'insured state': 'insured_state', 'state': 'insured_state',
+    'coverage type': 'coverage', 'coverage': 'coverage',
+    'transaction type': 'transaction_type', 'transaction': 'transaction_type',
+    'month': "date_trunc('month', effective_date)::date", 'year': 'EXTRACT(YEAR FROM effective_date)::int'
+}
+DIMENSION_ALIASES = {
+    "date_trunc('month', effective_date)::date": 'month',
+    'EXTRACT(YEAR FROM effective_date)::int': 'year'
+}
+
+
+def _select_dimension(dim):
+    alias = DIMENSION_ALIASES.get(dim)
+    return (f"{dim} AS {alias}", alias) if alias else (dim, dim)
+
+COMPARATORS = {
+    'above': '>', 'over': '>', 'greater than': '>', 'more than': '>', 'exceeding': '>', '>': '>',
+    'higher than': '>', 'at least': '>=', '>=': '>=',
+    'below': '<', 'under': '<', 'less than': '<', 'lower than': '<', '<': '<', 'at most': '<=', '<=': '<='
+}
+
+# Words that carry no meaning once the recognised pieces are removed. Anything else left over
+# means the question says something the rules don't understand, so Bedrock handles it.
+FILLER = {
+    'show', 'list', 'get', 'give', 'me', 'all', 'the', 'a', 'an', 'of', 'for', 'in', 'from', 'with',
+    'what', 'whats', 'is', 'are', 'was', 'were', 'policies', 'policy', 'issued', 'effective',
+    'written', 'and', 'please', 'our', 'across', 'records', 'which', 'do', 'we', 'have', 'display',
+    'find', 'tell', 'us', 'chart', 'graph', 'pie', 'bar', 'visualize', 'plot', 'distribution',
+    'compare', 'comparison', 'share', 'proportion', 'breakdown', 'each', 'per', 'by', 'that',
+    'where', 'dated', 'on', 'can', 'you', 'business', 'amount', 'value', 'number', 'count', 'to',
+    'type', 'types', 'policys', 'insured', 'data', 'date', 'dates', 'between', 's'
+}
+
+_DATE_RANGE_RE = re.compile(
+    r"(?:effective_date\s+)?between\s+'(\d{4}-\d{2}-\d{2})'\s+and\s+'(\d{4}-\d{2}-\d{2})'", re.IGNORECASE)
+_MONTH_FILTER_RE = re.compile(r'extract\s*\(\s*month\s+from\s+effective_date\s*\)\s*=\s*(\d{1,2})', re.IGNORECASE)
+_MEASURE = '(?P<measure>' + '|'.join(sorted(MEASURES, key=len, reverse=True)) + ')s?'
+_COMPARATOR = '(?P<op>' + '|'.join(sorted((re.escape(c) for c in COMPARATORS), key=len, reverse=True)) + ')'
+_NUMERIC_FILTER_RE = re.compile(
+    rf'\b{_MEASURE}\s+(?:of\s+|is\s+)?{_COMPARATOR}\s+\$?(?P<num>\d[\d,]*(?:\.\d+)?)\s*(?P<scale>k|m|million|thousand)?\b',
+    re.IGNORECASE)
+_DIMENSION = '(?P<dim>' + '|'.join(sorted(DIMENSIONS, key=len, reverse=True)) + ')s?'
+_TOP_RE = re.compile(rf'\b(?:most\s+common|most\s+frequent|most\s+popular|top)\s+{_DIMENSION}\b', re.IGNORECASE)
+_GROUP_RE = re.compile(rf'\b(?:by|per|for\s+each|across|broken\s+down\s+by)\s+{_DIMENSION}\b', re.IGNORECASE)
+_COUNT_RE = re.compile(
+    r'\b(?:total\s+number\s+of|number\s+of|count\s+of|how\s+many|count)\s+(?:policies|policy)?\b', re.IGNORECASE)
+_AGGREGATE_RE = re.compile(
+    r'\b(?P<agg>' + '|'.join(sorted(AGGREGATES, key=len, reverse=True)) + r')\s+(?:of\s+)?(?:policy\s+)?'
+    + _MEASURE + r'\b', re.IGNORECASE)
+_BARE_MEASURE_RE = re.compile(r'\b' + _MEASURE + r'\b', re.IGNORECASE)
+_STATE_NAME_RE = re.compile(r'\b(' + '|'.join(sorted(US_STATES, key=len, reverse=True)) + r')\b', re.IGNORECASE)
+_STATE_CODE_RE = re.compile(r'\b([A-Z]{2})\b')
+_TRANSACTION_RE = re.compile(
+    r'\b(' + '|'.join(sorted(TRANSACTION_TYPES, key=len, reverse=True)) + r')s?\b', re.IGNORECASE)
+_COVERAGE_RE = re.compile(r"\b(?:for\s+|with\s+)?([a-z][\w&'-]*)\s+coverage\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z_]+|\d+", re.IGNORECASE)
+
+
+def _take(pattern, text, handler):
+    # Applies `handler` to every match and blanks the matched span out of the text
+    return pattern.sub(lambda m: handler(m) or ' ', text)
+
+
+def _number(match):
+    value = float(match.group('num').replace(',', ''))
+    scale = (match.group('scale') or '').lower()
+    if scale in ('k', 'thousand'):
+        value *= 1_000
+    elif scale in ('m', 'million'):
+        value *= 1_000_000
+    return int(value) if value.is_integer() else value
+
+
+# Parses a preprocessed question into parameterized SQL, or returns None when it isn't sure
+def match_question(question):
+    conditions = []
+    params = []
+    # Text column -> values named for it; "CA and TX" or "renewal and new" means either value
+    text_filters = {}
+    state = {'aggregate': None, 'count': False, 'group': None, 'top': None}
+    text = question
+
+    def date_range(m):
+        conditions.append('effective_date BETWEEN %s AND %s')
+        params.extend([m.group(1), m.group(2)])
+
+    def month_filter(m):
+        conditions.append('EXTRACT(MONTH FROM effective_date) = %s')
+        params.append(int(m.group(1)))
+
+    def numeric_filter(m):
+        column = MEASURES[m.group('measure').lower()][0]
+        conditions.append(f"{column} {COMPARATORS[m.group('op').lower()]} %s")
+        params.append(_number(m))
+
+    def top(m):
+        state['top'] = DIMENSIONS[m.group('dim').lower()]
+
+    def group(m):
+        if state['group'] is not None:
+            state['group'] = False      # two GROUP BY dimensions: leave it to Claude
+        else:
+            state['group'] = DIMENSIONS[m.group('dim').lower()]
+
+    def count(m):
+        state['count'] = True
+
+    def aggregate_of(func, measure):
+        if state['aggregate'] is not None:
+            state['aggregate'] = False  # two measures in one question
+        else:
+            state['aggregate'] = (func, MEASURES[measure.lower()])
+
+    def aggregate(m):
+        aggregate_of(AGGREGATES[m.group('agg').lower()], m.group('measure'))
+
+    def text_filter(column, value):
+        values = text_filters.setdefault(column, [])
+        if value.lower() not in (v.lower() for v in values):
+            values.append(value)
+
+    def state_filter(code):
+        text_filter('insured_state', code.upper())
+
+    def transaction(m):
+        text_filter('transaction_type', TRANSACTION_TYPES[m.group(1).lower()])
+
+    def coverage(m):
+        if m.group(1).lower() in FILLER:
+            return m.group(0)
+        text_filter('coverage', m.group(1))
+
+    text = _take(_DATE_RANGE_RE, text, date_range)
+    text = _take(_MONTH_FILTER_RE, text, month_filter)
+    text = _take(_NUMERIC_FILTER_RE, text, numeric_filter)
+    text = _take(_TOP_RE, text, top)
+    text = _take(_GROUP_RE, text, group)
+    text = _take(_COUNT_RE, text, count)
+    text = _take(_AGGREGATE_RE, text, aggregate)
+    if state['group'] and state['aggregate'] is None:
+        # "compare premium by state" means the total per state
+        text = _take(_BARE_MEASURE_RE, text,
+                     lambda m: aggregate_of(('SUM', 'total'), m.group('measure')))
+    text = _take(_STATE_NAME_RE, text, lambda m: state_filter(US_STATES[m.group(1).lower()]))
+    text = _STATE_CODE_RE.sub(
+        lambda m: state_filter(m.group(1)) or ' ' if m.group(1).lower() in US_STATES.values() else m.group(0),
+        text)
+    text = _take(_COVERAGE_RE, text, coverage)
+    text = _take(_TRANSACTION_RE, text, transaction)
+
+    leftover = [w for w in _WORD_RE.findall(text.lower()) if w not in FILLER]
+    if leftover or state['group'] is False or state['aggregate'] is False:
+        return None
+
+    # lower() = lower() rather than ILIKE, so the lower() indexes from migrations/003 serve it
+    for column, values in text_filters.items():
+        matches = ' OR '.join(f'lower({column}) = lower(%s)' for _ in values)
+        conditions.append(matches if len(values) == 1 else f'({matches})')
+        params.extend(values)
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    if state['top']:
+        column, _ = _select_dimension(state['top'])
+        sql = (f"SELECT {column}, COUNT(*) AS policy_count FROM {TABLE}{where} "
+               f"GROUP BY 1 ORDER BY policy_count DESC LIMIT 1")
+        return FastPathMatch(sql, params, 'top')
+
+    if state['aggregate']:
+        (func, prefix), (column, measure_name) = state['aggregate']
+        select = f"ROUND({func}({column}), 2) AS {prefix}_{measure_name}"
+        intent = 'aggregate'
+    elif state['count'] or state['group']:
+        select = 'COUNT(*) AS policy_count'
+        intent = 'count'
+    elif conditions or re.search(r'\bpolic(?:y|ies)\b', question, re.IGNORECASE):
+        return FastPathMatch(f"SELECT {LIST_COLUMNS} FROM {TABLE}{where}", params, 'list')
+    else:
+        return None
+
+    if state['group']:
+        column, alias = _select_dimension(state['group'])
+        sql = f"SELECT {column}, {select} FROM {TABLE}{where} GROUP BY 1 ORDER BY 1"
+        return FastPathMatch(sql, params, f'{intent}_by_{alias}')
+
+    return FastPathMatch(f"SELECT {select} FROM {TABLE}{where}", params, intent)
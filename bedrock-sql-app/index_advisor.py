@@ -0,0 +1,220 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+# Below this many rows a sequential scan is cheap enough that no index is worth suggesting
+MIN_ROWS_FOR_INDEX = 10_000
+# BRIN only pays off when rows are physically stored in roughly column order
+BRIN_MIN_CORRELATION = 0.9
+BRIN_MIN_ROWS = 1_000_000
+
+_RANGE_NODES = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+_EQ_NODES = (exp.EQ, exp.NEQ, exp.In)
+_PATTERN_NODES = (exp.Like, exp.ILike)
+_DATE_TYPES = ('date', 'timestamp without time zone', 'timestamp with time zone')
+
+EXISTING_INDEXES_SQL = """
+    SELECT i.tablename, i.indexdef
+    FROM pg_indexes i
+    WHERE i.schemaname = 'public' AND i.tablename = ANY(%s)
+"""
+TABLE_STATS_SQL = """
+    SELECT c.relname, c.reltuples::bigint, s.attname, s.correlation, col.data_type
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = 'public'
+    LEFT JOIN pg_stats s ON s.schemaname = 'public' AND s.tablename = c.relname
+    LEFT JOIN information_schema.columns col
+           ON col.table_schema = 'public' AND col.table_name = c.relname AND col.column_name = s.attname
+    WHERE c.relname = ANY(%s) AND c.relkind = 'r'
+"""
+
+
+def _normalize_definition(definition):
+    # "(lower(insured_state))" and "lower( insured_state )" compare equal
+    return re.sub(r'[\s"()]', '', definition.lower())
+
+
+def _column_of(node):
+    # Returns (column, wrapper) for col, lower(col) and EXTRACT(field FROM col); otherwise (None, None)
+    if isinstance(node, exp.Column):
+        return node.name, None
+    if isinstance(node, exp.Lower) and isinstance(node.this, exp.Column):
+        return node.this.name, 'lower'
+    if isinstance(node, exp.Extract) and isinstance(node.expression, exp.Column):
+        return node.expression.name, f"extract:{node.this.name.lower()}"
+    return None, None
+
+
+# Predicates in a query shape as (table, column, access) where access is one of
+# eq, range, lower_eq, pattern or extract:<field>
+def extract_predicates(sql):
+    try:
+        tree = sqlglot.parse_one(sql, read='postgres')
+    except ParseError:
+        return []
+    table = tree.find(exp.Table)
+    if table is None:
+        return []
+    table = table.name
+
+    predicates = set()
+    for node in tree.find_all(*_RANGE_NODES, *_EQ_NODES, *_PATTERN_NODES):
+        sides = [node.this] if isinstance(node, (exp.Between, exp.In)) else [node.left, node.right]
+        for side in sides:
+            column, wrapper = _column_of(side)
+            if column is None:
+                continue
+            if wrapper and wrapper.startswith('extract:'):
+                access = wrapper
+            elif isinstance(node, _PATTERN_NODES):
+                access = 'pattern'
+            elif wrapper == 'lower':
+                access = 'lower_eq'
+            elif isinstance(node, _RANGE_NODES):
+                access = 'range'
+            else:
+                access = 'eq'
+            predicates.add((table, column, access))
+    return sorted(predicates)
+
+
+# Records normalized query shapes (parameterized SQL text) with their timings, and turns the
+# predicates the slowest shapes use into index suggestions: B-tree for equality and ranges,
+# lower() expression indexes for case-insensitive equality, pg_trgm GIN for ILIKE/LIKE and BRIN
+# for large, physically ordered date columns.
+class IndexAdvisor:
+    def __init__(self, pool, max_shapes=500):
+        self.pool = pool
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()    # sql -> {"calls", "totalMs", "maxMs", "predicates"}
+
+    @classmethod
+    def from_env(cls, pool):
+        return cls(pool, max_shapes=int(os.getenv('INDEX_ADVISOR_MAX_SHAPES', '500')))
+
+    def record(self, sql, elapsed_ms):
+        if self.max_shapes <= 0:
+            return
+        with self._lock:
+            shape = self._shapes.get(sql)
+            if shape is not None:
+                self._shapes.move_to_end(sql)
+        if shape is None:
+            # Parse outside the lock; a shape is only parsed the first time it is seen
+            shape = {"calls": 0, "totalMs": 0.0, "maxMs": 0.0, "predicates": extract_predicates(sql)}
+            with self._lock:
+                shape = self._shapes.setdefault(sql, shape)
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+        with self._lock:
+            shape["calls"] += 1
+            shape["totalMs"] += elapsed_ms
+            shape["maxMs"] = max(shape["maxMs"], elapsed_ms)
+
+    def _catalog(self, tables):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(EXISTING_INDEXES_SQL, (tables,))
+            index_rows = cur.fetchall()
+            cur.execute(TABLE_STATS_SQL, (tables,))
+            stat_rows = cur.fetchall()
+            conn.rollback()
+
+        existing = {}
+        for table, indexdef in index_rows:
+            method, _, columns = indexdef.partition(' USING ')[2].partition(' ')
+            existing.setdefault(table, []).append((method, _normalize_definition(columns)))
+        stats = {}
+        for table, rows, column, correlation, data_type in stat_rows:
+            entry = stats.setdefault(table, {"rows": rows, "columns": {}})
+            if column is not None:
+                entry["columns"][column] = (correlation, data_type)
+        return existing, stats
+
+    @staticmethod
+    def _suggestion(table, column, access, table_stats):
+        quoted = f'"{column}"' if column == 'limit' else column
+        if access == 'pattern':
+            return 'gin', f"{quoted} gin_trgm_ops", f"{table}_{column}_trgm_idx", \
+                "ILIKE/LIKE, including leading-wildcard patterns (needs pg_trgm)"
+        if access == 'lower_eq':
+            return 'btree', f"lower({quoted})", f"{table}_lower_{column}_idx", "case-insensitive equality"
+        if access.startswith('extract:'):
+            field = access.split(':', 1)[1]
+            return 'btree', f"(EXTRACT({field} FROM {quoted}))", f"{table}_{column}_{field}_idx", \
+                f"EXTRACT({field.upper()} FROM {column}) comparisons"
+
+        rows = table_stats.get("rows") or 0
+        correlation, data_type = table_stats.get("columns", {}).get(column, (None, None))
+        if access == 'range' and data_type in _DATE_TYPES and rows >= BRIN_MIN_ROWS and \
+                correlation is not None and abs(correlation) >= BRIN_MIN_CORRELATION:
+            return 'brin', quoted, f"{table}_{column}_brin_idx", \
+                f"date ranges on a large table stored in {column} order (correlation {correlation:.2f})"
+        return 'btree', quoted, f"{table}_{column}_idx", "equality and range filters"
+
+    # Index suggestions ranked by the database time of the query shapes they would serve
+    def advise(self, top=20):
+        with self._lock:
+            shapes = [(sql, dict(shape)) for sql, shape in self._shapes.items()]
+
+        usage = {}
+        for sql, shape in shapes:
+            for predicate in shape["predicates"]:
+                entry = usage.setdefault(predicate, {"shapes": 0, "calls": 0, "totalMs": 0.0})
+                entry["shapes"] += 1
+                entry["calls"] += shape["calls"]
+                entry["totalMs"] += shape["totalMs"]
+
+        tables = sorted({table for table, _, _ in usage})
+        catalog_error = None
+        try:
+            existing, stats = self._catalog(tables) if tables else ({}, {})
+        except Exception as e:
+            existing, stats, catalog_error = {}, {}, str(e)
+
+        suggestions = {}
+        for (table, column, access), entry in usage.items():
+            table_stats = stats.get(table, {})
+            if table_stats and (table_stats.get("rows") or 0) < MIN_ROWS_FOR_INDEX:
+                continue
+            method, expression, name, reason = self._suggestion(table, column, access, table_stats)
+            wanted = _normalize_definition(expression)
+            # Any B-tree or BRIN index leading with the same column already serves ranges on it
+            exists = any((m == method or {m, method} <= {'btree', 'brin'})
+                         and (columns == wanted or columns.startswith(wanted + ','))
+                         for m, columns in existing.get(table, []))
+            suggestion = suggestions.setdefault(name, {
+                "table": table,
+                "method": method,
+                "definition": expression,
+                "ddl": f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING {method} ({expression});",
+                "reason": reason,
+                "exists": exists,
+                "shapes": 0,
+                "calls": 0,
+                "totalMs": 0.0
+            })
+            suggestion["shapes"] += entry["shapes"]
+            suggestion["calls"] += entry["calls"]
+            suggestion["totalMs"] = round(suggestion["totalMs"] + entry["totalMs"], 2)
+
+        ranked = sorted(suggestions.values(), key=lambda s: (s["exists"], -s["totalMs"]))
+        slowest = sorted(shapes, key=lambda item: -item[1]["totalMs"])[:top]
+        return {
+            "suggestions": ranked,
+            "shapes": [{
+                "sql": sql,
+                "calls": shape["calls"],
+                "avgMs": round(shape["totalMs"] / shape["calls"], 2) if shape["calls"] else 0.0,
+                "maxMs": round(shape["maxMs"], 2),
+                "totalMs": round(shape["totalMs"], 2),
+                "predicates": [f"{table}.{column}:{access}" for table, column, access in shape["predicates"]]
+            } for sql, shape in slowest],
+            "trackedShapes": len(shapes),
+            "catalogError": catalog_error
+        }
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from psycopg2 import errors
+
+log = logging.getLogger('sqlapp.kpi_store')
+
+
+# Every KPI is answered from one pass over the day/state/transaction_type summary rows.
+# `{source}` is either the kpi_daily table or, before the migration has been run, an
+# equivalent aggregate computed on the fly from insurance_policies.
+KPI_SQL = """
+    WITH kpi AS ({source})
+    SELECT
+        COALESCE(SUM(policy_count), 0),
+        COALESCE(ROUND(SUM(gross_premium), 2), 0),
+        COALESCE(ROUND(SUM(limit_sum) / NULLIF(SUM(limit_count), 0), 2), 0),
+        COALESCE(SUM(policy_count) FILTER (
+            WHERE day >= date_trunc('year', CURRENT_DATE)::date
+              AND day < (date_trunc('year', CURRENT_DATE) + interval '1 year')::date), 0),
+        (SELECT transaction_type FROM kpi GROUP BY transaction_type ORDER BY SUM(policy_count) DESC LIMIT 1),
+        (SELECT insured_state FROM kpi GROUP BY insured_state ORDER BY SUM(policy_count) DESC LIMIT 1),
+        COALESCE(SUM(gross_premium) FILTER (WHERE day = CURRENT_DATE), 0),
+        COALESCE(SUM(gross_premium) FILTER (
+            WHERE day >= date_trunc('month', CURRENT_DATE)::date AND day <= CURRENT_DATE), 0),
+        COALESCE(SUM(gross_premium) FILTER (
+            WHERE day >= date_trunc('year', CURRENT_DATE)::date AND day <= CURRENT_DATE), 0),
+        {refreshed_at}
+    FROM kpi;
+"""
+
+STORE_SOURCE = "SELECT * FROM kpi_daily"
+STORE_REFRESHED_AT = "(SELECT refreshed_at FROM kpi_refresh_state)"
+
+LIVE_SOURCE = """
+    SELECT effective_date AS day, insured_state, transaction_type,
+           COUNT(*) AS policy_count, COALESCE(SUM(gross_premium), 0) AS gross_premium,
+           COALESCE(SUM("limit"), 0) AS limit_sum, COUNT("limit") AS limit_count
+    FROM insurance_policies
+    GROUP BY 1, 2, 3
+"""
+LIVE_REFRESHED_AT = "now()"
+
+
+# Reads KPIs from the kpi_daily store (migrations/002_kpi_daily.sql) and keeps it fresh
+# by calling refresh_kpi_daily() from a background thread every `refresh_interval` seconds.
+class KPIStore:
+    def __init__(self, pool, refresh_interval=60.0):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.installed = True
+        self.last_refresh_error = None
+        self.last_refreshed_days = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, pool):
+        return cls(pool, refresh_interval=float(os.getenv('KPI_REFRESH_INTERVAL', '60')))
+
+    def refresh(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT refresh_kpi_daily()")
+            days = cur.fetchone()[0]
+            conn.commit()
+        self.last_refreshed_days = days
+        return days
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                days = self.refresh()
+                self.installed = True
+                self.last_refresh_error = None
+                if days:
+                    log.info("[KPI Refresh] Rebuilt %d day(s)", days)
+            except errors.UndefinedFunction:
+                self.installed = False
+            except Exception as e:
+                self.last_refresh_error = str(e)
+                log.warning("[KPI Refresh Error] %s", e, exc_info=True)
+
+    def start(self):
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="kpi-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def read(self):
+        with self.pool.connection() as conn:
+            return self.read_from(conn)
+
+    # KPIs over `conn`, e.g. a read-replica connection; kpi_daily is replicated with the table
+    def read_from(self, conn):
+        with conn.cursor() as cur:
+            if self.installed:
+                try:
+                    cur.execute(KPI_SQL.format(source=STORE_SOURCE, refreshed_at=STORE_REFRESHED_AT))
+                    return self._to_kpis(cur.fetchone(), source="store")
+                except errors.UndefinedTable:
+                    conn.rollback()
+                    self.installed = False
+                    log.warning("[KPI Store] kpi_daily not found, computing KPIs from insurance_policies. "
+                                "Run migrations/002_kpi_daily.sql to enable the store.")
+            cur.execute(KPI_SQL.format(source=LIVE_SOURCE, refreshed_at=LIVE_REFRESHED_AT))
+            return self._to_kpis(cur.fetchone(), source="live")
+
+    @staticmethod
+    def _to_kpis(row, source):
+        (total_policies, total_gross_premium, avg_policy_limit, policies_this_year,
+         common_transaction_type, top_insured_state, gwp_today, gwp_mtd, gwp_ytd, refreshed_at) = row
+        staleness = (datetime.now(timezone.utc) - refreshed_at).total_seconds() if refreshed_at else None
+        return {
+            "totalPolicies": total_policies,
+            "totalGrossPremium": total_gross_premium,
+            "avgPolicyLimit": avg_policy_limit,
+            "policiesThisYear": policies_this_year,
+            "commonTransactionType": common_transaction_type,
+            "topInsuredState": top_insured_state,
+            "gwpToday": float(gwp_today),
+            "gwpMTD": float(gwp_mtd),
+            "gwpYTD": float(gwp_ytd),
+            # insurance_policies carries no claims data yet; the UI shows these as unavailable
+            "totalIncurred": None,
+            "openClaimsToday": None,
+            "openClaimsMTD": None,
+            "openClaimsYTD": None,
+            "asOf": refreshed_at.isoformat() if refreshed_at else None,
+            "stalenessSeconds": round(max(staleness, 0.0), 1) if staleness is not None else None,
+            "source": source
+        }
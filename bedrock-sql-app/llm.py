@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from collections import deque
+
+
+# Finds where the generated SQL statement ends while Claude's output is still arriving.
+#
+# The statement starts at the first "select" and ends at the first semicolon or blank line
+# outside a string literal (the same boundaries /ask has always cut the SQL at).
+class SQLEndDetector:
+    def __init__(self):
+        self.text = ''
+        self.sql_start = -1
+        self._pos = 0
+        self._in_quote = False
+
+    # Appends a chunk; returns the index just past the statement once it is complete, else -1
+    def feed(self, chunk):
+        self.text += chunk
+        if self.sql_start == -1:
+            self.sql_start = self.text.lower().find('select')
+            if self.sql_start == -1:
+                return -1
+            self._pos = self.sql_start
+
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if char == "'":
+                self._in_quote = not self._in_quote
+            elif not self._in_quote:
+                if char == ';':
+                    return self._pos + 1
+                if char == '\n':
+                    # Need the next character to tell a blank line from a line break
+                    if self._pos + 1 >= len(text):
+                        return -1
+                    if text[self._pos + 1] == '\n':
+                        return self._pos
+            self._pos += 1
+        return -1
+
+
+# Recent time-to-first-token / time-to-SQL samples for /stats
+class LLMStats:
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._ttft_ms = deque(maxlen=window)
+        self._sql_ms = deque(maxlen=window)
+        self.calls = 0
+        self.stopped_early = 0
+
+    def record(self, ttft_ms, sql_ms, stopped_early):
+        with self._lock:
+            self.calls += 1
+            if ttft_ms is not None:
+                self._ttft_ms.append(ttft_ms)
+            if sql_ms is not None:
+                self._sql_ms.append(sql_ms)
+            if stopped_early:
+                self.stopped_early += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "stoppedEarly": self.stopped_early,
+                "timeToFirstTokenMs": _summary(self._ttft_ms),
+                "timeToSqlMs": _summary(self._sql_ms)
+            }
+
+
+def _summary(samples):
+    if not samples:
+        return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "avg": round(sum(ordered) / len(ordered), 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2)
+    }
+
+
+# Streams a Claude text completion and stops reading as soon as the SQL statement is complete.
+# Returns (completion_text, timings) where timings has ttftMs, timeToSqlMs, totalMs, stoppedEarly.
+def stream_completion(client, model_id, body, stats=None):
+    started = time.perf_counter()
+    response = client.invoke_model_with_response_stream(
+        modelId=model_id,
+        contentType='application/json',
+        accept='application/json',
+        body=body
+    )
+
+    stream = response['body']
+    detector = SQLEndDetector()
+    ttft_ms = None
+    sql_ms = None
+    end = -1
+    try:
+        for event in stream:
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+            payload = json.loads(chunk['bytes'])
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            end = detector.feed(payload.get('completion', ''))
+            if end != -1:
+                sql_ms = (time.perf_counter() - started) * 1000
+                break
+    finally:
+        # Closing mid-stream drops the rest of the answer instead of waiting for it to finish
+        stream.close()
+
+    stopped_early = end != -1
+    text = detector.text[:end] if stopped_early else detector.text
+    total_ms = (time.perf_counter() - started) * 1000
+    if sql_ms is None and detector.sql_start != -1:
+        sql_ms = total_ms
+
+    if stats is not None:
+        stats.record(ttft_ms, sql_ms, stopped_early)
+
+    return text, {
+        "ttftMs": round(ttft_ms, 2) if ttft_ms is not None else None,
+        "timeToSqlMs": round(sql_ms, 2) if sql_ms is not None else None,
+        "totalMs": round(total_ms, 2),
+        "stoppedEarly": stopped_early
+    }
@@ -0,0 +1,129 @@
+import bisect
+import threading
+
+# Prometheus text exposition format, as served by GET /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond cache lookups up to a slow Bedrock call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Monotonic count per label combination
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+
+# Bucketed observations per label combination (cumulative buckets are built at scrape time)
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}   # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        out = []
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = (('le', _number(bound)),)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(round(total, 6))}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return out
+
+
+# Values read from existing stats() dicts at scrape time (pool sizes, cache hits, ...).
+# `read` returns [(label values tuple, value), ...].
+class Collected:
+    def __init__(self, name, help_text, read, labelnames=(), kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def lines(self):
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in self.read()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def collected(self, name, help_text, read, labelnames=(), kind='gauge'):
+        return self._add(Collected(name, help_text, read, labelnames, kind))
+
+    def render(self):
+        out = []
+        for metric in self._metrics:
+            try:
+                lines = metric.lines()
+            except Exception as e:
+                # One failing stats source shouldn't break the whole scrape
+                out.append(f"# {metric.name} unavailable: {_escape(e)}")
+                continue
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
@@ -0,0 +1,27 @@
+-- Change counter per table, bumped by a statement-level trigger on every write.
+-- The result cache in result_cache.py compares these versions instead of expiring on a TTL.
+-- Safe to run more than once.
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version    BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_versions (table_name, version, changed_at)
+    VALUES (TG_TABLE_NAME, 1, now())
+    ON CONFLICT (table_name)
+    DO UPDATE SET version = table_versions.version + 1, changed_at = now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO table_versions (table_name) VALUES ('insurance_policies')
+ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS insurance_policies_version ON insurance_policies;
+CREATE TRIGGER insurance_policies_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON insurance_policies
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,116 @@
+-- Precomputed KPI store for /kpis: one row per (day, insured_state, transaction_type).
+--
+-- Writes to insurance_policies mark the affected effective_date values dirty; refresh_kpi_daily()
+-- recomputes only those days, so a refresh costs O(changed days) instead of a full scan.
+-- Policies without an effective_date are tracked under day = '-infinity'.
+-- Safe to run more than once (rebuilds the store from scratch).
+
+CREATE TABLE IF NOT EXISTS kpi_daily (
+    day              DATE NOT NULL,
+    insured_state    TEXT,
+    transaction_type TEXT,
+    policy_count     BIGINT NOT NULL,
+    gross_premium    NUMERIC NOT NULL,
+    limit_sum        NUMERIC NOT NULL,
+    limit_count      BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS kpi_daily_day_idx ON kpi_daily (day);
+
+CREATE TABLE IF NOT EXISTS kpi_dirty_days (
+    day DATE PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS kpi_refresh_state (
+    id           BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Statement-level, so a bulk COPY marks its days in one INSERT instead of one trigger call per row.
+-- DO UPDATE (not DO NOTHING) row-locks a day that is already dirty until the writer commits, so
+-- refresh_kpi_daily()'s DELETE of that day waits and its rebuild sees the write. Days are locked
+-- in order so concurrent writers can't deadlock on each other's days.
+CREATE OR REPLACE FUNCTION mark_kpi_day_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO kpi_dirty_days
+        SELECT DISTINCT COALESCE(effective_date, '-infinity'::date) FROM new_rows ORDER BY 1
+        ON CONFLICT (day) DO UPDATE SET day = EXCLUDED.day;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO kpi_dirty_days
+        SELECT DISTINCT COALESCE(effective_date, '-infinity'::date) FROM old_rows ORDER BY 1
+        ON CONFLICT (day) DO UPDATE SET day = EXCLUDED.day;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION clear_kpi_daily() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE kpi_daily, kpi_dirty_days;
+    UPDATE kpi_refresh_state SET refreshed_at = now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes every dirty day; returns how many days were rebuilt
+CREATE OR REPLACE FUNCTION refresh_kpi_daily() RETURNS INTEGER AS $$
+DECLARE
+    days DATE[];
+BEGIN
+    -- One refresher at a time, otherwise two runs rebuilding the same day could double-insert it
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_kpi_daily'));
+
+    WITH claimed AS (DELETE FROM kpi_dirty_days RETURNING day)
+    SELECT array_agg(day) INTO days FROM claimed;
+
+    IF days IS NOT NULL THEN
+        DELETE FROM kpi_daily WHERE day = ANY(days);
+
+        INSERT INTO kpi_daily
+        SELECT COALESCE(effective_date, '-infinity'::date), insured_state, transaction_type,
+               COUNT(*), COALESCE(SUM(gross_premium), 0), COALESCE(SUM("limit"), 0), COUNT("limit")
+        FROM insurance_policies
+        WHERE effective_date = ANY(days)
+           OR (effective_date IS NULL AND '-infinity'::date = ANY(days))
+        GROUP BY 1, 2, 3;
+    END IF;
+
+    UPDATE kpi_refresh_state SET refreshed_at = now();
+    RETURN COALESCE(array_length(days, 1), 0);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers with transition tables can only have one event each
+DROP TRIGGER IF EXISTS insurance_policies_kpi_dirty ON insurance_policies;
+DROP TRIGGER IF EXISTS insurance_policies_kpi_dirty_insert ON insurance_policies;
+CREATE TRIGGER insurance_policies_kpi_dirty_insert
+    AFTER INSERT ON insurance_policies
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_kpi_day_dirty();
+DROP TRIGGER IF EXISTS insurance_policies_kpi_dirty_update ON insurance_policies;
+CREATE TRIGGER insurance_policies_kpi_dirty_update
+    AFTER UPDATE ON insurance_policies
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_kpi_day_dirty();
+DROP TRIGGER IF EXISTS insurance_policies_kpi_dirty_delete ON insurance_policies;
+CREATE TRIGGER insurance_policies_kpi_dirty_delete
+    AFTER DELETE ON insurance_policies
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_kpi_day_dirty();
+
+DROP TRIGGER IF EXISTS insurance_policies_kpi_truncate ON insurance_policies;
+CREATE TRIGGER insurance_policies_kpi_truncate
+    AFTER TRUNCATE ON insurance_policies
+    FOR EACH STATEMENT EXECUTE FUNCTION clear_kpi_daily();
+
+-- Full initial build
+TRUNCATE kpi_daily, kpi_dirty_days;
+INSERT INTO kpi_daily
+SELECT COALESCE(effective_date, '-infinity'::date), insured_state, transaction_type,
+       COUNT(*), COALESCE(SUM(gross_premium), 0), COALESCE(SUM("limit"), 0), COUNT("limit")
+FROM insurance_policies
+GROUP BY 1, 2, 3;
+
+INSERT INTO kpi_refresh_state (id, refreshed_at) VALUES (TRUE, now())
+ON CONFLICT (id) DO UPDATE SET refreshed_at = now();
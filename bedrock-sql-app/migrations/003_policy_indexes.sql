@@ -0,0 +1,39 @@
+-- Baseline indexes for the predicates /ask, /filters and /kpis generate on insurance_policies.
+-- index_advisor.py (GET /indexes/advice) explains which query shapes each one serves.
+--
+-- Safe to run more than once. Run it with psql (not inside BEGIN/COMMIT): CONCURRENTLY builds
+-- don't block writes but can't run in a transaction. If a concurrent build fails it leaves an
+-- INVALID index behind that IF NOT EXISTS will skip; drop it and re-run.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Date ranges: effective_date BETWEEN ... / >= ... AND < ... (also what EXTRACT(YEAR) is rewritten to)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_effective_date_idx
+    ON insurance_policies (effective_date);
+
+-- Text filters: lower(col) = lower(value) from /filters, the fast path, and generated SQL's
+-- ILIKE without wildcards (sql_pipeline.py rewrites it)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_lower_insured_state_idx
+    ON insurance_policies (lower(insured_state));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_lower_transaction_type_idx
+    ON insurance_policies (lower(transaction_type));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_lower_coverage_idx
+    ON insurance_policies (lower(coverage));
+
+-- Wildcard ILIKE ('%auto%') on coverage. Two-letter state codes are too short for trigrams and
+-- always compared whole, so insured_state has no trigram index (dropped if an earlier run made one).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_coverage_trgm_idx
+    ON insurance_policies USING gin (coverage gin_trgm_ops);
+DROP INDEX CONCURRENTLY IF EXISTS insurance_policies_insured_state_trgm_idx;
+
+-- Keyset pages of streamed /ask results: ORDER BY policy_number, ctid from policy_number >= last
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_policy_number_idx
+    ON insurance_policies (policy_number);
+
+-- Numeric ranges: "limit" above/below, gross_premium between
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_limit_idx
+    ON insurance_policies ("limit");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS insurance_policies_gross_premium_idx
+    ON insurance_policies (gross_premium);
+
+ANALYZE insurance_policies;
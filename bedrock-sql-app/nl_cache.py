@@ -0,0 +1,266 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+US_STATES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca',
+    'colorado': 'co', 'connecticut': 'ct', 'delaware': 'de', 'florida': 'fl', 'georgia': 'ga',
+    'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia',
+    'kansas': 'ks', 'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md',
+    'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn', 'mississippi': 'ms',
+    'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv', 'new hampshire': 'nh',
+    'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny', 'north carolina': 'nc',
+    'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok', 'oregon': 'or', 'pennsylvania': 'pa',
+    'rhode island': 'ri', 'south carolina': 'sc', 'south dakota': 'sd', 'tennessee': 'tn',
+    'texas': 'tx', 'utah': 'ut', 'vermont': 'vt', 'virginia': 'va', 'washington': 'wa',
+    'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy'
+}
+STATE_CODES = set(US_STATES.values())
+TRANSACTION_TYPES = {'new', 'renewal', 'endorsement', 'reinstate', 'cancellation', 'audit'}
+
+# Words that never change the meaning of a question for SQL generation
+STOPWORDS = {
+    'a', 'an', 'the', 'for', 'of', 'to', 'me', 'please', 'show', 'give', 'get', 'list',
+    'what', 'whats', 'is', 'are', 'was', 'were', 'can', 'you', 'tell', 'all', 'with',
+    'on', 'by', 'from', 'in', 'within', 'display', 'find', 'our', 'my', 'i', 'want', 'see',
+    'how', 'do', 'we', 'have'
+}
+
+SYNONYMS = {
+    'policy': 'policies', 'premiums': 'premium', 'sum': 'total', 'totals': 'total',
+    'avg': 'average', 'mean': 'average', 'limits': 'limit', 'states': 'state',
+    'number': 'count', 'coverages': 'coverage', 'transactions': 'transaction',
+    'renewals': 'renewal', 'endorsements': 'endorsement', 'cancellations': 'cancellation',
+    'audits': 'audit', 'greater': 'above', 'more': 'above', 'over': 'above',
+    'less': 'below', 'under': 'below', 'fewer': 'below', 'many': 'count', 'much': 'total',
+    'max': 'maximum', 'highest': 'maximum', 'largest': 'maximum', 'biggest': 'maximum',
+    'min': 'minimum', 'lowest': 'minimum', 'smallest': 'minimum', 'asc': 'ascending',
+    'desc': 'descending', 'without': 'except', 'excluding': 'except', 'exclude': 'except',
+    'newest': 'latest', 'oldest': 'earliest', 'months': 'month', 'years': 'year', 'dates': 'date',
+    'quarters': 'quarter', 'weeks': 'week', 'days': 'day', 'monthly': 'month', 'yearly': 'year',
+    'annual': 'year', 'quarterly': 'quarter', 'weekly': 'week', 'daily': 'day'
+}
+
+# Measure and dimension words: "premium above 1000" and "limit above 1000", or "by state" and
+# "by coverage", read different columns however many other words they share
+COLUMN_WORDS = {
+    'premium', 'limit', 'state', 'coverage', 'transaction', 'month', 'year', 'date', 'quarter',
+    'week', 'day'
+}
+
+# Words that flip or narrow what a question asks for: negations, comparators, ordering and
+# aggregates. "policies not in TX" and "policies in TX" differ by one token, which Jaccard
+# alone would call similar, so these are part of the literal signature.
+MODIFIERS = {
+    'not', 'no', 'non', 'except', 'other', 'never', 'nor', 'outside', 'only',
+    'above', 'below', 'least', 'most', 'top', 'bottom', 'maximum', 'minimum', 'exactly', 'equal',
+    'ascending', 'descending', 'before', 'after', 'since', 'until', 'between', 'first', 'last',
+    'earliest', 'latest', 'total', 'average', 'count', 'median', 'distinct', 'unique'
+}
+
+# Coverage lines, so "auto policies" and "home policies" never share SQL. Any other word
+# right before "coverage" is a coverage value too (see canonical_tokens).
+COVERAGES = {
+    'auto', 'home', 'homeowners', 'property', 'commercial', 'liability', 'general', 'workers',
+    'comp', 'compensation', 'life', 'umbrella', 'cyber', 'flood', 'fire', 'marine', 'renters',
+    'health', 'motorcycle', 'boat', 'travel', 'pet'
+}
+
+_STATE_NAME_RE = re.compile(r'\b(' + '|'.join(sorted(US_STATES, key=len, reverse=True)) + r')\b', re.IGNORECASE)
+# Only upper-case two-letter codes count as states: "in", "or", "me" are ordinary words
+_STATE_CODE_RE = re.compile(r'\b([A-Z]{2})\b')
+_COVERAGE_RE = re.compile(r"\b([a-z][a-z&'-]*)\s+coverage\b", re.IGNORECASE)
+_TOKEN_RE = re.compile(r"\d{4}-\d{2}-\d{2}|\d+(?:\.\d+)?|[a-z_]+")
+
+
+# Exact cache key: the preprocessed question with case, punctuation and whitespace folded.
+# Relative dates have already been rewritten into literal dates by preprocess_question,
+# so "last month" asked on two different days produces two different keys.
+def normalize_question(question):
+    text = question.lower()
+    text = re.sub(r"[^\w\s'\-.=<>]", ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _coverage_value(match):
+    word = match.group(1).lower()
+    if word in COVERAGES or word in STOPWORDS or SYNONYMS.get(word, word) in MODIFIERS:
+        return match.group(0)
+    return f' cov_{word} coverage'
+
+
+# Order-insensitive token set used by the similarity tier. States become "st_xx" tokens
+# so "Texas" and "TX" compare equal; "<word> coverage" becomes a "cov_<word>" token.
+def canonical_tokens(question):
+    text = _COVERAGE_RE.sub(_coverage_value, question)
+    text = _STATE_NAME_RE.sub(lambda m: ' st_' + US_STATES[m.group(1).lower()] + ' ', text)
+    text = _STATE_CODE_RE.sub(
+        lambda m: ' st_' + m.group(1).lower() + ' ' if m.group(1).lower() in STATE_CODES else m.group(0),
+        text
+    )
+    tokens = set()
+    for token in _TOKEN_RE.findall(text.lower()):
+        token = SYNONYMS.get(token, token)
+        if token not in STOPWORDS:
+            tokens.add(token)
+    return frozenset(tokens)
+
+
+# Tokens that must match exactly for two questions to share SQL: numbers, dates, states,
+# transaction types, coverages, modifiers and column words. "total premium in TX" must never be
+# served the SQL generated for CA, nor "policies not in TX" the SQL for "policies in TX".
+def literal_signature(tokens):
+    return frozenset(
+        t for t in tokens
+        if t[0].isdigit() or t.startswith(('st_', 'cov_')) or t in TRANSACTION_TYPES
+        or t in MODIFIERS or t in COVERAGES or t in COLUMN_WORDS
+    )
+
+
+# In-process LRU with per-entry TTL
+class LRUTTLBackend:
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Shared backend so several app instances reuse each other's generated SQL.
+# Requires the optional `redis` package.
+class RedisBackend:
+    def __init__(self, url, ttl=3600, prefix='nlsql:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("NL_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    def __len__(self):
+        return -1
+
+
+# Two-tier NL -> SQL cache.
+#
+# 1. exact: normalized question text -> SQL, stored in the backend
+# 2. similar: canonical token sets bucketed by literal signature; a question whose tokens
+#    overlap an earlier one by at least `similarity` (Jaccard) reuses that question's SQL
+class NLSQLCache:
+    def __init__(self, backend, similarity=0.9, max_similar_entries=1000):
+        self.backend = backend
+        self.similarity = similarity
+        self.max_similar_entries = max_similar_entries
+        self._similar = OrderedDict()   # tokens -> (exact key, literal signature)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        ttl = float(os.getenv('NL_CACHE_TTL', '3600'))
+        max_entries = int(os.getenv('NL_CACHE_MAX_ENTRIES', '1000'))
+        if os.getenv('NL_CACHE_BACKEND', 'memory').lower() == 'redis':
+            backend = RedisBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+        else:
+            backend = LRUTTLBackend(max_entries=max_entries, ttl=ttl)
+        return cls(
+            backend,
+            similarity=float(os.getenv('NL_CACHE_SIMILARITY', '0.9')),
+            max_similar_entries=max_entries
+        )
+
+    def _find_similar(self, tokens):
+        signature = literal_signature(tokens)
+        best_key, best_score = None, 0.0
+        with self._lock:
+            for other, (key, other_signature) in self._similar.items():
+                if other_signature != signature:
+                    continue
+                score = len(tokens & other) / len(tokens | other)
+                if score > best_score:
+                    best_key, best_score = key, score
+        if best_score >= self.similarity:
+            return best_key
+        return None
+
+    # Returns (sql, tier) where tier is 'exact', 'similar' or None on a miss
+    def get(self, question):
+        key = normalize_question(question)
+        sql = self.backend.get(key)
+        if sql is not None:
+            self._count('hits')
+            return sql, 'exact'
+
+        tokens = canonical_tokens(question)
+        if tokens:
+            similar_key = self._find_similar(tokens)
+            if similar_key is not None:
+                sql = self.backend.get(similar_key)
+                if sql is not None:
+                    self._count('similar_hits')
+                    return sql, 'similar'
+
+        self._count('misses')
+        return None, None
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def put(self, question, sql):
+        key = normalize_question(question)
+        self.backend.set(key, sql)
+        tokens = canonical_tokens(question)
+        if not tokens:
+            return
+        with self._lock:
+            self._similar[tokens] = (key, literal_signature(tokens))
+            self._similar.move_to_end(tokens)
+            while len(self._similar) > self.max_similar_entries:
+                self._similar.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "hits": self.hits,
+            "similarHits": self.similar_hits,
+            "misses": self.misses,
+            "hitRate": round((self.hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.backend)
+        }
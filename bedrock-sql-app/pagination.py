@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+
+# Tokens carry the SQL for the next page, so they are signed: a client must not be able to
+# hand us arbitrary SQL (the app also re-validates it). Set PAGE_TOKEN_SECRET to a long random
+# value so tokens survive restarts and work across several app processes; left empty, a random
+# per-process secret is used. The old template placeholder is refused, since it is public.
+_PLACEHOLDER_SECRETS = {'change-me', 'changeme', 'secret'}
+if (os.getenv('PAGE_TOKEN_SECRET') or '').strip().lower() in _PLACEHOLDER_SECRETS:
+    raise RuntimeError("PAGE_TOKEN_SECRET is a placeholder; set a long random value or leave it empty")
+_SECRET = (os.getenv('PAGE_TOKEN_SECRET') or '').encode() or os.urandom(32)
+
+# "limit" in double quotes is the column, not the clause
+_ORDER_OR_LIMIT_RE = re.compile(r'\b(order\s+by|(?<!")limit(?!")|offset|group\s+by|distinct|union)\b', re.IGNORECASE)
+_ORDER_RE = re.compile(r'\border\s+by\b', re.IGNORECASE)
+_SELECT_LIST_RE = re.compile(r'^\s*select\s+(.*?)\s+from\b', re.IGNORECASE | re.DOTALL)
+
+
+def encode_page_token(payload):
+    body = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+    signature = hmac.new(_SECRET, body.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{body}.{signature}"
+
+
+def decode_page_token(token):
+    try:
+        body, signature = token.rsplit('.', 1)
+    except (AttributeError, ValueError):
+        raise ValueError("Malformed page token")
+    expected = hmac.new(_SECRET, body.encode(), hashlib.sha256).hexdigest()[:32]
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid or expired page token")
+    return json.loads(base64.urlsafe_b64decode(body.encode()))
+
+
+# Hidden column carrying each row's ctid in keyset pages; stream_rows drops it from the output
+ROW_ID_COLUMN = 'page_row_id'
+
+_SINGLE_TABLE_RE = re.compile(r'\bfrom\s+insurance_policies\b(?!\s*,)', re.IGNORECASE)
+_JOIN_RE = re.compile(r'\bjoin\b', re.IGNORECASE)
+
+
+# Plain row listings of insurance_policies that select policy_number page by key, which stays
+# fast on deep pages. policy_number isn't unique (New, Endorsement and Renewal rows share it),
+# so the key is (policy_number, ctid). Anything ordered, limited, aggregated or joined pages by
+# offset.
+def supports_keyset(sql):
+    if _ORDER_OR_LIMIT_RE.search(sql) or _JOIN_RE.search(sql) or not _SINGLE_TABLE_RE.search(sql):
+        return False
+    match = _SELECT_LIST_RE.match(sql)
+    if not match or '(' in match.group(1):
+        return False
+    items = [item.strip().lower() for item in match.group(1).split(',')]
+    return '*' in items or 'policy_number' in items
+
+
+# Wraps generated SQL so one page (plus one look-ahead row) is read; returns (sql, params).
+# `params` are the query's own placeholder values (fast-path SQL); they go before the paging ones.
+# `after_key` is the (policy_number, ctid) of the previous page's last row.
+def page_query(sql, page_size, after_key=None, offset=0, params=None):
+    sql = sql.strip().rstrip(';')
+    keyset = supports_keyset(sql)
+    params = list(params or [])
+    if not params:
+        # The generated SQL is inlined next to our placeholders, so its own % signs (ILIKE '%x%') must be escaped
+        sql = sql.replace('%', '%%')
+    if keyset:
+        end = _SELECT_LIST_RE.match(sql).end(1)
+        sql = f"{sql[:end]}, ctid AS {ROW_ID_COLUMN}{sql[end:]}"
+        order = f"ORDER BY page.policy_number, page.{ROW_ID_COLUMN}"
+        if after_key is None:
+            return f"SELECT * FROM ({sql}) AS page {order} LIMIT %s", params + [page_size + 1]
+        policy_number, row_id = after_key
+        # The plain >= lets the policy_number index narrow the scan before the row comparison
+        return (f"SELECT * FROM ({sql}) AS page WHERE page.policy_number >= %s "
+                f"AND (page.policy_number, page.{ROW_ID_COLUMN}) > (%s, %s::tid) {order} LIMIT %s",
+                params + [policy_number, policy_number, row_id, page_size + 1])
+    # Without an ORDER BY of its own the SQL is ordered by the whole row, so every page reads
+    # the same sequence; rows that compare equal are identical, so their order can't show
+    order = '' if _ORDER_RE.search(sql) else ' ORDER BY page'
+    return f"SELECT * FROM ({sql}) AS page{order} OFFSET %s LIMIT %s", params + [offset, page_size + 1]
+
+
+# Token for the page that follows `last_row`; `columns` include ROW_ID_COLUMN on keyset pages
+def next_page_token(sql, columns, last_row, page_size, offset=0, params=None):
+    payload = {"sql": sql}
+    if params:
+        payload["params"] = list(params)
+    if supports_keyset(sql) and 'policy_number' in columns and ROW_ID_COLUMN in columns:
+        payload["after"] = [last_row[columns.index('policy_number')], last_row[columns.index(ROW_ID_COLUMN)]]
+    else:
+        payload["offset"] = offset + page_size
+    return encode_page_token(payload)
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+from sql_pipeline import enforce_limit
+
+log = logging.getLogger('sqlapp.query_guard')
+
+
+# Raised when EXPLAIN says a query is too expensive to run, even with a tighter LIMIT; the app returns a 422
+class QueryRejected(Exception):
+    def __init__(self, message, cost, rows):
+        super().__init__(message)
+        self.cost = cost
+        self.rows = rows
+
+
+# Raised when a running query was cancelled on purpose ("superseded" or "client_disconnected")
+class QueryCancelled(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Query cancelled ({reason})")
+        self.reason = reason
+
+
+class _Running:
+    def __init__(self, conn, client_disconnected):
+        self.conn = conn
+        self.client_disconnected = client_disconnected
+        self.reason = None
+        self.active = True
+
+
+# Guards the database against generated SQL:
+#
+# - admission: EXPLAIN before running; plans over `max_cost` (or estimating more than `max_rows`
+#   rows) are retried with LIMIT `auto_limit` and rejected if that doesn't bring the cost down
+#   (sorts and aggregates over the whole table). Decisions are cached per SQL + params.
+# - per-request statement_timeout, SET on the pooled connection only when it differs from the
+#   session default and RESET before the connection goes back to the pool (SET LOCAL would open
+#   a transaction and defeat prepared statements).
+# - cancellation: a newer query from the same session, or the client going away, cancels the
+#   backend query with conn.cancel() (the protocol-level pg_cancel_backend for that connection).
+class QueryGuard:
+    def __init__(self, max_cost=1_000_000, max_rows=0, auto_limit=1000, default_timeout_ms=15000,
+                 max_timeout_ms=15000, min_timeout_ms=1000, cache_size=1024, cache_ttl=300, poll_interval=0.5):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.auto_limit = auto_limit
+        self.default_timeout_ms = default_timeout_ms
+        self.max_timeout_ms = max_timeout_ms
+        self.min_timeout_ms = min_timeout_ms
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._decisions = OrderedDict()     # (sql, params, can_limit) -> (expires, None | LIMIT | QueryRejected)
+        self._latest = OrderedDict()        # session id -> ticket of its newest question
+        self._by_session = {}
+        self._watched = set()
+        self._watcher = None
+
+        self.admitted = 0
+        self.auto_limited = 0
+        self.rejected = 0
+        self.explains = 0
+        self.cancelled = {"superseded": 0, "client_disconnected": 0, "statement_timeout": 0}
+
+    @classmethod
+    def from_env(cls):
+        default_timeout = int(os.getenv('PG_STATEMENT_TIMEOUT_MS', '15000'))
+        return cls(
+            max_cost=float(os.getenv('ADMISSION_MAX_COST', '1000000')),
+            max_rows=int(os.getenv('ADMISSION_MAX_ROWS', '0')),
+            auto_limit=int(os.getenv('ADMISSION_AUTO_LIMIT', '1000')),
+            default_timeout_ms=default_timeout,
+            max_timeout_ms=int(os.getenv('ASK_STATEMENT_TIMEOUT_MS', str(default_timeout))),
+            min_timeout_ms=int(os.getenv('ASK_STATEMENT_TIMEOUT_MIN_MS', '1000')),
+            cache_size=int(os.getenv('ADMISSION_CACHE_SIZE', '1024')),
+            cache_ttl=float(os.getenv('ADMISSION_CACHE_TTL', '300'))
+        )
+
+    # statement_timeout for an /ask query: ASK_STATEMENT_TIMEOUT_MS, or less if the client asked for
+    # less, but never under ASK_STATEMENT_TIMEOUT_MIN_MS
+    def ask_timeout(self, requested_ms=None):
+        if requested_ms:
+            return min(self.max_timeout_ms, max(int(requested_ms), self.min_timeout_ms))
+        return self.max_timeout_ms
+
+    # Runs the block with statement_timeout = timeout_ms on `conn`. The SET is committed so it
+    # outlives the admission EXPLAIN's rollback, and RESET (committed) on the way out so the next
+    # borrower of the pooled connection - /kpis, the schema and version probes - gets the session
+    # default again. A connection that can't be reset is closed, which makes the pool discard it.
+    @contextmanager
+    def timeout(self, conn, timeout_ms=None):
+        timeout_ms = int(timeout_ms or self.default_timeout_ms)
+        if timeout_ms == self.default_timeout_ms:
+            yield
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout = %s", (timeout_ms,))
+            conn.commit()
+            yield
+        finally:
+            self._reset_timeout(conn)
+
+    def _reset_timeout(self, conn):
+        if conn.closed:
+            return
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("RESET statement_timeout")
+            conn.commit()
+        except Exception:
+            log.warning("[Query Guard] Could not reset statement_timeout; closing the connection", exc_info=True)
+            conn.close()
+
+    def _explain(self, conn, cur, sql, params):
+        self.explains += 1
+        cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cur.fetchone()[0][0]['Plan']
+        # Back to idle so the statement cache may still PREPARE on this connection
+        conn.rollback()
+        wanted = plan['Plans'][0] if plan['Node Type'] == 'Limit' and plan.get('Plans') else plan
+        return plan['Total Cost'], wanted['Plan Rows']
+
+    def _over(self, cost, rows):
+        return cost > self.max_cost or (self.max_rows > 0 and rows > self.max_rows)
+
+    # Returns the LIMIT to run `sql` with (None = as written) or raises QueryRejected.
+    # can_limit=False for queries that are already paged.
+    def admit(self, conn, cur, sql, params=None, can_limit=True):
+        if self.max_cost <= 0 and self.max_rows <= 0:
+            return None
+        key = (sql, tuple(params or ()), can_limit)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._decisions.get(key)
+            if cached is not None and cached[0] > now:
+                self._decisions.move_to_end(key)
+                return self._record(cached[1])
+
+        cost, rows = self._explain(conn, cur, sql, params)
+        decision = None
+        if self._over(cost, rows):
+            if can_limit and self.auto_limit > 0:
+                limited_cost, limited_rows = self._explain(conn, cur, enforce_limit(sql, self.auto_limit + 1), params)
+                if not self._over(limited_cost, limited_rows):
+                    decision = self.auto_limit
+            if decision is None:
+                decision = QueryRejected(
+                    f"Query is too expensive to run (estimated cost {cost:,.0f}, {rows:,} rows); "
+                    f"add filters or aggregate", cost, rows)
+
+        with self._lock:
+            self._decisions[key] = (now + self.cache_ttl, decision)
+            while len(self._decisions) > self.cache_size:
+                self._decisions.popitem(last=False)
+        return self._record(decision)
+
+    def _record(self, decision):
+        if isinstance(decision, QueryRejected):
+            self.rejected += 1
+            raise decision
+        if decision is None:
+            self.admitted += 1
+        else:
+            self.auto_limited += 1
+        return decision
+
+    # A new question from `session_id`: cancels the session's running query and returns the
+    # question's ticket, so an older question still waiting on Bedrock never starts its query
+    def begin(self, session_id):
+        with self._lock:
+            ticket = self._latest.pop(session_id, 0) + 1
+            self._latest[session_id] = ticket
+            while len(self._latest) > 10_000:
+                self._latest.popitem(last=False)
+            previous = self._by_session.get(session_id)
+        if previous is not None:
+            self.cancel(previous, "superseded")
+        return ticket
+
+    # Tracks a query running on `conn`. It is cancelled by a newer begin() for the same session
+    # or when client_disconnected() turns true (waitress' waitress.client_disconnected).
+    @contextmanager
+    def running(self, conn, session_id=None, ticket=None, client_disconnected=None):
+        entry = _Running(conn, client_disconnected)
+        with self._lock:
+            if session_id and ticket is not None and self._latest.get(session_id, ticket) > ticket:
+                self.cancelled["superseded"] += 1
+                raise QueryCancelled("superseded")
+            if session_id:
+                self._by_session[session_id] = entry
+            if client_disconnected is not None:
+                self._watched.add(entry)
+                self._start_watcher()
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.active = False
+                self._watched.discard(entry)
+                if session_id and self._by_session.get(session_id) is entry:
+                    del self._by_session[session_id]
+
+    def cancel(self, entry, reason):
+        with self._lock:
+            if not entry.active or entry.reason is not None:
+                return
+            entry.reason = reason
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            try:
+                entry.conn.cancel()
+            except Exception:
+                log.warning("[Query Guard] Cancel (%s) failed", reason, exc_info=True)
+
+    def record_timeout(self):
+        with self._lock:
+            self.cancelled["statement_timeout"] += 1
+
+    def _start_watcher(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name='query-cancel-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._watched)
+            for entry in watched:
+                try:
+                    gone = entry.client_disconnected()
+                except Exception:
+                    gone = False
+                if gone:
+                    self.cancel(entry, "client_disconnected")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "autoLimited": self.auto_limited,
+                "rejected": self.rejected,
+                "explains": self.explains,
+                "cachedDecisions": len(self._decisions),
+                "cancelled": dict(self.cancelled),
+                "watchingDisconnect": len(self._watched),
+                "maxCost": self.max_cost,
+                "maxRows": self.max_rows,
+                "autoLimit": self.auto_limit
+            }
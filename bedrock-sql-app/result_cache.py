@@ -0,0 +1,182 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2 import errors
+
+log = logging.getLogger('sqlapp.result_cache')
+
+_TABLE_RE = re.compile(r'\b(?:from|join)\s+"?([a-z_][\w]*)"?(?:\s*\.\s*"?([a-z_][\w]*)"?)?', re.IGNORECASE)
+_EXTRACT_RE = re.compile(r'\bextract\s*\([^)]*\)', re.IGNORECASE)
+_CTE_RE = re.compile(r'(?:\bwith(?:\s+recursive)?|,)\s*"?([a-z_][\w]*)"?\s+as\s*\(', re.IGNORECASE)
+
+
+# Table names referenced by FROM / JOIN clauses (schema prefixes and WITH query names dropped)
+def referenced_tables(sql):
+    sql = _EXTRACT_RE.sub('', sql)
+    ctes = {m.group(1).lower() for m in _CTE_RE.finditer(sql)}
+    return tuple(sorted({(m.group(2) or m.group(1)).lower() for m in _TABLE_RE.finditer(sql)} - ctes))
+
+
+# Reads a cheap per-table version number.
+#
+# Prefers the trigger-maintained `table_versions` counter (migrations/001_table_versions.sql).
+# Tables without a counter row (or without the table at all) fall back to the insert/update/
+# delete counters in pg_stat_user_tables, which are only flushed when the writing transaction
+# ends and can lag by a moment. A table neither knows (a view, another schema) gets None.
+# Probes are shared across requests for `check_interval` seconds.
+class TableVersionProbe:
+    def __init__(self, pool, check_interval=1.0):
+        self.pool = pool
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._cached = {}           # table -> (version, probed_at)
+        self._use_counter_table = True
+
+    def _probe(self, tables):
+        versions = {}
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            if self._use_counter_table:
+                try:
+                    cur.execute(
+                        "SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)",
+                        (list(tables),)
+                    )
+                    versions = dict(cur.fetchall())
+                except errors.UndefinedTable:
+                    conn.rollback()
+                    self._use_counter_table = False
+            untracked = [t for t in tables if t not in versions]
+            if untracked:
+                cur.execute(
+                    "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                    "WHERE relname = ANY(%s)",
+                    (untracked,)
+                )
+                versions.update(cur.fetchall())
+        return versions
+
+    def versions(self, tables):
+        now = time.monotonic()
+        with self._lock:
+            fresh = {t: self._cached[t][0] for t in tables
+                     if t in self._cached and now - self._cached[t][1] < self.check_interval}
+        missing = [t for t in tables if t not in fresh]
+        if missing:
+            probed = self._probe(missing)
+            with self._lock:
+                for table in missing:
+                    fresh[table] = probed.get(table)
+                    self._cached[table] = (fresh[table], now)
+        return tuple(fresh[t] for t in tables)
+
+
+# Rough in-memory footprint of a result set, used for the byte cap
+def estimate_size(columns, rows):
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(c) for c in columns)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+# Executed-SQL result cache: (sql, params) -> (columns, result).
+#
+# Each entry remembers the version of every table it read. A lookup re-probes those versions
+# and drops the entry if any table changed, so results are never served stale past one probe
+# interval. Queries reading a table without a version aren't cached, since nothing would ever
+# invalidate them. Entries are evicted least-recently-used once `max_bytes` is exceeded.
+class ResultCache:
+    def __init__(self, probe, max_bytes=64 * 1024 * 1024, max_entry_bytes=None):
+        self.probe = probe
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self._entries = OrderedDict()   # key -> (tables, versions, columns, result, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.unversioned = 0
+
+    @classmethod
+    def from_env(cls, pool):
+        probe = TableVersionProbe(pool, check_interval=float(os.getenv('RESULT_CACHE_VERSION_CHECK_INTERVAL', '1')))
+        return cls(probe, max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024)
+
+    @staticmethod
+    def _key(sql, params):
+        return (' '.join(sql.split()), tuple(params) if params else ())
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[4]
+
+    # Returns (hit, token). On a hit `hit` is (columns, *result); on a miss pass `token` to store().
+    # Versions are read before the caller executes the query, so a write that lands mid-query
+    # leaves the stored entry already out of date rather than wrongly fresh.
+    def lookup(self, sql, params=None):
+        if self.max_bytes <= 0:
+            return None, None
+        key = self._key(sql, params)
+        tables = referenced_tables(sql)
+        try:
+            versions = self.probe.versions(tables)
+        except Exception as e:
+            log.warning("[Result Cache] Version probe failed, bypassing cache: %s", e)
+            return None, None
+        if None in versions:
+            with self._lock:
+                self.unversioned += 1
+            return None, None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] == versions:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return (entry[2], *entry[3]), None
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+        return None, (key, tables, versions)
+
+    # `result` is a tuple whose first item is the row list, e.g. (rows, truncated)
+    def store(self, token, columns, result):
+        if token is None:
+            return
+        key, tables, versions = token
+        size = estimate_size(columns, result[0])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (tables, versions, columns, result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "unversioned": self.unversioned,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes
+            }
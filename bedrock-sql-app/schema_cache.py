@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger('sqlapp.schema_cache')
+
+Column = namedtuple('Column', ['name', 'data_type', 'note', 'values', 'value_range'])
+
+# Hand-written hints the catalog can't tell us. A COMMENT ON COLUMN in Postgres takes precedence.
+COLUMN_NOTES = {
+    ('insurance_policies', 'effective_date'): 'when the policy was issued',
+    ('insurance_policies', 'insured_state'): 'two-letter US state abbreviation',
+    ('insurance_policies', 'limit'): 'coverage limit in dollars',
+    ('insurance_policies', 'gross_premium'): 'total premium in dollars'
+}
+
+# Used until the first successful introspection (or when the database can't be reached)
+DEFAULT_SCHEMA = {
+    'insurance_policies': [
+        Column('policy_number', 'text', None, None, None),
+        Column('effective_date', 'date', COLUMN_NOTES[('insurance_policies', 'effective_date')], None, None),
+        Column('transaction_type', 'text', None,
+               ['New', 'Renewal', 'Endorsement', 'Reinstate', 'Cancellation', 'Audit'], None),
+        Column('insured_state', 'text', COLUMN_NOTES[('insurance_policies', 'insured_state')], None, None),
+        Column('coverage', 'text', None, None, None),
+        Column('limit', 'numeric', COLUMN_NOTES[('insurance_policies', 'limit')], None, None),
+        Column('gross_premium', 'numeric', COLUMN_NOTES[('insurance_policies', 'gross_premium')], None, None)
+    ]
+}
+
+DEFAULT_VALUES = {(table, col.name): col.values for table, cols in DEFAULT_SCHEMA.items() for col in cols if col.values}
+
+# Words Postgres won't accept as bare column names
+RESERVED_WORDS = {'limit', 'order', 'group', 'user', 'offset', 'select', 'table', 'from', 'where', 'desc', 'asc'}
+
+COLUMNS_SQL = """
+    SELECT c.table_name, c.column_name, c.data_type,
+           col_description(format('%%I.%%I', c.table_schema, c.table_name)::regclass, c.ordinal_position)
+    FROM information_schema.columns c
+    WHERE c.table_schema = %s AND c.table_name = ANY(%s)
+    ORDER BY c.table_name, c.ordinal_position
+"""
+
+# most_common_vals is anyarray; going through text gives us a plain text[] back
+STATS_SQL = """
+    SELECT tablename, attname, n_distinct,
+           most_common_vals::text::text[], histogram_bounds::text::text[]
+    FROM pg_stats
+    WHERE schemaname = %s AND tablename = ANY(%s)
+"""
+
+PROMPT_HEADER = """
+Human: You are a SQL assistant. Convert the following natural language question into a SQL query for a PostgreSQL database.
+Only return the SQL query. Do not explain anything.
+
+"""
+
+PROMPT_RULES = """
+Use '>' for above/over and '<' for below/under. Compare text columns case-insensitively with ILIKE.
+Double-quote reserved column names (e.g. "limit"). Use one line of plain PostgreSQL with no comments.
+If the question says "no filter" for a column, add no WHERE clause for it.
+Only use the listed values for columns that have them; do not invent new ones.
+
+"""
+
+
+def _quote(name):
+    return f'"{name}"' if name in RESERVED_WORDS else name
+
+
+# Columns, types and low-cardinality value sets for the tables Claude may query, read from
+# information_schema and pg_stats. The prompt prefix is rendered once per refresh so
+# build_prompt is a single string concatenation per request.
+class SchemaCache:
+    def __init__(self, pool, tables=('insurance_policies',), schema='public', refresh_interval=600.0,
+                 max_values=25):
+        self.pool = pool
+        self.tables = list(tables)
+        self.schema = schema
+        self.refresh_interval = refresh_interval
+        self.max_values = max_values
+        self.source = 'default'
+        self.loaded_at = None
+        self.last_refresh_error = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._set_tables({t: cols for t, cols in DEFAULT_SCHEMA.items() if t in self.tables})
+
+    @classmethod
+    def from_env(cls, pool):
+        tables = [t.strip() for t in os.getenv('SCHEMA_TABLES', 'insurance_policies').split(',') if t.strip()]
+        return cls(
+            pool,
+            tables=tables,
+            schema=os.getenv('SCHEMA_NAME', 'public'),
+            refresh_interval=float(os.getenv('SCHEMA_REFRESH_INTERVAL', '600')),
+            max_values=int(os.getenv('SCHEMA_MAX_VALUES', '25'))
+        )
+
+    def _set_tables(self, tables):
+        prefix = PROMPT_HEADER + self._render(tables) + PROMPT_RULES
+        # One assignment so readers never see tables and prompt from different refreshes
+        self._snapshot = (tables, prefix)
+
+    @property
+    def tables_info(self):
+        return self._snapshot[0]
+
+    @property
+    def prompt_prefix(self):
+        return self._snapshot[1]
+
+    def _render(self, tables):
+        lines = []
+        for table, columns in tables.items():
+            lines.append(f"Table {table}:")
+            for col in columns:
+                details = [col.data_type]
+                if col.note:
+                    details.append(col.note)
+                if col.values:
+                    details.append('values: ' + ', '.join(col.values))
+                elif col.value_range:
+                    details.append(f'range {col.value_range[0]} to {col.value_range[1]}')
+                lines.append(f"- {_quote(col.name)} ({'; '.join(details)})")
+            lines.append('')
+        return '\n'.join(lines)
+
+    def refresh(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(COLUMNS_SQL, (self.schema, self.tables))
+            column_rows = cur.fetchall()
+            cur.execute(STATS_SQL, (self.schema, self.tables))
+            stats_rows = cur.fetchall()
+            conn.rollback()
+
+        if not column_rows:
+            raise LookupError(f"None of the tables {self.tables} exist in schema '{self.schema}'")
+
+        stats = {(table, col): (n_distinct, common, bounds) for table, col, n_distinct, common, bounds in stats_rows}
+        tables = {}
+        for table, name, data_type, comment in column_rows:
+            n_distinct, common, bounds = stats.get((table, name), (None, None, None))
+            values = None
+            value_range = None
+            # Positive n_distinct is an absolute count; only then is most_common_vals the full value set
+            if data_type in ('text', 'character varying', 'character') and common and \
+                    n_distinct is not None and 0 < n_distinct <= self.max_values and len(common) >= n_distinct:
+                values = sorted(common)
+            elif (table, name) in DEFAULT_VALUES:
+                # Not all values are in the sample yet; keep the known list rather than none
+                values = DEFAULT_VALUES[(table, name)]
+            elif data_type in ('date', 'timestamp without time zone', 'timestamp with time zone') and bounds:
+                value_range = (bounds[0], bounds[-1])
+            note = comment or COLUMN_NOTES.get((table, name))
+            tables.setdefault(table, []).append(Column(name, data_type, note, values, value_range))
+
+        self._set_tables(tables)
+        self.source = 'introspected'
+        self.loaded_at = time.time()
+        return tables
+
+    # Loads the schema once at startup; keeps the defaults if the database isn't reachable yet
+    def load(self):
+        try:
+            self.refresh()
+            self.last_refresh_error = None
+            log.info("[Schema Cache] Loaded %d columns from %s",
+                     sum(len(c) for c in self.tables_info.values()), ', '.join(self.tables_info))
+        except Exception as e:
+            self.last_refresh_error = str(e)
+            log.warning("[Schema Cache] Introspection failed, using the built-in schema: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+                self.last_refresh_error = None
+            except Exception as e:
+                self.last_refresh_error = str(e)
+                log.warning("[Schema Cache Error] %s", e, exc_info=True)
+
+    def start(self):
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="schema-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def build_prompt(self, question):
+        return f"{self.prompt_prefix}Question: {question}\nAssistant:\n"
+
+    def stats(self):
+        tables = self.tables_info
+        return {
+            "source": self.source,
+            "tables": list(tables),
+            "columns": sum(len(c) for c in tables.values()),
+            "promptPrefixChars": len(self.prompt_prefix),
+            "loadedAt": self.loaded_at,
+            "lastRefreshError": self.last_refresh_error
+        }
@@ -0,0 +1,86 @@
+import os
+import pickle
+import tempfile
+import threading
+from itertools import islice
+
+
+# Result rows that keep the first `memory_rows` in a list and pickle the rest, a batch at a
+# time, to an anonymous temp file.
+#
+# Large /ask results then hold one batch of Python objects at a time instead of every row,
+# and the response is encoded from batches() as it is written. Reads seek to a batch's own
+# offset, so several iterators can be open at once.
+class RowSpool:
+    def __init__(self, memory_rows=2000):
+        self.memory_rows = memory_rows
+        self.head = []
+        self._file = None
+        self._batches = []          # (offset, length, row count) of each pickled batch
+        self._lock = threading.Lock()
+        self._refs = 1
+
+    @classmethod
+    def from_env(cls):
+        return cls(memory_rows=int(os.getenv('RESULT_SPILL_ROWS', '2000')))
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    # RESULT_SPILL_ROWS=0 keeps every row in memory
+    def extend(self, rows):
+        if not self.spilled:
+            room = len(rows) if self.memory_rows <= 0 else self.memory_rows - len(self.head)
+            self.head.extend(rows[:room])
+            rows = rows[room:]
+        if not rows:
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        data = pickle.dumps(list(rows), pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+            self._batches.append((offset, len(data), len(rows)))
+
+    def __len__(self):
+        return len(self.head) + sum(count for _, _, count in self._batches)
+
+    # Row lists: the in-memory rows in chunks of `size`, then each spilled batch
+    def batches(self, size=1000):
+        for start in range(0, len(self.head), size):
+            yield self.head[start:start + size]
+        for offset, length, _ in self._batches:
+            with self._lock:
+                self._file.seek(offset)
+                data = self._file.read(length)
+            yield pickle.loads(data)
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is not None and 0 <= index.stop <= len(self.head) and (index.start or 0) >= 0:
+                return self.head[index]
+            return list(islice(self, *index.indices(len(self))))
+        if 0 <= index < len(self.head):
+            return self.head[index]
+        return next(islice(self, index % len(self), None))
+
+    # One more reader (a coalesced request) that will close() it
+    def share(self):
+        with self._lock:
+            self._refs += 1
+
+    def close(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._batches = []
@@ -0,0 +1,362 @@
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+from llm import SQLEndDetector
+
+# Tables generated SQL may read; the same list the schema cache describes to Claude
+ALLOWED_TABLES = {t.strip().lower() for t in os.getenv('SCHEMA_TABLES', 'insurance_policies').split(',') if t.strip()}
+PARSE_CACHE_SIZE = int(os.getenv('SQL_PARSE_CACHE_SIZE', '1024'))
+
+# Column names Postgres only accepts double-quoted
+RESERVED_IDENTIFIERS = {'limit', 'order', 'group', 'user', 'offset', 'table', 'from', 'where', 'select', 'desc', 'asc'}
+
+# Anything that writes, locks, or changes session state
+FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter, exp.TruncateTable,
+    exp.Command, exp.Into, exp.Lock, exp.Set
+)
+FORBIDDEN_FUNCTION_PREFIXES = ('pg_', 'lo_', 'dblink')
+FORBIDDEN_FUNCTIONS = {'set_config', 'current_setting', 'query_to_xml', 'table_to_xml', 'cursor_to_xml'}
+
+# Explanations Claude sometimes appends on the line after the query
+_TRAILER_RE = re.compile(r'\n\s*(?:```|This\b|Note\b|Explanation\b|The result\b|You can use\b)', re.IGNORECASE)
+
+
+# Raised for SQL that doesn't parse or isn't a read-only SELECT on an allowed table
+class UnsafeSQL(ValueError):
+    pass
+
+
+# Cuts the SQL statement out of Claude's answer: from the first SELECT to the first semicolon
+# or blank line outside a string literal, minus any trailing commentary
+def extract_sql(text):
+    detector = SQLEndDetector()
+    end = detector.feed(text + '\n\n')
+    if detector.sql_start == -1:
+        raise ValueError("No SQL query found in response.")
+    sql = text[detector.sql_start:end]
+    sql = _TRAILER_RE.split(sql, 1)[0]
+    return sql.rstrip(';').strip('",` \n')
+
+
+def _parse(sql):
+    try:
+        statements = [s for s in sqlglot.parse(sql, read='postgres') if s is not None]
+    except ParseError as e:
+        raise UnsafeSQL(f"Generated SQL could not be parsed: {e}") from e
+    if len(statements) != 1:
+        raise UnsafeSQL("Generated SQL must be a single statement")
+    return statements[0]
+
+
+def _check_read_only(tree):
+    if not isinstance(tree, (exp.Select, exp.SetOperation)):
+        raise UnsafeSQL("Only SELECT queries are allowed")
+    forbidden = tree.find(*FORBIDDEN_NODES)
+    if forbidden is not None:
+        raise UnsafeSQL(f"{forbidden.key.upper()} is not allowed in generated SQL")
+
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if name in cte_names and not table.db:
+            continue
+        if name not in ALLOWED_TABLES or (table.db and table.db.lower() != 'public'):
+            raise UnsafeSQL(f"Table '{table.sql(dialect='postgres')}' is not queryable")
+
+    for func in tree.find_all(exp.Anonymous):
+        name = func.name.lower()
+        if name in FORBIDDEN_FUNCTIONS or name.startswith(FORBIDDEN_FUNCTION_PREFIXES):
+            raise UnsafeSQL(f"Function '{name}' is not allowed in generated SQL")
+
+
+def _quote_reserved(tree):
+    for identifier in tree.find_all(exp.Identifier):
+        if not identifier.quoted and identifier.name.lower() in RESERVED_IDENTIFIERS:
+            identifier.set('this', identifier.name.lower())
+            identifier.set('quoted', True)
+
+
+def _year_of(node):
+    # EXTRACT(YEAR FROM <column>) -> <column>
+    if isinstance(node, exp.Extract) and node.this.name.upper() == 'YEAR' and isinstance(node.expression, exp.Column):
+        return node.expression
+    return None
+
+
+def _int_literal(node):
+    if isinstance(node, exp.Literal) and re.fullmatch(r'\d{4}', node.this):
+        return int(node.this)
+    return None
+
+
+def _year_range(column, first_year, last_year):
+    column = column.sql(dialect='postgres')
+    return exp.Paren(this=sqlglot.condition(
+        f"{column} >= '{first_year}-01-01' AND {column} < '{last_year + 1}-01-01'", dialect='postgres'))
+
+
+# EXTRACT(YEAR FROM d) = 2024 can't use an index on d; the equivalent range on d can
+def _sargable_year(node):
+    if isinstance(node, exp.Between):
+        column, low, high = _year_of(node.this), _int_literal(node.args['low']), _int_literal(node.args['high'])
+        if column is not None and low is not None and high is not None:
+            return _year_range(column, low, high)
+        return node
+
+    if not isinstance(node, (exp.EQ, exp.GTE, exp.GT, exp.LT, exp.LTE)):
+        return node
+    column, year = _year_of(node.left), _int_literal(node.right)
+    if column is None or year is None:
+        return node
+    bound = column.sql(dialect='postgres')
+    if isinstance(node, exp.EQ):
+        return _year_range(column, year, year)
+    if isinstance(node, exp.GTE):
+        return sqlglot.condition(f"{bound} >= '{year}-01-01'", dialect='postgres')
+    if isinstance(node, exp.GT):
+        return sqlglot.condition(f"{bound} >= '{year + 1}-01-01'", dialect='postgres')
+    if isinstance(node, exp.LT):
+        return sqlglot.condition(f"{bound} < '{year}-01-01'", dialect='postgres')
+    return sqlglot.condition(f"{bound} < '{year + 1}-01-01'", dialect='postgres')
+
+
+# col ILIKE 'CA' without wildcards is lower(col) = lower('CA'), which the lower() B-tree
+# indexes serve; patterns with % or _ keep ILIKE (and the trigram index on coverage)
+def _plain_ilike(node):
+    if not isinstance(node, exp.ILike) or not isinstance(node.this, exp.Column):
+        return node
+    value = node.expression
+    if not isinstance(value, exp.Literal) or not value.is_string or any(c in value.this for c in '%_\\'):
+        return node
+    return exp.EQ(this=exp.Lower(this=node.this.copy()), expression=exp.Lower(this=value.copy()))
+
+
+# "since March 2024" is open-ended: keep the lower bound of an effective_date range only
+def _open_ended(node):
+    if isinstance(node, exp.Between) and isinstance(node.this, exp.Column) and node.this.name == 'effective_date':
+        return exp.GTE(this=node.this.copy(), expression=node.args['low'].copy())
+    if isinstance(node, exp.And) and isinstance(node.left, (exp.GTE, exp.GT)) and isinstance(node.right, exp.LTE):
+        lower, upper = node.left, node.right
+        if lower.left.name == upper.left.name == 'effective_date':
+            return lower.copy()
+    return node
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _prepared(sql, open_ended_from):
+    tree = _parse(sql)
+    _check_read_only(tree)
+    _quote_reserved(tree)
+    tree = tree.transform(_sargable_year)
+    tree = tree.transform(_plain_ilike)
+    if open_ended_from:
+        tree = tree.transform(_open_ended)
+    return tree, tree.sql(dialect='postgres')
+
+
+# Validates and rewrites generated SQL in one parse; the result is cached by SQL text.
+# Raises UnsafeSQL for anything that isn't a single read-only SELECT on an allowed table.
+def prepare_sql(sql, open_ended_from=False):
+    return _prepared(sql, open_ended_from)[1]
+
+
+# Adds (or tightens) the outer LIMIT so Postgres stops after `max_rows` rows
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def enforce_limit(sql, max_rows):
+    tree, text = _prepared(sql, False)
+    limit = tree.args.get('limit')
+    if limit is not None:
+        current = limit.expression
+        if isinstance(current, exp.Literal) and current.is_int and int(current.this) <= max_rows:
+            return text
+    return tree.limit(max_rows).sql(dialect='postgres')
+
+
+_BINDABLE_PARENTS = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Like, exp.ILike)
+_NAMED_PLACEHOLDER_RE = re.compile(r'%\(p(\d+)\)s')
+
+
+# Only literals compared against a bare column (or lower(value) against lower(column)) become
+# parameters, so Postgres can always infer the parameter type from the column
+def _bindable(literal):
+    parent = literal.parent
+    if isinstance(parent, exp.Lower) and isinstance(parent.parent, exp.EQ):
+        comparison = parent.parent
+        other = comparison.left if comparison.right is parent else comparison.right
+        return isinstance(other, exp.Lower) and isinstance(other.this, exp.Column)
+    if isinstance(parent, _BINDABLE_PARENTS):
+        other = parent.left if parent.right is literal else parent.right
+        return isinstance(other, exp.Column)
+    if isinstance(parent, exp.Between):
+        return literal is not parent.this and isinstance(parent.this, exp.Column)
+    if isinstance(parent, exp.In):
+        return isinstance(parent.this, exp.Column)
+    return False
+
+
+# psycopg2-style text: named markers become %s in the order they appear, any other % is doubled
+def _positional(sql, values):
+    out = []
+    params = []
+    quote = None
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            if char == quote:
+                quote = None
+            out.append('%%' if char == '%' else char)
+        elif char in ("'", '"'):
+            quote = char
+            out.append(char)
+        elif char == '%':
+            marker = _NAMED_PLACEHOLDER_RE.match(sql, i)
+            if marker:
+                params.append(values[int(marker.group(1))])
+                out.append('%s')
+                i = marker.end()
+                continue
+            out.append('%%')
+        else:
+            out.append(char)
+        i += 1
+    return ''.join(out), params
+
+
+# Moves the literals of prepared SQL into bind parameters so every question of the same shape
+# shares one query text (and one server-side prepared statement). Returns (sql, params) in
+# psycopg2 style.
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parameterize(sql):
+    tree = _parse(sql)
+    values = []
+    for literal in list(tree.find_all(exp.Literal)):
+        if _bindable(literal):
+            literal.replace(exp.Placeholder(this=f'p{len(values)}'))
+            values.append(literal.to_py())
+    text, params = _positional(tree.sql(dialect='postgres'), values)
+    return text, tuple(params)
+
+
+# One scan answering several aggregate queries; members are (query index, column names), and
+# the i-th member's columns are the next len(columns) columns of the combined row
+CombinedQuery = namedtuple('CombinedQuery', ['sql', 'params', 'members'])
+
+_CLAUSES_NOT_COMBINED = ('with_', 'joins', 'laterals', 'pivots', 'connect', 'group', 'having', 'qualify', 'order',
+                         'distinct', 'offset', 'windows', 'sample')
+
+
+# Postgres' own name for an unaliased output column
+def _output_name(expression):
+    if isinstance(expression, (exp.Alias, exp.Column)):
+        return expression.alias_or_name
+    if isinstance(expression, exp.Anonymous):
+        return expression.name.lower()
+    if isinstance(expression, exp.Func):
+        return expression.sql_name().lower()
+    return '?column?'
+
+
+# The table and WHERE condition of a query returning exactly one row of aggregates over one
+# table, or None when it has any other shape (grouping, joins, subqueries, windows, ...)
+def _aggregate_shape(tree):
+    if not isinstance(tree, exp.Select) or any(tree.args.get(clause) for clause in _CLAUSES_NOT_COMBINED):
+        return None
+    table = tree.args.get('from_')
+    table = table.this if table is not None else None
+    if not isinstance(table, exp.Table) or table.alias or table.db:
+        return None
+    limit = tree.args.get('limit')
+    if limit is not None and not (isinstance(limit.expression, exp.Literal) and limit.expression.is_int
+                                  and int(limit.expression.this) >= 1):
+        return None
+    if any(isinstance(node, exp.Select) and node is not tree for node in tree.find_all(exp.Select)):
+        return None
+    for expression in tree.expressions:
+        if isinstance(expression, exp.Star) or expression.find(exp.Window, exp.Filter) is not None:
+            return None
+        if expression.find(exp.AggFunc) is None:
+            return None
+        for column in expression.find_all(exp.Column):
+            if column.find_ancestor(exp.AggFunc) is None:
+                return None
+    where = tree.args.get('where')
+    return table.name.lower(), (where.this if where is not None else None)
+
+
+# Folds aggregate queries over the same table into one scan with FILTER clauses:
+#
+#   SELECT SUM(gross_premium) FILTER (WHERE insured_state = 'CA') AS c0,
+#          COUNT(*) FILTER (WHERE coverage = 'Cyber') AS c1
+#   FROM insurance_policies WHERE insured_state = 'CA' OR coverage = 'Cyber'
+#
+# `queries` are (sql, params) pairs: prepared SQL with literals (params None) or psycopg2 SQL
+# with %s parameters. Returns CombinedQuery items (psycopg2-style, literals bound as in
+# parameterize()) for tables with at least two combinable queries.
+def combine_aggregates(queries):
+    by_table = {}
+    for index, (sql, params) in enumerate(queries):
+        try:
+            tree = _parse(sql)
+        except UnsafeSQL:
+            continue
+        shape = _aggregate_shape(tree)
+        if shape is not None:
+            by_table.setdefault(shape[0], []).append((index, tree, shape[1], params))
+
+    combined = []
+    for table, members in by_table.items():
+        if len(members) < 2:
+            continue
+        values = []
+        expressions = []
+        conditions = []
+        outputs = []
+        for index, tree, condition, params in members:
+            # Positional %s of fast-path SQL become named placeholders so conditions can repeat
+            if params is not None:
+                placeholders = list(tree.find_all(exp.Placeholder))
+                if len(placeholders) != len(params):
+                    continue
+                for placeholder, value in zip(placeholders, params):
+                    placeholder.replace(exp.Placeholder(this=f'p{len(values)}'))
+                    values.append(value)
+                for literal in tree.find_all(exp.Literal):
+                    if literal.is_string:
+                        literal.set('this', literal.this.replace('%%', '%'))
+            columns = []
+            for expression in tree.expressions:
+                columns.append(_output_name(expression))
+                value = expression.unalias().copy()
+                if condition is not None:
+                    value = value.transform(
+                        lambda node: exp.Filter(this=node, expression=exp.Where(this=condition.copy()))
+                        if isinstance(node, exp.AggFunc) else node)
+                expressions.append(exp.alias_(value, f'c{len(expressions)}'))
+            conditions.append(condition)
+            outputs.append((index, columns))
+        if len(outputs) < 2:
+            continue
+
+        select = exp.select(*expressions).from_(table)
+        if all(condition is not None for condition in conditions):
+            select = select.where(exp.or_(*(exp.paren(condition.copy()) for condition in conditions)))
+        for literal in list(select.find_all(exp.Literal)):
+            if _bindable(literal):
+                literal.replace(exp.Placeholder(this=f'p{len(values)}'))
+                values.append(literal.to_py())
+        text, params = _positional(select.sql(dialect='postgres'), values)
+        combined.append(CombinedQuery(text, tuple(params), outputs))
+    return combined
+
+
+def parse_cache_stats():
+    prepared = _prepared.cache_info()
+    return {"hits": prepared.hits, "misses": prepared.misses, "entries": prepared.currsize}
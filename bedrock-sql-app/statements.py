@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import errors
+
+
+# Rewrites psycopg2-style SQL (%s placeholders, %% for a literal %) into PREPARE-style SQL ($1, $2, ...).
+# Returns (sql, placeholder_count).
+def to_numbered(sql):
+    out = []
+    count = 0
+    quote = None
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            if char == quote:
+                quote = None
+            elif char == '%' and sql[i + 1:i + 2] == '%':
+                i += 1
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '%':
+            following = sql[i + 1:i + 2]
+            if following == 's':
+                count += 1
+                out.append(f'${count}')
+                i += 2
+                continue
+            if following == '%':
+                i += 1
+        out.append(char)
+        i += 1
+    return ''.join(out), count
+
+
+# Server-side prepared statements, cached per connection.
+#
+# The first time a connection runs a query shape it is PREPAREd (and committed, so the pool's
+# rollback doesn't undo it); later runs send EXECUTE name(params) and Postgres reuses the plan.
+# Each connection keeps at most `max_per_connection` statements, least recently used go first.
+# Connections are held weakly, so a closed connection's cache disappears with it.
+class StatementCache:
+    def __init__(self, max_per_connection=100):
+        self.max_per_connection = max_per_connection
+        self._lock = threading.Lock()
+        self._by_conn = weakref.WeakKeyDictionary()
+        self._unpreparable = set()
+        self.prepared = 0
+        self.hits = 0
+        self.evicted = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_per_connection=int(os.getenv('PG_PREPARED_STATEMENTS', '100')))
+
+    def _statements(self, conn):
+        with self._lock:
+            statements = self._by_conn.get(conn)
+            if statements is None:
+                statements = self._by_conn[conn] = OrderedDict()
+            return statements
+
+    def _prepare(self, conn, cur, statements, sql):
+        numbered, count = to_numbered(sql)
+        name = 'stmt_' + hashlib.sha1(sql.encode()).hexdigest()[:16]
+        while len(statements) >= self.max_per_connection:
+            _, (old_name, _) = statements.popitem(last=False)
+            cur.execute(f"DEALLOCATE {old_name}")
+            conn.commit()
+            self.evicted += 1
+        try:
+            cur.execute(f"PREPARE {name} AS {numbered}")
+            conn.commit()
+        except errors.DuplicatePreparedStatement:
+            # Names come from the SQL text, so an existing statement is this same query
+            conn.rollback()
+        statements[sql] = (name, count)
+        self.prepared += 1
+        return name, count
+
+    def execute(self, conn, cur, sql, params=None):
+        # A statement prepared inside someone's open transaction would vanish on rollback
+        if self.max_per_connection <= 0 or sql in self._unpreparable or \
+                conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cur.execute(sql, params)
+            return
+
+        statements = self._statements(conn)
+        entry = statements.get(sql)
+        if entry is not None:
+            statements.move_to_end(sql)
+            self.hits += 1
+        else:
+            try:
+                entry = self._prepare(conn, cur, statements, sql)
+            except psycopg2.Error as e:
+                # Postgres couldn't type a parameter (or the SQL is invalid): run it unprepared,
+                # which either works or raises the same error a plain execute always did
+                conn.rollback()
+                self.fallbacks += 1
+                if isinstance(e, (errors.IndeterminateDatatype, errors.AmbiguousParameter)):
+                    if len(self._unpreparable) > 1024:
+                        self._unpreparable.clear()
+                    self._unpreparable.add(sql)
+                cur.execute(sql, params)
+                return
+
+        name, count = entry
+        placeholders = f"({', '.join(['%s'] * count)})" if count else ''
+        try:
+            cur.execute(f"EXECUTE {name}{placeholders}", params)
+        except errors.InvalidSqlStatementName:
+            # DISCARD ALL or a server-side reset dropped our statements; start over on this connection
+            conn.rollback()
+            statements.clear()
+            self.execute(conn, cur, sql, params)
+
+    def stats(self):
+        with self._lock:
+            connections = len(self._by_conn)
+            statements = sum(len(s) for s in self._by_conn.values())
+        return {
+            "connections": connections,
+            "statements": statements,
+            "prepared": self.prepared,
+            "hits": self.hits,
+            "evicted": self.evicted,
+            "fallbacks": self.fallbacks
+        }
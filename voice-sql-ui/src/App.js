@@ -8,11 +8,16 @@ import Loader from './components/Loader';
 import NoData from './components/NoData';
 import ResultTable from './components/ResultTable';
 // import Footer from './components/Footer';
-import { formatForChart } from './utils/formatData';
+import { formatForChart, rowsFromColumnar } from './utils/formatData';
 // import ChartToggleButtons from './components/ChartToggleButtons';
 import ChartWrapper from './components/Charts/ChartWrapper';
 import './App.css';
 
+// One id per tab (per page load): the server cancels this tab's previous /ask query when a new
+// question arrives with the same X-Session-ID
+const SESSION_ID = window.crypto?.randomUUID
+  ? window.crypto.randomUUID()
+  : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
 
 const App = () => {
   const [transcript, setTranscript] = useState('');
@@ -43,6 +48,7 @@ const App = () => {
   const recognitionRef = useRef(null);
   const stopRequestedRef = useRef(false);
   const listeningRef = useRef(false); // ✅ New ref to track listening state
+  const latestAskRef = useRef(0); // only the newest question may update the results
   const [chartType, setChartType] = useState('pie');
   const [xField, setXField] = useState('');
   const [yField, setYField] = useState('');
@@ -152,17 +158,25 @@ const App = () => {
     setFilterResults([]);
     setLoading(true);
     setErrorMessage('');
+    const askId = ++latestAskRef.current;
 
     try {
-      const response = await axios.post('http://localhost:5000/ask', { question: query });
+      // Columnar rows are smaller and cheaper for the server to encode; decoded back to objects here
+      const response = await axios.post(
+        'http://localhost:5000/ask',
+        { question: query, format: 'columnar' },
+        { headers: { 'X-Session-ID': SESSION_ID } }
+      );
+      if (askId !== latestAskRef.current) return;
       const data = response.data;
+      const rows = rowsFromColumnar(data);
 
-      if (data.error || !data.result) {
+      if (data.error || !rows) {
         throw new Error(data.error || 'Unexpected response.');
       }
 
       setSql(data.sql || '');
-      setManualQueryResults(data.result || []);
+      setManualQueryResults(rows);
       setRecordCount(data.count || 0);
       setChartType(data.chartType || 'pie');
       setXField(data.xField || '');
@@ -170,15 +184,17 @@ const App = () => {
       setErrorMessage(''); // ✅ Clear previous errors
 
       // Optional: handle empty results separately
-      if ((data.result || []).length === 0) {
+      if (rows.length === 0) {
         setErrorMessage('Sorry! We could not find any relevant data.');
       }
     } catch (error) {
+      // A newer question superseded this one (the server answers 409); its results will follow
+      if (askId !== latestAskRef.current) return;
       console.error(error);
       setManualQueryResults([]);
       setErrorMessage('Sorry, I couldn’t understand that. Please try asking a different question.');
     } finally {
-      setLoading(false);
+      if (askId === latestAskRef.current) setLoading(false);
     }
   };
 
@@ -197,10 +213,10 @@ const App = () => {
   setLoading(true);
 
   try {
-    const response = await axios.post('http://localhost:5000/filters', currentFilters);
+    const response = await axios.post('http://localhost:5000/filters', { ...currentFilters, format: 'columnar' });
     const data = response.data;
     setSql(data.sql || '');
-    setFilterResults(data.result || []);
+    setFilterResults(rowsFromColumnar(data) || []);
     setRecordCount(data.count || 0);  // 👈 Add this
   } catch (error) {
     console.error(error);
@@ -1,16 +1,25 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import './KPICards.css';
 
 const KPICards = () => {
-  // Hardcoded KPI values with types for styling
+  const [kpis, setKpis] = useState({});
+
+  // KPI values come from the precomputed store behind /kpis
+  useEffect(() => {
+    axios.get('http://localhost:5000/kpis')
+      .then((response) => setKpis(response.data || {}))
+      .catch((error) => console.error('Failed to fetch KPIs:', error));
+  }, []);
+
   const kpiItems = [
-    { label: 'GWP Issued Today', value: 251234, type: 'gwp' },
-    { label: 'GWP MTD', value: 2144578.32, type: 'gwp' },
-    { label: 'GWP YTD', value: 5638921.64, type: 'gwp' },
-    { label: 'Total Incurred', value: 2000000, type: 'totals' },
-    { label: 'Open Claims Today', value: 65873.42, type: 'claims' },
-    { label: 'Open Claims MTD', value: 214987.1, type: 'claims' },
-    { label: 'Open Claims YTD', value: 1274589.99, type: 'claims' },
+    { label: 'GWP Issued Today', value: kpis.gwpToday, type: 'gwp' },
+    { label: 'GWP MTD', value: kpis.gwpMTD, type: 'gwp' },
+    { label: 'GWP YTD', value: kpis.gwpYTD, type: 'gwp' },
+    { label: 'Total Incurred', value: kpis.totalIncurred, type: 'totals' },
+    { label: 'Open Claims Today', value: kpis.openClaimsToday, type: 'claims' },
+    { label: 'Open Claims MTD', value: kpis.openClaimsMTD, type: 'claims' },
+    { label: 'Open Claims YTD', value: kpis.openClaimsYTD, type: 'claims' },
   ];
 
   // const formatCurrency = (amount, type) => {
@@ -32,6 +41,7 @@ const KPICards = () => {
   // };
 
   const formatCurrency = (amount, type) => {
+  if (amount === null || amount === undefined) return '—';
   const num = Number(amount);
 
   if (num >= 1_000_000) {
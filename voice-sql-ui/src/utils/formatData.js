@@ -9,3 +9,10 @@ export const formatForChart = (data, xField, yField) => {
     }))
     .filter(item => item.label !== '' && !isNaN(item.value));  // Clean invalids
 };
+
+// Rows as objects from a "format": "columnar" response ({ columns, data: [[...], ...] })
+export const rowsFromColumnar = (response) => {
+  const { columns, data } = response || {};
+  if (!Array.isArray(columns) || !Array.isArray(data)) return null;
+  return data.map(values => Object.fromEntries(columns.map((col, i) => [col, values[i]])));
+};